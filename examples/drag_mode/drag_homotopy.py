@@ -281,18 +281,19 @@ if __name__=='__main__':
 
     print "setting up solver..."
     ocp.setupSolver( solverOpts=solverOptions,
-                     callback=callback )
+                     callback=callback,
+                     warmStart=True )
 
     xInit = None
     ocp.bound('gamma_homotopy',(1e-4,1e-4),force=True)
     traj = ocp.solve(xInit=xInit)
 
     ocp.bound('gamma_homotopy',(0,1),force=True)
-    traj = ocp.solve(xInit=traj.getDvs())
+    traj = ocp.solve()
 
     ocp.bound('gamma_homotopy',(1,1),force=True)
 #    ocp.bound('endTime',(3.5,6.0),force=True)
-    traj = ocp.solve(xInit=traj.getDvs())
+    traj = ocp.solve()
 
     traj.save("data/crosswind_homotopy.dat")
 
@@ -17,3 +17,4 @@
 
 from collocation import *
 import trajectory
+import sweep
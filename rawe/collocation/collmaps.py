@@ -21,6 +21,110 @@ import casadi as C
 
 from collpoints import mkCollocationPoints
 
+# index tables are the same for every map of the same ocp, so share them
+_collIndexCache = {}
+
+def collIndex(xNames,zNames,uNames,pNames,nk,nicp,deg):
+    key = (tuple(xNames),tuple(zNames),tuple(uNames),tuple(pNames),nk,nicp,deg)
+    if key not in _collIndexCache:
+        _collIndexCache[key] = CollIndex(xNames,zNames,uNames,pNames,nk,nicp,deg)
+    return _collIndexCache[key]
+
+class CollIndex(object):
+    """
+    Offsets of every (name, timestep, nicpIdx, degIdx) in the design variable vector.
+    The layout is the same as in VectorizedReadOnlyCollMap._devectorize:
+    p, then for every timestep the x (and z for degIdx != 0) at every (nicpIdx,degIdx) followed by u,
+    then the final x.
+
+    xAll is (nk+1,nicp,deg+1,nx), zAll is (nk,nicp,deg+1,nz), uAll is (nk,nu), pAll is (np,).
+    Points where a variable isn't defined (z at degIdx 0, x past nicpIdx=0,degIdx=0 at the last timestep)
+    are -1. xIdx/zIdx/uIdx/pIdx are the same tables per name.
+    """
+    def __init__(self,xNames,zNames,uNames,pNames,nk,nicp,deg):
+        ndiff = len(xNames)
+        nalg = len(zNames)
+        nu = len(uNames)
+        NP = len(pNames)
+        self.nk = nk
+        self.nicp = nicp
+        self.deg = deg
+
+        # start of every (timestep,nicpIdx,degIdx) block
+        jStart = np.array([0] + [ndiff + (j-1)*(ndiff+nalg) for j in range(1,deg+1)])
+        iSize = (deg+1)*ndiff + deg*nalg
+        kSize = nicp*iSize + nu
+        start = NP + np.arange(nk).reshape(nk,1,1)*kSize + \
+            np.arange(nicp).reshape(1,nicp,1)*iSize + jStart.reshape(1,1,deg+1)
+        self.NV = NP + nk*kSize + ndiff
+
+        self.xAll = -np.ones((nk+1,nicp,deg+1,ndiff),dtype=int)
+        self.xAll[:nk] = start.reshape(nk,nicp,deg+1,1) + np.arange(ndiff)
+        self.xAll[nk,0,0] = self.NV - ndiff + np.arange(ndiff)
+        self.zAll = -np.ones((nk,nicp,deg+1,nalg),dtype=int)
+        self.zAll[:,:,1:] = start[:,:,1:].reshape(nk,nicp,deg,1) + ndiff + np.arange(nalg)
+        self.uAll = NP + np.arange(nk).reshape(nk,1)*kSize + nicp*iSize + np.arange(nu)
+        self.pAll = np.arange(NP)
+
+        self.xIdx = dict([(name,self.xAll[:,:,:,m]) for m,name in enumerate(xNames)])
+        self.zIdx = dict([(name,self.zAll[:,:,:,m]) for m,name in enumerate(zNames)])
+        self.uIdx = dict([(name,self.uAll[:,m]) for m,name in enumerate(uNames)])
+        self.pIdx = dict([(name,int(self.pAll[m])) for m,name in enumerate(pNames)])
+
+    def kind(self,name):
+        for (kind,idx) in [('x',self.xIdx),('z',self.zIdx),('u',self.uIdx),('p',self.pIdx)]:
+            if name in idx:
+                return kind
+        return None
+
+    def offsets(self,name):
+        """
+        All the offsets of one variable, flattened
+        """
+        for idx in [self.xIdx,self.zIdx,self.uIdx,self.pIdx]:
+            if name in idx:
+                ret = np.atleast_1d(idx[name]).ravel()
+                return ret[ret >= 0]
+        raise NameError("couldn't find \""+name+"\"")
+
+    def flat(self,name,timestep=None,nicpIdx=None,degIdx=None,mapName='design var'):
+        """
+        Offset of one element, with the same argument handling as ReadOnlyCollMap.lookup
+        """
+        assert isinstance(name,str), "lookup key must be a string in "+mapName+" map"
+        if name in self.xIdx:
+            assert timestep is not None, "must give timestep for differential state lookup ("+mapName+")"
+            if nicpIdx is None:
+                nicpIdx = 0
+            if degIdx is None:
+                degIdx = 0
+            assert timestep <= self.nk, \
+                "timestep: "+str(timestep)+" out of range in "+mapName+" map (nk: "+str(self.nk)+")"
+            assert degIdx >=0 and degIdx < (self.deg+1), \
+                "degIdx: "+str(degIdx)+" out of range in "+mapName+" map (deg: "+str(self.deg)+")"
+            if timestep == self.nk:
+                assert nicpIdx==0 and degIdx==0,"last timestep is only defined at nicpIdx=0,degIdx=0"
+            return int(self.xIdx[name][timestep,nicpIdx,degIdx])
+        if name in self.zIdx:
+            assert timestep is not None, "must give timestep for algebraic state lookup ("+mapName+")"
+            if nicpIdx is None:
+                nicpIdx = 0
+            assert degIdx is not None, "must set degIdx for algebraic state map ("+mapName+")"
+            assert degIdx != 0, "algebraic variable ("+mapName+") not defined at degIdx 0"
+            assert timestep < self.nk, \
+                "timestep: "+str(timestep)+" out of range in "+mapName+" map (nk: "+str(self.nk)+")"
+            assert degIdx > 0 and degIdx <= self.deg, \
+                "degIdx: "+str(degIdx)+" out of range in "+mapName+" map (deg: "+str(self.deg)+")"
+            return int(self.zIdx[name][timestep,nicpIdx,degIdx])
+        if name in self.uIdx:
+            assert timestep is not None, "must give timestep for control input lookup ("+mapName+")"
+            assert timestep < self.nk, \
+                   "timestep: "+str(timestep)+" out of range in "+mapName+" map (nk: "+str(self.nk)+")"
+            return int(self.uIdx[name][timestep])
+        if name in self.pIdx:
+            return self.pIdx[name]
+        raise NameError("couldn't find \""+name+"\" in "+mapName+" map")
+
 class ReadOnlyCollMap(object):
     """
     A map of x/z/u/p handling number of timesteps, nicp, and deg.
@@ -39,7 +143,19 @@ class ReadOnlyCollMap(object):
 
         assert isinstance(name,str)
         self._name = name
-        
+
+        self._index = collIndex(self._xNames,self._zNames,self._uNames,self._pNames,
+                                self._nk,self._nicp,self._deg)
+        self._allocateMaps()
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        # maps pickled before the index tables existed
+        if '_index' not in state:
+            self._index = collIndex(self._xNames,self._zNames,self._uNames,self._pNames,
+                                    self._nk,self._nicp,self._deg)
+
+    def _allocateMaps(self):
         self._xMap = {}
         self._zMap = {}
         self._uMap = {}
@@ -224,6 +340,151 @@ class WriteableCollMap(ReadOnlyCollMap):
                         alphaIndex += 1
 
 
+class NumericCollMap(WriteableCollMap):
+    """
+    A WriteableCollMap of numbers stored in one float array in design variable order,
+    so "vectorize" is a copy instead of a lookup per element.
+    Each element holds "width" numbers (e.g. 2 for (lb,ub) bounds), unset elements are nan.
+    """
+    def __init__(self,ocp,name,width=1):
+        self._width = width
+        WriteableCollMap.__init__(self,ocp,name)
+
+    def _allocateMaps(self):
+        self._data = np.nan*np.ones((self._index.NV,self._width))
+        # name -> offsets, so "name in self._xMap" works the same as in the object maps
+        self._xMap = self._index.xIdx
+        self._zMap = self._index.zIdx
+        self._uMap = self._index.uIdx
+        self._pMap = self._index.pIdx
+
+    def _get(self,idx):
+        val = self._data[idx]
+        if np.isnan(val[0]):
+            return None
+        if self._width == 1:
+            return float(val[0])
+        return tuple([float(v) for v in val])
+
+    def lookup(self,name,timestep=None,nicpIdx=None,degIdx=None):
+        return self._get(self._index.flat(name,timestep,nicpIdx,degIdx,self._name))
+
+    def _lookupOrSet(self,name,timestep,nicpIdx,degIdx,setVal=None,quiet=False,force=False):
+        idx = self._index.flat(name,timestep,nicpIdx,degIdx,self._name)
+        if setVal is None:
+            return self._get(idx)
+        assert np.size(setVal) == self._width, \
+            "value for \""+name+"\" in "+self._name+" map must have "+str(self._width)+" elements"
+        oldval = self._get(idx)
+        if oldval is not None:
+            if name in self._pMap:
+                if force is False:
+                    msg = "can't change \""+name+"\" "+self._name+" once it's set unless " + \
+                        "you use force=True (tried to change "+str(oldval)+" to "+str(setVal)
+                    raise ValueError(msg)
+            elif quiet is False:
+                print "WARNING: changing \"%s\" %s at timestep %d from %s to %s" % \
+                    (name,self._name,timestep,str(oldval),str(setVal))
+        self._data[idx] = setVal
+
+    def setVals(self,name,vals,quiet=False):
+        """
+        Set a state, algebraic variable or control everywhere at once.
+        vals has the shape of the variable's index table: (nk+1,nicp,deg+1) for states,
+        (nk,nicp,deg+1) for algebraic variables, (nk,) for controls.
+        Points where the variable isn't defined are ignored.
+        """
+        for table in [self._xMap,self._zMap,self._uMap]:
+            if name in table:
+                idx = table[name]
+                break
+        else:
+            raise NameError("can't set all \""+name+"\" in "+self._name+" map, it's not x/z/u")
+        vals = np.asarray(vals,dtype=np.double)
+        assert vals.shape == idx.shape, \
+            "setVals got shape "+str(vals.shape)+" for \""+name+"\", expected "+str(idx.shape)
+        valid = idx >= 0
+        idx = idx[valid]
+        if (quiet is False) and not np.isnan(self._data[idx,0]).all():
+            print "WARNING: changing \"%s\" %s at every timestep" % (name,self._name)
+        self._data[idx,0] = vals[valid]
+
+    def setMissing(self,names,val):
+        """
+        Set every unset element of the given variables to val
+        """
+        for name in names:
+            idx = self._index.offsets(name)
+            self._data[idx[np.isnan(self._data[idx,0])]] = val
+
+    def vectorize(self):
+        """
+        Return all the variables in one array, (NV,) or (NV,width)
+        """
+        if self._width == 1:
+            return self._data[:,0].copy()
+        return self._data.copy()
+
+    def fillInMissing(self,mapName,interpFun):
+        """
+        Like WriteableCollMap.fillInMissing, but interpFun is called once per state
+        with arrays (tuples of arrays if width > 1) of all the missing points.
+        """
+        assert(isinstance(mapName, str))
+        tau_root = mkCollocationPoints(self._collPoly,self._deg)
+        isSet = np.logical_not(np.isnan(self._data[:,0]))
+
+        def firstMissing(idx):
+            missing = np.logical_not(isSet[idx])
+            if missing.any():
+                return tuple(np.argwhere(missing)[0])
+            return None
+
+        # all parameters should be set
+        for name in self._pNames:
+            if not isSet[self._pMap[name]]:
+                raise ValueError(mapName+" for parameter \""+name+"\" is not set")
+
+        # all controls should be set
+        for name in self._uNames:
+            miss = firstMissing(self._uMap[name])
+            if miss is not None:
+                raise ValueError(mapName+" for control \""+name+"\" is not set at timestep "+str(miss[0]))
+
+        # all algebraic variables should be set
+        for name in self._zNames:
+            miss = firstMissing(self._zMap[name][:,:,1:])
+            if miss is not None:
+                (k,j,d) = miss
+                raise ValueError(mapName+" for algebraic variable \""+name+"\" is not set at timestep "+str(k)+", nicpIdx: "+str(j)+", degIdx: "+str(d+1))
+
+        # states should all be set at degIdx=0, nicpIdx=0
+        # if not set in between, call interpFun
+        tau = np.arange(self._nicp).reshape(self._nicp,1) + \
+              np.array(tau_root).reshape(1,self._deg+1)/float(self._nicp)
+        def columns(vals):
+            if self._width == 1:
+                return vals[:,0]
+            return tuple(vals.T)
+        for name in self._xNames:
+            idx = self._xMap[name]
+            miss = firstMissing(idx[:,0,0])
+            if miss is not None:
+                raise ValueError(mapName+" for state \""+name+"\" is not set at timestep "+str(miss[0]))
+            block = idx[:self._nk]
+            missing = np.logical_not(isSet[block])
+            if not missing.any():
+                continue
+            (ks,js,ds) = np.nonzero(missing)
+            vals = interpFun(tau[js,ds],
+                             columns(self._data[idx[ks,0,0]]),
+                             columns(self._data[idx[ks+1,0,0]]))
+            if self._width == 1:
+                self._data[block[missing],0] = vals
+            else:
+                self._data[block[missing]] = np.column_stack(vals)
+
+
 class VectorizedReadOnlyCollMap(ReadOnlyCollMap):
     """
     A ReadOnlyCollMap meant to play more nicely with the MX class.
@@ -232,36 +493,83 @@ class VectorizedReadOnlyCollMap(ReadOnlyCollMap):
     returns the original vector instead of concatenating all the individual elements.
     This is 
     """
+    # numeric vectors are looked up through the index tables, symbolic ones through the object maps
+    _numeric = False
+
     def __init__(self,ocp,name,vec):
+        self._numeric = isinstance(vec,(np.ndarray,C.DMatrix))
         ReadOnlyCollMap.__init__(self,ocp,name)
         self._devectorize(vec)
         
+    def _allocateMaps(self):
+        if not self._numeric:
+            ReadOnlyCollMap._allocateMaps(self)
+            return
+        self._xMap = self._index.xIdx
+        self._zMap = self._index.zIdx
+        self._uMap = self._index.uIdx
+        self._pMap = self._index.pIdx
+
     def vectorize(self):
         return self._vec
+
+    def update(self,vec):
+        """
+        Copy a new numeric design vector into this map, reusing its storage
+        """
+        assert self._numeric, "only numeric maps can be updated"
+        vec = np.asarray(vec,dtype=np.double)
+        assert vec.size == self._index.NV, \
+            "design vector has "+str(vec.size)+" elements, expected "+str(self._index.NV)
+        # the first vector may belong to someone else, copy it once
+        if not getattr(self,'_ownsData',False):
+            self._data = np.array(self._data,dtype=np.double)
+            self._ownsData = True
+        self._data[...] = vec.reshape(self._data.shape)
+        self._vec = self._data
             
+    def lookup(self,name,timestep=None,nicpIdx=None,degIdx=None):
+        if not self._numeric:
+            return ReadOnlyCollMap.lookup(self,name,timestep=timestep,nicpIdx=nicpIdx,degIdx=degIdx)
+        return float(self._data.flat[self._index.flat(name,timestep,nicpIdx,degIdx,self._name)])
+
     def xVec(self,timestep,nicpIdx=None,degIdx=None):
         if nicpIdx is None:
             nicpIdx = 0
         if degIdx is None:
             degIdx = 0
+        if self._numeric:
+            return self._data[self._index.xAll[timestep,nicpIdx,degIdx]]
         return self._xVec[timestep][nicpIdx][degIdx]
     def zVec(self,timestep,nicpIdx=None,degIdx=None):
         if nicpIdx is None:
             nicpIdx = 0
         assert (degIdx is not None), "must set degIdx in zVec"
         assert (degIdx != 0), "algebraic variables not defined at tau=0"
+        if self._numeric:
+            return self._data[self._index.zAll[timestep,nicpIdx,degIdx]]
         return self._zVec[timestep][nicpIdx][degIdx]
     def uVec(self,timestep):
+        if self._numeric:
+            return self._data[self._index.uAll[timestep]]
         return self._uVec[timestep]
     def pVec(self):
+        if self._numeric:
+            return self._data[self._index.pAll]
         return self._pVec
 
     def _devectorize(self,V):
         """
         Take a vector and populate internal _{x,z,u,p}Vec, then
-        look through and call setVal so that lookup() works as normal
+        look through and call setVal so that lookup() works as normal.
+        Numeric vectors are just kept as an array and gathered from with the index tables.
         """
         self._vec = V
+        if self._numeric:
+            self._data = np.asarray(V) if isinstance(V,np.ndarray) else np.array(V)
+            assert self._data.size == self._index.NV, \
+                "design vector has "+str(self._data.size)+" elements, expected "+str(self._index.NV)
+            return
         ndiff = len(self._xNames)
         nalg = len(self._zNames)
         nu = len(self._uNames)
@@ -402,14 +710,7 @@ class OutputMap(object):
         elif type(dvs) == C.SXMatrix:
             allOutputs = outputMapGenerator.fEveryOutput.eval([dvs])
         elif type(dvs) in [np.ndarray,C.DMatrix]:
-            def scalarToFloat(val):
-                if val.size == 1:
-                    return val.item()
-                return val
-            outputMapGenerator.fEveryOutput.setInput(dvs,0)
-            outputMapGenerator.fEveryOutput.evaluate()
-            allOutputs = [scalarToFloat(np.array(outputMapGenerator.fEveryOutput.output(k)).squeeze())
-                          for k in range(outputMapGenerator.fEveryOutput.getNumOutputs())]
+            allOutputs = self._evaluate(outputMapGenerator,dvs)
         else:
             raise TypeError("OutputMap got unrecognized design vector type: "+str(type(dvs)))
 
@@ -431,7 +732,25 @@ class OutputMap(object):
         for name in self._outputNames:
             self._outputs[name] = np.resize(np.array([None]),(self._nk,self._nicp,self._deg+1))
 
-        outs = []
+        self._fill(allOutputs)
+
+    def _evaluate(self,outputMapGenerator,dvs):
+        def scalarToFloat(val):
+            if val.size == 1:
+                return val.item()
+            return val
+        outputMapGenerator.fEveryOutput.setInput(dvs,0)
+        outputMapGenerator.fEveryOutput.evaluate()
+        return [scalarToFloat(np.array(outputMapGenerator.fEveryOutput.output(k)).squeeze())
+                for k in range(outputMapGenerator.fEveryOutput.getNumOutputs())]
+
+    def update(self,outputMapGenerator,dvs):
+        """
+        Evaluate the outputs of a new numeric design vector into the existing arrays
+        """
+        self._fill(self._evaluate(outputMapGenerator,dvs))
+
+    def _fill(self,allOutputs):
         k = 0
         for timestepIdx in range(self._nk):
             for nicpIdx in range(self._nicp):
@@ -473,6 +792,23 @@ class OutputMap(object):
         else:
             return self._outputs[name][timestep][nicpIdx][degIdx]
 
+def outputMapFromArrays(nk,nicp,deg,outputNames0,outputNames,outputs0,outputs):
+    """
+    An OutputMap of already evaluated outputs (e.g. loaded from a file), no output function needed.
+    outputs0[name] is (nk,nicp,...), outputs[name] is (nk,nicp,deg+1,...) with nothing at degIdx 0.
+    """
+    ret = OutputMap.__new__(OutputMap)
+    ret._outputNames0 = list(outputNames0)
+    ret._outputNames = list(outputNames)
+    ret._numOutputs0 = len(ret._outputNames0)
+    ret._numOutputs = len(ret._outputNames)
+    ret._nk = nk
+    ret._nicp = nicp
+    ret._deg = deg
+    ret._outputs0 = dict(outputs0)
+    ret._outputs = dict(outputs)
+    return ret
+
 
 class QuadratureManager(object):
     """
@@ -561,6 +897,13 @@ class QuadratureMap(object):
         self._nicp = quadratureManager._nicp
         self._deg = quadratureManager._deg
 
+        self._quadMap = {}
+        self.update(quadratureManager,numericDvs)
+
+    def update(self,quadratureManager,numericDvs):
+        """
+        Evaluate the quadrature states of a new numeric design vector, into the existing arrays
+        """
         if hasattr(quadratureManager,'quadratureFun'):
             f = quadratureManager.quadratureFun
             f.setInput(numericDvs,0)
@@ -568,11 +911,14 @@ class QuadratureMap(object):
             allOutputs = [np.array(f.output(k)).squeeze() for k in range(f.getNumOutputs())]
 
         k = 0
-        self._quadMap = {}
         numPerState = self._nk*self._nicp*(self._deg+1) + 1
 
         for name in quadratureManager._quadratures:
-            self._quadMap[name] = np.resize(allOutputs[k:k+numPerState],(self._nk+1,self._nicp,self._deg+1))
+            vals = np.resize(allOutputs[k:k+numPerState],(self._nk+1,self._nicp,self._deg+1))
+            if name in self._quadMap:
+                self._quadMap[name][...] = vals
+            else:
+                self._quadMap[name] = vals
 #            self.quadMap[name][-1,1:,:] = None
 #            self.quadMap[name][-1,0,1:] = None
             k += numPerState
@@ -588,3 +934,14 @@ class QuadratureMap(object):
         if (timestep == -1) or (timestep == self._nk):
             assert (degIdx==0 and nicpIdx==0), "quadrature state undefined at last timestep, degIdx>0 and/or nicpIdx>0"
         return self._quadMap[name][timestep][nicpIdx][degIdx]
+
+def quadratureMapFromArrays(nk,nicp,deg,quadratures):
+    """
+    A QuadratureMap of already evaluated quadrature states, quadratures[name] is (nk+1,nicp,deg+1)
+    """
+    ret = QuadratureMap.__new__(QuadratureMap)
+    ret._nk = nk
+    ret._nicp = nicp
+    ret._deg = deg
+    ret._quadMap = dict(quadratures)
+    return ret
@@ -18,15 +18,68 @@
 import casadi as CS
 import numpy as np
 import numbers
-import pickle
-from scipy.interpolate import PiecewisePolynomial
-import sys
+import os
 
 from rawe.ocputils import Constraints,setFXOptions
 import collmaps
 from collpoints import mkCollocationPoints
 from rawe.dae import Dae
 import trajectory
+import nlpExport
+
+def _interpLinear(ts,ys,t):
+    """
+    Piecewise linear interpolation of every column of ys (len(ts),n) at times t,
+    extrapolating the first and last pieces. ts must be non-decreasing.
+    """
+    # drop the first of repeated times (interval end = next interval start)
+    keep = np.append(np.diff(ts) > 0, True)
+    ts = ts[keep]
+    ys = ys[keep]
+    if len(ts) == 1:
+        return np.repeat(ys, len(t), axis=0)
+    idx = np.clip(np.searchsorted(ts, t, side='right') - 1, 0, len(ts) - 2)
+    alpha = ((t - ts[idx])/(ts[idx+1] - ts[idx])).reshape(-1,1)
+    return ys[idx]*(1 - alpha) + ys[idx+1]*alpha
+
+# interpolation tables of saved trajectories, so homotopy restarts don't reload them
+_trajectoryFits = {}
+
+def _trajectoryFit(filename):
+    """
+    Knot times and values of every x/z/u of a saved trajectory, and the parameters.
+    Cached until the file changes.
+    """
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), stat.st_mtime, stat.st_size)
+    if key in _trajectoryFits:
+        return _trajectoryFits[key]
+
+    traj = trajectory.loadTrajectory(filename)
+    index = traj.dvMap._index
+    dvs = np.asarray(traj.getDvs(),dtype=np.double).ravel()
+    nk = traj.dvMap._nk
+    nicp = traj.dvMap._nicp
+    deg = traj.dvMap._deg
+    nx = len(traj.dvMap._xNames)
+    nz = len(traj.dvMap._zNames)
+
+    fit = {'nk':nk, 'nicp':nicp, 'tEnd':float(traj.tgrid[-1,0,0] - traj.tgrid[0,0,0])}
+    # states at every point plus the end, algebraic variables at collocation points, controls at interval starts
+    fit['x'] = (np.append(traj.tgrid[:nk].ravel(), traj.tgrid[nk,0,0]),
+                dvs[np.concatenate([index.xAll[:nk].reshape(nk*nicp*(deg+1),nx), index.xAll[nk,0,0].reshape(1,nx)])],
+                list(traj.dvMap._xNames))
+    fit['z'] = (traj.tgrid[:nk,:,1:].ravel(),
+                dvs[index.zAll[:,:,1:].reshape(nk*nicp*deg,nz)],
+                list(traj.dvMap._zNames))
+    fit['u'] = (traj.tgrid[:nk,0,0].copy(),
+                dvs[index.uAll],
+                list(traj.dvMap._uNames))
+    fit['p'] = dict([(name,float(dvs[index.pIdx[name]])) for name in traj.dvMap._pNames])
+
+    _trajectoryFits.clear()
+    _trajectoryFits[key] = fit
+    return fit
 
 class LagrangePoly(object):
     def __init__(self,deg=None,collPoly=None):
@@ -82,9 +135,9 @@ class LagrangePoly(object):
 
         return ret
 
-class BoundsMap(collmaps.WriteableCollMap):
+class BoundsMap(collmaps.NumericCollMap):
     def __init__(self,ocp,name):
-        collmaps.WriteableCollMap.__init__(self,ocp,name)
+        collmaps.NumericCollMap.__init__(self,ocp,name,width=2)
 
         # tags for the bounds
         bndtags = []
@@ -166,7 +219,7 @@ class Coll():
         self.collPoly = collPoly
 
         self._bounds = BoundsMap(self,"bounds")
-        self._guess = collmaps.WriteableCollMap(self,"guess")
+        self._guess = collmaps.NumericCollMap(self,"guess")
 
         self._constraints = Constraints()
 
@@ -213,52 +266,17 @@ class Coll():
         self.hfun.init()
 
         # add collocation constraints
-        ffcn = self._makeResidualFun()
+        (g, tags, xDotAll) = self._collocationBlock()
+        self._constraints.addBlock(g, (np.zeros(g.size()), np.zeros(g.size())), tags)
 
         ndiff = self.xSize()
-        nalg = self.zSize()
-
         self._xDot = np.resize(np.array([None]),(self.nk,self.nicp,self.deg+1))
-
-        # For all finite elements
+        offset = 0
         for k in range(self.nk):
             for i in range(self.nicp):
-                # For all collocation points
                 for j in range(1,self.deg+1):
-                    # Get an expression for the state derivative at the collocation point
-                    xp_jk = 0
-                    for j2 in range (self.deg+1):
-                        # get the time derivative of the differential states (eq 10.19b)
-                        xp_jk += self.lagrangePoly.lDotAtTauRoot[j,j2]*self.xVec(k,nicpIdx=i,degIdx=j2)
-                    self._xDot[k,i,j] = xp_jk/self.h
-                    # Add collocation equations to the NLP
-                    [fk] = ffcn.call([self._xDot[k,i,j],
-                                      self.xVec(k,nicpIdx=i,degIdx=j),
-                                      self.zVec(k,nicpIdx=i,degIdx=j),
-                                      self.uVec(k),
-                                      self.pVec()])
-
-                    # impose system dynamics (for the differential states (eq 10.19b))
-                    self.constrain(fk,'==',0,tag=("implicit dynamic equation",(k,i,j)))
-
-                # Get an expression for the state at the end of the finite element
-                xf_k = 0
-                for j in range(self.deg+1):
-                    xf_k += self.lagrangePoly.lAtOne[j]*self.xVec(k,nicpIdx=i,degIdx=j)
-#                    print "self.lagrangePoly.lAtOne["+str(j)+"]:" +str(self.lagrangePoly.lAtOne[j])
-
-#                mxfun = CS.MXFunction([self._V],[xf_k])
-#                mxfun.init()
-#                sxfun = CS.SXFunction(mxfun)
-#                sxfun.init()
-#                print ""
-#                print sxfun.outputSX()
-
-                # Add continuity equation to NLP
-                if i==self.nicp-1:
-                    self.constrain(self.xVec(k+1,nicpIdx=0,degIdx=0), '==', xf_k, tag=("continuity",(k,i)))
-                else:
-                    self.constrain(self.xVec(k,nicpIdx=i+1,degIdx=0), '==', xf_k, tag=("continuity",(k,i)))
+                    self._xDot[k,i,j] = xDotAll[offset:offset+ndiff]
+                    offset += ndiff
 
         # add outputs
         self._outputMapGenerator = collmaps.OutputMapGenerator(self, self._xDot)
@@ -279,6 +297,26 @@ class Coll():
     def constrainBnds(self,g,(lbg,ubg),tag=('unnamed_constraint',None)):
         self._constraints.addBnds(g,(lbg,ubg),tag=tag)
 
+    def setConstraintBounds(self,tagName,(lbg,ubg),tagIdx=None):
+        '''
+        Change the bounds of the constraints tagged tagName (and tagIdx), also after setupSolver.
+        Only the changed rows of the solver's lbg/ubg are touched.
+        '''
+        rows = self._constraints.setTagBounds(tagName,(lbg,ubg),tagIdx=tagIdx)
+        if hasattr(self,'solver'):
+            (lb,ub) = self._constraints.getBounds(rows)
+            lbgRef = self.solver.input('lbg')
+            ubgRef = self.solver.input('ubg')
+            for j,k in enumerate(rows):
+                lbgRef[int(k)] = lb[j]
+                ubgRef[int(k)] = ub[j]
+
+    def printConstraintSparsity(self):
+        '''
+        Jacobian nonzeros of every constraint tag, to see which ones the solver spends its time on.
+        '''
+        self._constraints.printJacobianSparsity(self._dvMap.vectorize())
+
     def xSize(self):
         return len(self.dae.xNames())
     def zSize(self):
@@ -315,127 +353,112 @@ class Coll():
 
         return ffcn
 
+    def _collocationBlock(self):
+        '''
+        All collocation and continuity equations as one SXFunction of the design vector and h,
+        called once on the MX design vector. Returns (g, tags, xDot) where g is every equation
+        (ordered per finite element: collocation points then continuity), tags has one constraint
+        tag per element of g, and xDot is the state derivative at every collocation point.
+        '''
+        ffcn = self._makeResidualFun()
+
+        # the same design var map, but with SX symbols so that slicing is free
+        sxMap = collmaps.VectorizedReadOnlyCollMap(self,"sx design var map",CS.ssym("V",self.getNV()))
+        h = CS.ssym("h")
+        ndiff = self.xSize()
+
+        gs = []
+        xDots = []
+        tags = []
+        # For all finite elements
+        for k in range(self.nk):
+            for i in range(self.nicp):
+                # For all collocation points
+                for j in range(1,self.deg+1):
+                    # Get an expression for the state derivative at the collocation point (eq 10.19b)
+                    xp_jk = 0
+                    for j2 in range (self.deg+1):
+                        xp_jk += self.lagrangePoly.lDotAtTauRoot[j,j2]*sxMap.xVec(k,nicpIdx=i,degIdx=j2)
+                    xp_jk = xp_jk/h
+                    xDots.append(xp_jk)
+                    [fk] = ffcn.eval([xp_jk,
+                                      sxMap.xVec(k,nicpIdx=i,degIdx=j),
+                                      sxMap.zVec(k,nicpIdx=i,degIdx=j),
+                                      sxMap.uVec(k),
+                                      sxMap.pVec()])
+                    # impose system dynamics (for the differential states (eq 10.19b))
+                    gs.append(fk)
+                    tags += [("implicit dynamic equation",(k,i,j),m) for m in range(fk.size())]
+
+                # Get an expression for the state at the end of the finite element
+                xf_k = 0
+                for j in range(self.deg+1):
+                    xf_k += self.lagrangePoly.lAtOne[j]*sxMap.xVec(k,nicpIdx=i,degIdx=j)
+
+                # continuity equation
+                if i==self.nicp-1:
+                    gs.append(sxMap.xVec(k+1,nicpIdx=0,degIdx=0) - xf_k)
+                else:
+                    gs.append(sxMap.xVec(k,nicpIdx=i+1,degIdx=0) - xf_k)
+                tags += [("continuity",(k,i),m) for m in range(ndiff)]
+
+        collFun = CS.SXFunction([sxMap.vectorize(),h],[CS.veccat(gs),CS.veccat(xDots)])
+        collFun.init()
+
+        if isinstance(self.h, CS.MX):
+            hMX = self.h
+        else:
+            hMX = CS.MX(float(self.h))
+        [g, xDotAll] = collFun.call([self._dvMap.vectorize(), hMX])
+        return (g, tags, xDotAll)
+
     def interpolateInitialGuess(self,filename,force=False,quiet=False,numLoops=1):
+        """
+        Set the initial guess from a saved trajectory, interpolated onto this ocp's time grid.
+        The saved trajectory is repeated numLoops times.
+        """
         print "interpolating initial guess from "+filename+" ..."
-        f=open(filename,'r')
-        traj = pickle.load(f)
-        f.close()
+        fit = _trajectoryFit(filename)
+        tEnd = fit['tEnd']
 
-        assert isinstance(traj,trajectory.Trajectory), "the file \""+filename+"\" doean't have a pickled Trajectory"
-
-        h = (traj.tgrid[-1,0,0] - traj.tgrid[0,0,0])/float(traj.dvMap._nk*traj.dvMap._nicp)
-        h *= traj.dvMap._nk*traj.dvMap._nicp/float(self.nk*self.nicp)
+        h = tEnd/float(fit['nk']*fit['nicp'])
+        h *= fit['nk']*fit['nicp']/float(self.nk*self.nicp)
         h *= numLoops
 
-        pps = {}
+        def wrap(t):
+            # periodic continuation of the saved trajectory
+            return np.where(t > tEnd, t - tEnd*np.ceil(t/tEnd - 1), t)
+
+        # the new time grid, (nk+1,nicp,deg+1)
+        t0 = wrap(h*np.arange(self.nk*self.nicp+1))
+        tau = np.array(self.lagrangePoly.tau_root)
+        tgrid = np.zeros((self.nk+1,self.nicp,self.deg+1))
+        tgrid[:self.nk] = wrap(t0[:-1].reshape(self.nk,self.nicp,1) + h*tau.reshape(1,1,self.deg+1))
+        tgrid[self.nk,0,0] = t0[-1]
+
         missing = []
-        ############# make piecewise polynomials ###########
-        # differential states
-        for name in traj.dvMap._xNames:
-            # make piecewise poly
-            pps[name] = None
-            for timestepIdx in range(traj.dvMap._nk):
-                for nicpIdx in range(traj.dvMap._nicp):
-                    ts = []
-                    ys = []
-                    for degIdx in range(traj.dvMap._deg+1):
-                        ts.append(traj.tgrid[timestepIdx,nicpIdx,degIdx])
-                        ys.append([traj.dvMap.lookup(name,timestep=timestepIdx,nicpIdx=nicpIdx,degIdx=degIdx)])
-                    if pps[name] is None:
-                        pps[name] = PiecewisePolynomial(ts,ys)
-                    else:
-                        pps[name].extend(ts,ys)
-            pps[name].extend([traj.tgrid[-1,0,0]],[[traj.dvMap.lookup(name,timestep=-1,nicpIdx=0,degIdx=0)]])
-
-        # algebraic variables
-        for name in traj.dvMap._zNames:
-            # make piecewise poly
-            pps[name] = None
-            for timestepIdx in range(traj.dvMap._nk):
-                for nicpIdx in range(traj.dvMap._nicp):
-                    ts = []
-                    ys = []
-                    for degIdx in range(1,traj.dvMap._deg+1):
-                        ts.append(traj.tgrid[timestepIdx,nicpIdx,degIdx])
-                        ys.append([traj.dvMap.lookup(name,timestep=timestepIdx,nicpIdx=nicpIdx,degIdx=degIdx)])
-                    if pps[name] is None:
-                        pps[name] = PiecewisePolynomial(ts,ys)
-                    else:
-                        pps[name].extend(ts,ys)
-
-        # controls
-        for name in traj.dvMap._uNames:
-            # make piecewise poly
-            ts = []
-            ys = []
-            for timestepIdx in range(traj.dvMap._nk):
-                ts.append(traj.tgrid[timestepIdx,0,0])
-                ys.append([traj.dvMap.lookup(name,timestep=timestepIdx)])
-            pps[name] = PiecewisePolynomial(ts,ys)
-
-        ############# interpolate ###########
-        sys.stdout.write('reticulating splines... ')
-        # interpolate differential states
-        for name in self.dae.xNames():
-            sys.stdout.write(name+' '); sys.stdout.flush()
-            if name not in pps:
-                missing.append(name)
-                continue
-            # evaluate piecewise poly to set initial guess
-            t0 = 0.0
-            for timestepIdx in range(self.nk):
-                for nicpIdx in range(self.nicp):
-                    for degIdx in range(self.deg+1):
-                        time = t0 + h*self.lagrangePoly.tau_root[degIdx]
-                        if time > traj.tgrid[-1,0,0]:
-                            time -= traj.tgrid[-1,0,0]
-                        self.guess(name,pps[name](time),timestep=timestepIdx,nicpIdx=nicpIdx,degIdx=degIdx,force=force,quiet=quiet)
-                    t0 += h
-                    if t0 > traj.tgrid[-1,0,0]:
-                        t0 -= traj.tgrid[-1,0,0]
-            self.guess(name,pps[name](t0),timestep=-1,nicpIdx=0,degIdx=0,force=force,quiet=quiet)
-
-
-        # interpolate algebraic variables
-        for name in self.dae.zNames():
-            sys.stdout.write(name+' '); sys.stdout.flush()
-            if name not in pps:
-                missing.append(name)
-                continue
-            # evaluate piecewise poly to set initial guess
-            t0 = 0.0
-            for timestepIdx in range(self.nk):
-                for nicpIdx in range(self.nicp):
-                    for degIdx in range(1,self.deg+1):
-                        time = t0 + h*self.lagrangePoly.tau_root[degIdx]
-                        if time > traj.tgrid[-1,0,0]:
-                            time -= traj.tgrid[-1,0,0]
-                        self.guess(name,pps[name](time),timestep=timestepIdx,nicpIdx=nicpIdx,degIdx=degIdx,force=force,quiet=quiet)
-                    t0 += h
-
-        # interpolate controls
-        for name in self.dae.uNames():
-            sys.stdout.write(name+' '); sys.stdout.flush()
-            if name not in pps:
-                missing.append(name)
+        for (kind,names,times) in [('x',self.dae.xNames(),tgrid),
+                                   ('z',self.dae.zNames(),tgrid[:self.nk]),
+                                   ('u',self.dae.uNames(),tgrid[:self.nk,0,0])]:
+            (ts,ys,fitNames) = fit[kind]
+            found = [name for name in names if name in fitNames]
+            missing.extend([name for name in names if name not in fitNames])
+            if len(found) == 0:
                 continue
-            # evaluate piecewise poly to set initial guess
-            t0 = 0.0
-            for timestepIdx in range(self.nk):
-                self.guess(name,pps[name](t0),timestep=timestepIdx,force=force,quiet=quiet)
-                t0 += h
+            # every variable of one kind on the whole grid at once
+            vals = _interpLinear(ts, ys[:,[fitNames.index(name) for name in found]], times.ravel())
+            for k,name in enumerate(found):
+                self._guess.setVals(name, vals[:,k].reshape(times.shape), quiet=quiet)
 
         # set parameters
         for name in self.dae.pNames():
-            sys.stdout.write(name+' '); sys.stdout.flush()
-            if name not in traj.dvMap._pNames:
+            if name not in fit['p']:
                 missing.append(name)
                 continue
             if name=='endTime':
-                self.guess(name,traj.dvMap.lookup(name)*numLoops,force=force,quiet=quiet)
+                self.guess(name,fit['p'][name]*numLoops,force=force,quiet=quiet)
             else:
-                self.guess(name,traj.dvMap.lookup(name),force=force,quiet=quiet)
-        sys.stdout.write('\n')
+                self.guess(name,fit['p'][name],force=force,quiet=quiet)
 
         msg = "finished interpolating initial guess"
         if len(missing) > 0:
@@ -444,7 +467,16 @@ class Coll():
             msg += ", all fields found"
         print msg
 
-    def setupSolver(self,solverOpts=[],constraintFunOpts=[],callback=None):
+    def setupSolver(self,solverOpts=[],constraintFunOpts=[],callback=None,warmStart=False,compileNlp=False):
+        """
+        With warmStart=True every solve after the first starts from the previous solution's
+        primal and dual (lam_x, lam_g) values, for sequences of solves like homotopies.
+        The first solve is a normal cold start. The later ones use a second solver with
+        IPOPT's warm start options added, unless they're already in solverOpts.
+
+        With compileNlp=True the nlp and its derivatives are generated as C, compiled and loaded,
+        see nlpExport. compileNlp can also be a string of CFLAGS (default '-O2 -fPIC').
+        """
         if not self.collocationIsSetup:
             raise ValueError("you forgot to call setupCollocation")
 
@@ -475,6 +507,31 @@ class Coll():
             c.init()
             solverOpts.append( ("iteration_callback", c) )
 
+        # warm start options, don't move the previous solution away from the bounds.
+        # they would spoil the cold first solve, so solve sets them on a second solver
+        self._warmStartOpts = None
+        if warmStart:
+            optNames = [name for (name,_) in solverOpts]
+            self._warmStartOpts = [(name,val) for (name,val) in
+                                   [("warm_start_init_point","yes"),
+                                    ("warm_start_bound_push",1e-9),
+                                    ("warm_start_bound_frac",1e-9),
+                                    ("warm_start_slack_bound_push",1e-9),
+                                    ("warm_start_slack_bound_frac",1e-9),
+                                    ("warm_start_mult_bound_push",1e-9)]
+                                   if name not in optNames]
+        self._warmStart = warmStart
+        self._lastSolution = None
+        self._uploadedBounds = None
+
+        # compiled nlp functions, kept here so they live as long as the solver
+        if compileNlp:
+            cflags = compileNlp if isinstance(compileNlp,str) else '-O2 -fPIC'
+            (nlp, solverOpts) = nlpExport.compileNlp(nlp, solverOpts, cflags=cflags)
+        self._compiledNlp = nlp if compileNlp else None
+        self._nlp = nlp
+        self._solverOpts = solverOpts
+
         # Allocate an NLP solver
         self.solver = CS.IpoptSolver(nlp)
 #        self.solver = CS.WorhpSolver(nlp)
@@ -499,16 +556,10 @@ class Coll():
     def solve(self,xInit=None,warnZBounds=False,warnZGuess=False):
         if not hasattr(self, 'solver'):
             raise Exception("you need to call setupSolver before you can call solve")
-        for name in self.dae.zNames():
-            for k in range(self.nk):
-                for j in range(self.nicp):
-                    for d in range(1,self.deg+1):
-                        # if algebraic states are missing from bounds, set to (-inf,inf)
-                        if self._bounds.lookup(name,timestep=k,nicpIdx=j,degIdx=d) is None:
-                            self._bounds.setVal(name,(-np.inf,np.inf),timestep=k,nicpIdx=j,degIdx=d)
-                        # if algebraic states are missing from guess, set to 0
-                        if self._guess.lookup(name,timestep=k,nicpIdx=j,degIdx=d) is None:
-                            self._guess.setVal(name,0.0,timestep=k,nicpIdx=j,degIdx=d)
+        # if algebraic states are missing from bounds, set to (-inf,inf)
+        self._bounds.setMissing(self.dae.zNames(),(-np.inf,np.inf))
+        # if algebraic states are missing from guess, set to 0
+        self._guess.setMissing(self.dae.zNames(),0.0)
 
         # fill in missing differential states and make sure everything required is set
         def linearInterpMissing(tau,val0,val1):
@@ -518,15 +569,24 @@ class Coll():
         def ceilMissing(tau,val0,val1):
             (lb0,ub0) = val0
             (lb1,ub1) = val1
-            lb = min(lb0,lb1)
-            ub = max(ub0,ub1)
+            lb = np.minimum(lb0,lb1)
+            ub = np.maximum(ub0,ub1)
             return (lb,ub)
         self._bounds.fillInMissing("bounds",ceilMissing)
 
         vars_init = self._guess.vectorize()
         vars_lbub = self._bounds.vectorize()
-        vars_lb = [lbub[0] for lbub in vars_lbub]
-        vars_ub = [lbub[1] for lbub in vars_lbub]
+        vars_lb = vars_lbub[:,0]
+        vars_ub = vars_lbub[:,1]
+
+        # warm start from the last solution
+        if self._warmStart and self._lastSolution is not None:
+            if self._warmStartOpts is not None:
+                self._setupWarmSolver()
+            (x,lam_x,lam_g) = self._lastSolution
+            vars_init = x
+            self.solver.setInput(lam_x,'lam_x0')
+            self.solver.setInput(lam_g,'lam_g0')
 
         if xInit is not None:
             vars_init = xInit
@@ -535,8 +595,7 @@ class Coll():
         self.solver.setInput(vars_init, 'x0')
 
         # Bounds on x
-        self.solver.setInput(vars_lb,'lbx')
-        self.solver.setInput(vars_ub,'ubx')
+        self._setBounds(vars_lb,vars_ub)
 
         # Solve the problem
         self.solver.solve()
@@ -546,9 +605,41 @@ class Coll():
         # Print the optimal cost
         print "optimal cost: ", float(self.solver.output('f'))
 
+        if self._warmStart:
+            self._lastSolution = (np.array(self.solver.output('x')),
+                                  np.array(self.solver.output('lam_x')),
+                                  np.array(self.solver.output('lam_g')))
+
         # Retrieve the solution
         return trajectory.TrajectoryPlotter(self,np.array(self.solver.output('x')))
 
+    def _setupWarmSolver(self):
+        # same nlp and options plus the warm start ones, takes over the current lbg/ubg
+        solver = CS.IpoptSolver(self._nlp)
+        setFXOptions(solver, self._solverOpts + self._warmStartOpts)
+        solver.init()
+        solver.setInput(np.array(self.solver.input('lbg')),'lbg')
+        solver.setInput(np.array(self.solver.input('ubg')),'ubg')
+        self.solver = solver
+        self._warmStartOpts = None
+        self._uploadedBounds = None
+
+    def _setBounds(self,lbx,ubx):
+        # only upload the bounds which changed since the last solve
+        if self._uploadedBounds is None:
+            self.solver.setInput(lbx,'lbx')
+            self.solver.setInput(ubx,'ubx')
+        else:
+            for (inputName,new,old) in zip(['lbx','ubx'],[lbx,ubx],self._uploadedBounds):
+                changed = np.nonzero(new != old)[0]
+                if len(changed) > len(new)/4:
+                    self.solver.setInput(new,inputName)
+                else:
+                    solverInput = self.solver.input(inputName)
+                    for k in changed:
+                        solverInput[int(k)] = float(new[k])
+        self._uploadedBounds = (lbx.copy(),ubx.copy())
+
     def bound(self,name,val,timestep=None,quiet=False,force=False):
         assert isinstance(name,str)
         assert isinstance(val,tuple)
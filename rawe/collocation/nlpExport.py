@@ -0,0 +1,105 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Compile an NLP and the derivative functions IPOPT uses into C.
+
+The MX NLP is expanded to SX, a throwaway IpoptSolver builds the gradient of the objective,
+the constraint jacobian and (unless using a hessian approximation) the hessian of the lagrangian,
+exactly as it would for itself. All of them are generated as C, compiled into one shared library
+each in a memoized directory (~/.rawesome), and loaded back as ExternalFunctions which are given
+to the real solver as the "grad_f", "jac_g" and "hess_lag" options.
+'''
+
+import os
+import time
+
+import casadi as CS
+
+from rawe.ocputils import setFXOptions
+from rawe.utils import codegen, subprocess_tee
+
+def makeMakefile(names, cflags):
+    libs = ' '.join([name+'.so' for name in names])
+    return """\
+CC     = gcc
+CFLAGS = %(cflags)s
+LDFLAGS = -lm
+
+.PHONY: clean all
+all : %(libs)s
+
+%%.so : %%.c
+\t@echo CC $@: $(CC) $(CFLAGS) -shared $< -o $@ $(LDFLAGS)
+\t@$(CC) $(CFLAGS) -shared $< -o $@ $(LDFLAGS)
+
+clean :
+\trm -f *.so
+""" % {'cflags':cflags, 'libs':libs}
+
+def nlpFunctions(nlp, solverOpts):
+    '''
+    Return [(name, SXFunction)] of the nlp and the derivatives IPOPT would make of it.
+    '''
+    nlpSX = CS.SXFunction(nlp)
+    nlpSX.init()
+
+    solver = CS.IpoptSolver(nlpSX)
+    setFXOptions(solver, solverOpts)
+    solver.init()
+
+    funs = [('nlp', nlpSX), ('grad_f', solver.gradF()), ('jac_g', solver.jacG())]
+    if dict(solverOpts).get('hessian_approximation', 'exact') == 'exact':
+        funs.append(('hess_lag', solver.hessLag()))
+    return funs
+
+def exportNlp(nlp, solverOpts, cflags='-O2 -fPIC'):
+    '''
+    Generate and compile the nlp functions. Returns (directory, names).
+    '''
+    funs = nlpFunctions(nlp, solverOpts)
+    genfiles = {}
+    for (name,f) in funs:
+        t0 = time.time()
+        def callme(tmpdir):
+            f.generateCode(os.path.join(tmpdir, name+'.c'))
+        genfiles[name+'.c'] = codegen.withTempdir(callme)[name+'.c']
+        print 'generated %s: %.3f s, %d bytes' % (name, time.time() - t0, len(genfiles[name+'.c']))
+    names = [name for (name,_) in funs]
+    genfiles['Makefile'] = makeMakefile(names, cflags)
+    exportpath = codegen.memoizeFiles(genfiles, prefix='coll_nlp__')
+
+    (ret, msgs) = subprocess_tee.call(['make',codegen.makeJobs()], cwd=exportpath)
+    if ret != 0:
+        raise Exception("nlp compilation failed:\n"+msgs)
+    return (exportpath, names)
+
+def compileNlp(nlp, solverOpts, cflags='-O2 -fPIC'):
+    '''
+    Returns (nlp, solverOpts) to build an IpoptSolver from, where the nlp and the
+    derivative functions are compiled ExternalFunctions. Keep them alive as long as the solver.
+    '''
+    (exportpath, names) = exportNlp(nlp, solverOpts, cflags=cflags)
+    funs = {}
+    for name in names:
+        f = CS.ExternalFunction(os.path.join(exportpath, name+'.so'))
+        f.init()
+        funs[name] = f
+    # already SX, and ExternalFunctions can't be expanded
+    opts = [(name,val) for (name,val) in solverOpts if name != 'expand']
+    opts += [(name,funs[name]) for name in names if name != 'nlp']
+    return (funs['nlp'], opts)
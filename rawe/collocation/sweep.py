@@ -0,0 +1,213 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Solve one Coll problem over a grid of parameters in a pool of processes.
+
+    def makeOcp(params):
+        # build the dae/ocp for params['wind speed'], params['endTime'], ...
+        # set bounds/guesses/objective and call setupSolver
+        return ocp
+
+    log = rawe.collocation.sweep.sweep(makeOcp, {'wind speed':[6,8,10], 'endTime':[1.5,2.0]},
+                                       'data/sweep')
+
+The first point is solved from the factory's own initial guess, every other point starts
+from the solution of its nearest (in the normalized grid) solved neighbour.
+Results are streamed into one MmapLog (rawe.utils.mmaplog) with the columns
+index, params, success, cost, solveTime and dvs (the solution design vector).
+A point whose worker dies (e.g. a segfault in the solver) or which runs longer than
+the optional timeout is recorded as failed.
+'''
+
+import os
+import signal
+import time
+import itertools
+import traceback
+import multiprocessing
+import numpy
+
+from rawe.utils.mmaplog import MmapLog, openLog
+
+# the problem factory, set before the pool forks so it doesn't have to be pickled
+_makeOcp = None
+# workers write their pid here when they start a point, so lost points can be found.
+# shared memory, a Queue's feeder thread wouldn't get it out before a segfault
+_workerPids = None
+
+def _solvePoint(args):
+    (k, params, xInit) = args
+    t0 = time.time()
+    _workerPids[k] = os.getpid()
+    try:
+        ocp = _makeOcp(params)
+        traj = ocp.solve(xInit=xInit)
+        layout = {'xNames':ocp.dae.xNames(), 'zNames':ocp.dae.zNames(),
+                  'uNames':ocp.dae.uNames(), 'pNames':ocp.dae.pNames(),
+                  'nk':ocp.nk, 'nicp':ocp.nicp, 'deg':ocp.deg, 'collPoly':ocp.collPoly}
+        return (k, True, float(ocp.solver.output('f')), numpy.array(traj.getDvs()).ravel(),
+                time.time() - t0, layout, '')
+    except Exception:
+        return (k, False, numpy.nan, None, time.time() - t0, None, traceback.format_exc())
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+def _waitAny(running, workerPids, timeout):
+    '''
+    Wait until one of running ({index:(AsyncResult, start time)}) is done and return its
+    _solvePoint result. A point whose worker died or which ran over timeout comes back
+    failed instead of hanging.
+    '''
+    while True:
+        for k,(result,t0) in running.items():
+            if result.ready():
+                return result.get()
+            pid = workerPids[k] or None
+            if pid is not None and not _alive(pid):
+                # the result can still be on its way
+                try:
+                    return result.get(1.0)
+                except multiprocessing.TimeoutError:
+                    return (k, False, numpy.nan, None, time.time() - t0, None,
+                            'worker %d died\n' % pid)
+            if timeout is not None and time.time() - t0 > timeout:
+                if pid is not None:
+                    # the pool starts a new worker in its place
+                    os.kill(pid, signal.SIGKILL)
+                return (k, False, numpy.nan, None, time.time() - t0, None,
+                        'timed out after %g s\n' % timeout)
+        time.sleep(0.05)
+
+def gridPoints(grid):
+    '''
+    dict of name: values -> (names, list of params dicts) of every combination.
+    A list of params dicts is returned as it is.
+    '''
+    if isinstance(grid, dict):
+        names = sorted(grid.keys())
+        points = [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+        return (names, points)
+    assert isinstance(grid, list) and len(grid) > 0, "grid must be a dict of name:values or a list of dicts"
+    names = sorted(grid[0].keys())
+    for point in grid:
+        assert sorted(point.keys()) == names, "every grid point must have the same names"
+    return (names, grid)
+
+def sweep(makeOcp, grid, directory, processes=None, seed=0, meta=None, timeout=None):
+    '''
+    Solve makeOcp(params) for every point of grid, processes at a time (default: cpu count).
+    makeOcp must return a Coll which is ready to solve, with the same design variables for every point.
+    seed is the index of the first point solved. timeout (seconds) fails points which take longer.
+    Returns an MmapLogReader of the results.
+    '''
+    global _makeOcp, _workerPids
+    (names, points) = gridPoints(grid)
+    n = len(points)
+    assert 0 <= seed < n, "seed must be the index of a grid point"
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if meta is None:
+        meta = {}
+
+    # normalized parameters for the nearest neighbour search
+    params = numpy.array([[float(p[name]) for name in names] for p in points])
+    scale = params.max(axis=0) - params.min(axis=0)
+    scale[scale == 0] = 1
+    X = (params - params.min(axis=0))/scale
+
+    meta = dict(meta)
+    meta['paramNames'] = names
+    meta['params'] = params.tolist()
+
+    _makeOcp = makeOcp
+    _workerPids = multiprocessing.RawArray('i', n)
+    pool = multiprocessing.Pool(processes)
+
+    pending = set(range(n))
+    running = {}
+    solved = []
+    solutions = {}
+    log = None
+    buffered = []
+    t0 = time.time()
+    try:
+        while len(pending) > 0 or len(running) > 0:
+            # hand out the points closest to something already solved
+            while len(pending) > 0 and len(running) < processes:
+                if len(solved) == 0:
+                    if len(running) > 0:
+                        # wait for the first solution
+                        break
+                    k = seed if seed in pending else min(pending)
+                    xInit = None
+                else:
+                    todo = numpy.array(sorted(pending))
+                    dists = ((X[todo][:,None,:] - X[solved][None,:,:])**2).sum(axis=2)
+                    (i,j) = numpy.unravel_index(numpy.argmin(dists), dists.shape)
+                    k = int(todo[i])
+                    xInit = solutions[solved[j]]
+                pending.remove(k)
+                running[k] = (pool.apply_async(_solvePoint, ((k, points[k], xInit),)), time.time())
+
+            (k, success, cost, dvs, solveTime, layout, err) = _waitAny(running, _workerPids, timeout)
+            del running[k]
+            if success:
+                solved.append(k)
+                solutions[k] = dvs
+                print "sweep: %d/%d %s cost: %g (%.1f s)" % \
+                    (len(solved), n, str(points[k]), cost, solveTime)
+            else:
+                print "sweep: %s failed:\n%s" % (str(points[k]), err)
+
+            row = {'index':k,
+                   'params':params[k],
+                   'success':int(success),
+                   'cost':cost,
+                   'solveTime':solveTime}
+            if dvs is not None:
+                row['dvs'] = dvs
+            buffered.append(row)
+            # the log schema needs the design vector size, so wait for a solution
+            if log is None and success:
+                meta['layout'] = layout
+                log = MmapLog(directory,
+                              fields=[('index',()), ('params',(len(names),)), ('success',()),
+                                      ('cost',()), ('solveTime',()), ('dvs',(len(dvs),))],
+                              meta=meta, chunkRows=max(1,n))
+            if log is not None:
+                for row in buffered:
+                    log.append(row)
+                buffered = []
+                log.flush()
+    finally:
+        pool.terminate()
+        pool.join()
+        _makeOcp = None
+        _workerPids = None
+        if log is not None:
+            log.close()
+
+    print "sweep: %d of %d points solved in %.1f s" % (len(solved), n, time.time() - t0)
+    if log is None:
+        raise Exception("sweep: no grid point could be solved")
+    return openLog(directory)
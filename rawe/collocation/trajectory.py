@@ -17,12 +17,49 @@
 
 import matplotlib.pyplot as plt
 import pickle
+import struct
+import json
 import numpy
 import scipy.io
 
 import casadi as C
 import collmaps
 
+# binary trajectory files are
+#   magic, uint32 version, uint32 header length, json header (padded to 8 bytes), float64 blocks
+# where the header has the names, nk/nicp/deg/collPoly, and the [name, offset, shape] of every block
+trajectoryMagic = 'RAWETRAJ'
+trajectoryFormatVersion = 1
+
+class DaeNames(object):
+    """
+    The names of a Dae, which is all the collocation maps need from it
+    """
+    def __init__(self,xNames,zNames,uNames,pNames):
+        self._xNames = list(xNames)
+        self._zNames = list(zNames)
+        self._uNames = list(uNames)
+        self._pNames = list(pNames)
+    def xNames(self):
+        return self._xNames
+    def zNames(self):
+        return self._zNames
+    def uNames(self):
+        return self._uNames
+    def pNames(self):
+        return self._pNames
+
+class CollLayout(object):
+    """
+    The dimensions of a Coll, enough to build collocation maps of a saved trajectory
+    """
+    def __init__(self,dae,nk,nicp,deg,collPoly):
+        self.dae = dae
+        self.nk = nk
+        self.nicp = nicp
+        self.deg = deg
+        self.collPoly = collPoly
+
 class Trajectory(object):
     """
     Trajectory contains x/z/u/p collmap, and output map and quadrature map.
@@ -39,18 +76,74 @@ class Trajectory(object):
         self.deg = ocp.deg
         self.collPoly = ocp.collPoly
 
-        # make time grid
+        self.tgrid = numpy.resize([],(ocp.nk+1,ocp.nicp,ocp.deg+1))
+        self._setTimeGrid(ocp,v_opt)
+
+    def _setTimeGrid(self,ocp,v_opt):
         ocp.hfun.setInput(v_opt)
         ocp.hfun.evaluate()
         h = float(ocp.hfun.output())
 
-        self.tgrid = numpy.resize([],(ocp.nk+1,ocp.nicp,ocp.deg+1))
         tf = 0.0
         for k in range(ocp.nk):
             for i in range(ocp.nicp):
                 self.tgrid[k,i,:] = tf + h*numpy.array(ocp.lagrangePoly.tau_root)
                 tf += h
         self.tgrid[ocp.nk,0,0] = tf
+        # the time series tables depend on the time grid
+        self._tables = None
+
+    def update(self,ocp,v_opt,names=None):
+        """
+        Replace the design vector with a new numeric one, reusing all the storage.
+        If names is given, outputs and quadratures are only evaluated if one of them is in names,
+        the others keep their old values.
+        """
+        self.dvMap.update(v_opt)
+        self._setTimeGrid(ocp,v_opt)
+        if names is not None:
+            names = set(names)
+        if names is None or not names.isdisjoint(self.outputMap._outputNames0+self.outputMap._outputNames):
+            self.outputMap.update(ocp._outputMapGenerator,v_opt)
+        if names is None or not names.isdisjoint(self.quadratureMap._quadMap.keys()):
+            self.quadratureMap.update(ocp._quadratureManager,v_opt)
+
+    def nodeValues(self,name,timesteps,nicpIdxs,degIdxs):
+        """
+        Values of name at every (timestep,nicpIdx,degIdx) of the index arrays, in one go.
+        Returns (values, defined), defined is False where lookup() would fail.
+        """
+        timesteps = numpy.asarray(timesteps,dtype=int)
+        nicpIdxs = numpy.asarray(nicpIdxs,dtype=int)
+        degIdxs = numpy.asarray(degIdxs,dtype=int)
+        index = self.dvMap._index
+        kind = index.kind(name)
+        if kind is not None:
+            data = numpy.asarray(self.getDvs()).ravel()
+            if kind == 'x':
+                offsets = index.xIdx[name][timesteps,nicpIdxs,degIdxs]
+            elif kind == 'z':
+                offsets = index.zIdx[name][timesteps,nicpIdxs,degIdxs]
+            elif kind == 'u':
+                offsets = index.uIdx[name][timesteps]
+            else:
+                offsets = index.pIdx[name]*numpy.ones(timesteps.shape,dtype=int)
+            return (data[offsets], offsets >= 0)
+        if name in self.outputMap._outputs or name in self.outputMap._outputs0:
+            values = numpy.empty(timesteps.shape,dtype=object)
+            defined = numpy.zeros(timesteps.shape,dtype=bool)
+            at0 = degIdxs == 0
+            if name in self.outputMap._outputs0:
+                values[at0] = self.outputMap._outputs0[name][timesteps[at0],nicpIdxs[at0]]
+                defined[at0] = True
+            if name in self.outputMap._outputs:
+                values[~at0] = self.outputMap._outputs[name][timesteps[~at0],nicpIdxs[~at0],degIdxs[~at0]]
+                defined[~at0] = True
+            return (values, defined)
+        if name in self.quadratureMap._quadMap:
+            return (self.quadratureMap._quadMap[name][timesteps,nicpIdxs,degIdxs],
+                    numpy.ones(timesteps.shape,dtype=bool))
+        raise NameError("lookup fail, unrecognized name \""+name+"\"")
 
     def getDvs(self):
         return self.dvMap.vectorize()
@@ -71,108 +164,162 @@ class Trajectory(object):
         raise NameError("lookup fail, unrecognized name \""+name+"\"")
 
     def save(self,filename):
+        """
+        Save in the binary trajectory format, load it again with loadTrajectory
+        """
         assert isinstance(filename,str), "filename must be a string"
 
         print "saving trajectory as \"%s\"" % filename
-        f=open(filename,'w')
-        pickle.dump(self,f)
+        blocks = [('dvs', numpy.asarray(self.getDvs(), dtype=numpy.double).ravel()),
+                  ('tgrid', self.tgrid)]
+        for name in self.outputMap._outputNames0:
+            blocks.append(('outputs0/'+name, self.outputMap._outputs0[name].tolist()))
+        for name in self.outputMap._outputNames:
+            # degIdx 0 is undefined, store nan there so loading is just a view
+            vals = self.outputMap._outputs[name][:,:,1:].tolist()
+            vals = numpy.asarray(vals, dtype=numpy.double)
+            blocks.append(('outputs/'+name, numpy.concatenate([numpy.nan*vals[:,:,:1], vals], axis=2)))
+        for name in sorted(self.quadratureMap._quadMap.keys()):
+            blocks.append(('quadratures/'+name, self.quadratureMap._quadMap[name]))
+        blocks = [(name, numpy.asarray(val, dtype=numpy.double)) for (name,val) in blocks]
+
+        header = {'xNames':self.dvMap._xNames,
+                  'zNames':self.dvMap._zNames,
+                  'uNames':self.dvMap._uNames,
+                  'pNames':self.dvMap._pNames,
+                  'outputNames0':self.outputMap._outputNames0,
+                  'outputNames':self.outputMap._outputNames,
+                  'quadratureNames':sorted(self.quadratureMap._quadMap.keys()),
+                  'nk':self.nk,
+                  'nicp':self.nicp,
+                  'deg':self.deg,
+                  'collPoly':self.collPoly,
+                  'blocks':[]}
+        offset = 0
+        for (name,val) in blocks:
+            header['blocks'].append([name, offset, list(val.shape)])
+            offset += val.size
+
+        headerStr = json.dumps(header)
+        # pad so that the data starts 8 byte aligned
+        headerStr += ' '*(-(len(trajectoryMagic) + 8 + len(headerStr)) % 8)
+        f=open(filename,'wb')
+        f.write(trajectoryMagic)
+        f.write(struct.pack('<II', trajectoryFormatVersion, len(headerStr)))
+        f.write(headerStr)
+        for (name,val) in blocks:
+            f.write(val.astype('<f8').tostring())
         f.close()
 
+    def __getstate__(self):
+        # the time series tables are cheap to rebuild, don't pickle them
+        state = self.__dict__.copy()
+        state.pop('_tables', None)
+        return state
+
     def saveMat(self,filename,dataname='rawesomeTrajectory'):
         assert isinstance(filename,str), "filename must be a string"
         ret = {}
-        for name in self.dvMap._xNames + \
-            self.dvMap._zNames + \
-            self.dvMap._uNames + \
-            self.outputMap._outputNames + \
-            self.quadratureMap._quadMap.keys():
-            (ts,ys) = self.getTimeSeries(name)
-            ts = numpy.array(ts)
-            ys = numpy.array(ys)
+        for name,(ts,ys) in self.getAllTimeSeries().items():
             ret[name] = {'time':ts, 'value':ys}
 
         print "saving trajectory as matlab file \"%s\"" % filename
         scipy.io.savemat(filename, {dataname:ret})
 
+    def _seriesTables(self):
+        """
+        Time grids and design vector index tables of every kind of time series, built once.
+        Every interval is followed by a nan separator so that plots aren't joined across intervals.
+        """
+        if getattr(self, '_tables', None) is not None:
+            return self._tables
+        nk = self.dvMap._nk
+        nicp = self.dvMap._nicp
+        deg = self.dvMap._deg
+        index = self.dvMap._index
+
+        def withSeparators(a, first):
+            # a is (nk,nicp,deg+1,...), keep degIdx >= first then repeat the last point as a separator
+            a = a[:nk,:,first:]
+            # explicit length, (-1,0) can't be reshaped when there are no names of a kind
+            n = nk*nicp*(deg+2-first)
+            return numpy.concatenate([a, a[:,:,-1:]], axis=2).reshape((n,)+a.shape[3:])
+        def separatorMask(first):
+            mask = numpy.zeros((nk,nicp,deg+2-first), dtype=bool)
+            mask[:,:,-1] = True
+            return mask.ravel()
+
+        tables = {}
+        # every (timestep,nicpIdx,degIdx), plus the end point
+        tables['tFull'] = withSeparators(self.tgrid, 0)
+        tables['sepFull'] = separatorMask(0)
+        tables['tFullEnd'] = numpy.append(tables['tFull'], self.tgrid[nk,0,0])
+        # only collocation points (degIdx > 0)
+        tables['tColl'] = withSeparators(self.tgrid, 1)
+        tables['sepColl'] = separatorMask(1)
+        # zero order hold controls: (t0, t1, separator at t1)
+        t0 = self.tgrid[:nk,0,0]
+        t1 = self.tgrid[1:,0,0]
+        tables['tU'] = numpy.column_stack([t0, t1, t1]).ravel()
+        tables['sepU'] = numpy.tile([False,False,True], nk)
+
+        # design vector offsets, one column per name
+        tables['x'] = numpy.concatenate([withSeparators(index.xAll, 0), index.xAll[nk,0,0].reshape(1,index.xAll.shape[3])])
+        tables['z'] = withSeparators(index.zAll, 1)
+        tables['u'] = numpy.repeat(index.uAll, 3, axis=0)
+        self._tables = tables
+        return tables
+
+    def _dvSeries(self, kind, names):
+        # one gather for all the names of one kind
+        tables = self._seriesTables()
+        dvs = numpy.asarray(self.getDvs(), dtype=numpy.double).ravel()
+        ys = dvs[tables[kind]]
+        if kind == 'x':
+            ys[:-1][tables['sepFull']] = numpy.nan
+            ts = tables['tFullEnd']
+        elif kind == 'z':
+            ys[tables['sepColl']] = numpy.nan
+            ts = tables['tColl']
+        else:
+            ys[tables['sepU']] = numpy.nan
+            ts = tables['tU']
+        allNames = {'x':self.dvMap._xNames, 'z':self.dvMap._zNames, 'u':self.dvMap._uNames}[kind]
+        return dict([(name, (ts, ys[:,allNames.index(name)])) for name in names])
+
+    def _mapSeries(self, vals, first):
+        # vals is (nk,nicp,deg+1-first,...), numeric entries at degIdx >= first
+        tables = self._seriesTables()
+        vals = numpy.asarray(vals, dtype=numpy.double)[:self.dvMap._nk]
+        n = vals.shape[0]*vals.shape[1]*(vals.shape[2]+1)
+        ys = numpy.concatenate([vals, numpy.nan*vals[:,:,-1:]], axis=2).reshape((n,)+vals.shape[3:])
+        if first == 0:
+            return (tables['tFull'], ys)
+        return (tables['tColl'], ys)
+
     def getTimeSeries(self,name):
-        # if it's a differential state
-        if name in self.dvMap._xNames:
-            ys = []
-            ts = []
-            for i in range(self.dvMap._nk):
-                for k in range(self.dvMap._nicp):
-                    for j in range(self.dvMap._deg+1):
-                        ys.append(self.dvMap.lookup(name,timestep=i,nicpIdx=k,degIdx=j))
-                        ts.append(self.tgrid[i,k,j])
-                    ys.append(numpy.nan*ys[-1])
-                    ts.append(ts[-1])
-            ys.append(self.dvMap.lookup(name,timestep=-1,nicpIdx=0,degIdx=0))
-            ts.append(self.tgrid[-1,0,0])
-            return (ts,ys)
-
-        # if it's an algebraic var
-        elif name in self.dvMap._zNames:
-            ys = []
-            ts = []
-            for i in range(self.dvMap._nk):
-                for k in range(self.dvMap._nicp):
-                    for j in range(1,self.dvMap._deg+1):
-                        ys.append(self.dvMap.lookup(name,timestep=i,nicpIdx=k,degIdx=j))
-                        ts.append(self.tgrid[i,k,j])
-                    ys.append(numpy.nan*ys[-1])
-                    ts.append(ts[-1])
-            return (ts,ys)
-
-        # if it's a control
-        elif name in self.dvMap._uNames:
-            ys = []
-            ts = []
-            for i in range(self.dvMap._nk):
-                y = self.dvMap.lookup(name,timestep=i)
-                t0 = self.tgrid[i,0,0]
-                t1 = self.tgrid[i+1,0,0]
-                ys.extend([y,y,numpy.nan*y])
-                ts.extend([t0,t1,t1])
-            return (ts,ys)
+        """
+        Return (times, values) arrays of a state, algebraic variable, control, output or quadrature state.
+        Intervals are separated by nans.
+        """
+        # design variables
+        for kind,names in [('x',self.dvMap._xNames), ('z',self.dvMap._zNames), ('u',self.dvMap._uNames)]:
+            if name in names:
+                return self._dvSeries(kind, [name])[name]
 
         # if it's an output defined everywhere
-        elif name in self.outputMap._outputs0:
-            ys = []
-            ts = []
-            for i in range(self.dvMap._nk):
-                for k in range(self.dvMap._nicp):
-                    for j in range(self.dvMap._deg+1):
-                        ys.append(self.outputMap.lookup(name,timestep=i,nicpIdx=k,degIdx=j))
-                        ts.append(self.tgrid[i,k,j])
-                    ys.append(numpy.nan*ys[-1])
-                    ts.append(ts[-1])
-            return (ts, ys)
+        if name in self.outputMap._outputs0:
+            vals = self.outputMap._outputs[name].copy()
+            vals[:,:,0] = self.outputMap._outputs0[name]
+            return self._mapSeries(vals.tolist(), 0)
 
         # if it's an output defined only on collocation points
         elif name in self.outputMap._outputs:
-            ys = []
-            ts = []
-            for i in range(self.dvMap._nk):
-                for k in range(self.dvMap._nicp):
-                    for j in range(1,self.dvMap._deg+1):
-                        ys.append(self.outputMap.lookup(name,timestep=i,nicpIdx=k,degIdx=j))
-                        ts.append(self.tgrid[i,k,j])
-                    ys.append(numpy.nan*ys[-1])
-                    ts.append(ts[-1])
-            return (ts, ys)
+            return self._mapSeries(self.outputMap._outputs[name][:,:,1:].tolist(), 1)
 
         # if it's a quadrature state
         elif name in self.quadratureMap._quadMap:
-            ys = []
-            ts = []
-            for i in range(self.quadratureMap._nk):
-                for k in range(self.quadratureMap._nicp):
-                    for j in range(self.quadratureMap._deg+1):
-                        ys.append(self.quadratureMap.lookup(name,timestep=i,nicpIdx=k,degIdx=j))
-                        ts.append(self.tgrid[i,k,j])
-                    ys.append(numpy.nan*ys[-1])
-                    ts.append(ts[-1])
-            return (ts, ys)
+            return self._mapSeries(self.quadratureMap._quadMap[name], 0)
 
         # throw error on parameter
         elif name in self.dvMap._pNames:
@@ -182,6 +329,74 @@ class Trajectory(object):
         else:
             raise Exception("unrecognized name \""+name+"\"")
 
+    def getAllTimeSeries(self):
+        """
+        dict of name: (times, values) for every state, algebraic variable, control, output and quadrature state
+        """
+        ret = {}
+        ret.update(self._dvSeries('x', self.dvMap._xNames))
+        ret.update(self._dvSeries('z', self.dvMap._zNames))
+        ret.update(self._dvSeries('u', self.dvMap._uNames))
+        for name in self.outputMap._outputNames + self.quadratureMap._quadMap.keys():
+            ret[name] = self.getTimeSeries(name)
+        return ret
+
+
+def loadTrajectory(filename, mmap=True):
+    """
+    Load a trajectory written by Trajectory.save without evaluating any CasADi functions.
+    With mmap=True the values are read-only views of the memory mapped file, only read when used.
+    Files which aren't in the binary format are unpickled (old Trajectory.save).
+    """
+    f=open(filename,'rb')
+    magic = f.read(len(trajectoryMagic))
+    if magic != trajectoryMagic:
+        f.seek(0)
+        traj = pickle.load(f)
+        f.close()
+        assert isinstance(traj,Trajectory), "the file \""+filename+"\" doesn't have a Trajectory"
+        return traj
+    (version, headerLength) = struct.unpack('<II', f.read(8))
+    if version != trajectoryFormatVersion:
+        f.close()
+        raise Exception("trajectory file \""+filename+"\" has format version "+str(version)+
+                        ", expected "+str(trajectoryFormatVersion))
+    header = json.loads(f.read(headerLength))
+    dataOffset = f.tell()
+    if mmap:
+        data = numpy.memmap(f, dtype='<f8', mode='r', offset=dataOffset)
+    else:
+        data = numpy.fromfile(f, dtype='<f8')
+    f.close()
+
+    blocks = {}
+    for (name, offset, shape) in header['blocks']:
+        size = int(numpy.prod(shape))
+        blocks[str(name)] = data[offset:offset+size].reshape(shape)
+
+    def names(key):
+        return [str(name) for name in header[key]]
+    nk = header['nk']
+    nicp = header['nicp']
+    deg = header['deg']
+    layout = CollLayout(DaeNames(names('xNames'),names('zNames'),names('uNames'),names('pNames')),
+                        nk, nicp, deg, str(header['collPoly']))
+
+    traj = TrajectoryPlotter.__new__(TrajectoryPlotter)
+    traj.dvMap = collmaps.VectorizedReadOnlyCollMap(layout,'devectorized design vars',
+                                                     blocks['dvs'].reshape(-1,1))
+    traj.outputMap = collmaps.outputMapFromArrays(nk, nicp, deg,
+                                                  names('outputNames0'), names('outputNames'),
+                                                  dict([(name, blocks['outputs0/'+name]) for name in names('outputNames0')]),
+                                                  dict([(name, blocks['outputs/'+name]) for name in names('outputNames')]))
+    traj.quadratureMap = collmaps.quadratureMapFromArrays(nk, nicp, deg,
+                                                          dict([(name, blocks['quadratures/'+name]) for name in names('quadratureNames')]))
+    traj.nk = nk
+    traj.nicp = nicp
+    traj.deg = deg
+    traj.collPoly = layout.collPoly
+    traj.tgrid = blocks['tgrid']
+    return traj
 
 # thing which facilitates plotting
 class TrajectoryPlotter(Trajectory):
@@ -15,15 +15,42 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
 
-import pickle
+import os
+import sys
 import matplotlib.pyplot as plt
 
+from utils.mmaplog import openLog
+from collocation.trajectory import loadTrajectory
+
+def plotLog(directory, names, when=0):
+    '''
+    Plot states/controls/outputs from a log written by OcpRT.logToFile or Sim.logToFile.
+    The columns are memory mapped, nothing is read until it is plotted.
+    '''
+    log = openLog(directory)
+    print "differential states: "+str(log.meta.get('xNames'))
+    print "actions:             "+str(log.meta.get('uNames'))
+    print "outputs:             "+str(log.meta.get('outputNames'))
+    print str(len(log))+" records"
+
+    for name in names:
+        plt.figure()
+        (ts, ys) = log.timeSeries(name, when=when)
+        plt.plot(ts, ys)
+        plt.title(name)
+        plt.xlabel('time [s]')
+        plt.grid()
+
 if __name__=='__main__':
+    if len(sys.argv) > 1 and os.path.isdir(sys.argv[1]):
+        # python load_and_plot.py some_log_directory name1 name2 ...
+        plotLog(sys.argv[1], sys.argv[2:])
+        plt.show()
+        sys.exit(0)
+
     filename = "data/crosswind_opt.dat"
     
-    f=open(filename,'r')
-    traj = pickle.load(f)
-    f.close()
+    traj = loadTrajectory(filename)
 
     print "differential states: "+str(traj.xNames)
     print "algebraic states:    "+str(traj.zNames)
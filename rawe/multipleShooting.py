@@ -67,26 +67,60 @@ class MultipleShootingStage():
     def nParams(self):
         return self.dae.pVec().size()
 
-    def setIdasIntegrator(self, integratorOptions=[]):
+    def setIdasIntegrator(self, integratorOptions=[], parallelization=None):
+        '''
+        parallelization=None makes one integrator call per shooting interval.
+        "serial" or "openmp" puts all of the intervals in one Parallelizer, which
+        evaluates the integrations and their forward/adjoint sensitivities
+        one after another or across openmp threads (OMP_NUM_THREADS).
+        '''
+        if parallelization not in [None,'serial','openmp']:
+            raise ValueError('parallelization must be None, "serial" or "openmp", got '+str(parallelization))
         # make dae input fun
         daeSXFun = self.dae.sxFun()
         assert self.nStates()==daeSXFun.inputSX(C.DAE_X).size()
         assert self.nActions()+self.nParams()==daeSXFun.inputSX(C.DAE_P).size()
 
+        def mkIntegrator():
+            integrator = C.IdasIntegrator(daeSXFun)
+            setFXOptions(integrator, integratorOptions)
+            integrator.init()
+            return integrator
+
         # make integrator
-        self.integrator = C.IdasIntegrator(daeSXFun)
-        setFXOptions(self.integrator, integratorOptions)
-        self.integrator.init()
+        self.integrator = mkIntegrator()
+        self.parallelization = parallelization
 
-        # set up dynamics constraints
+        xus = []
         for k in range(0,self.nSteps-1):
             uk   = self.actions[:,k]
-            ukp1 = self.actions[:,k+1]
             xk   = self.states[:,k]
-            xkp1 = self.states[:,k+1]
             p = self.params
-            upk = C.veccat([uk,p])
-            self.addConstraint(self.integrator.call([xk,upk])[C.INTEGRATOR_XF],'==',xkp1)
+            xus.append((xk, C.veccat([uk,p])))
+
+        # set up dynamics constraints
+        if parallelization is None or len(xus) == 0:
+            xfs = [self.integrator.call([xk,upk])[C.INTEGRATOR_XF] for (xk,upk) in xus]
+        else:
+            # every interval gets its own integrator so the threads don't share IDAS memory
+            integrators = [self.integrator] + [mkIntegrator() for k in range(1,len(xus))]
+            self._parallelizer = C.Parallelizer(integrators)
+            self._parallelizer.setOption("parallelization",parallelization)
+            self._parallelizer.init()
+
+            nIn  = self.integrator.getNumInputs()
+            nOut = self.integrator.getNumOutputs()
+            args = []
+            for (xk,upk) in xus:
+                arg = [C.MX() for j in range(nIn)]
+                arg[C.INTEGRATOR_X0] = xk
+                arg[C.INTEGRATOR_P] = upk
+                args += arg
+            outs = self._parallelizer.call(args)
+            xfs = [outs[k*nOut + C.INTEGRATOR_XF] for k in range(len(xus))]
+
+        for k,xf in enumerate(xfs):
+            self.addConstraint(xf,'==',self.states[:,k+1])
 
     # constraints
     def addConstraint(self,lhs,comparison,rhs,tag='unnamed_constraint'):
@@ -124,6 +158,15 @@ class MultipleShootingStage():
             raise ValueError("You've already set an objective and you can't change it")
         self._objective = objective
         
+    def constraintFun(self, constraintFunOptions=[]):
+        '''
+        The initialized MXFunction dvs -> g which the solver gets.
+        '''
+        g = C.MXFunction([self.getDesignVars()], [self._constraints.getG()])
+        setFXOptions(g, constraintFunOptions)
+        g.init()
+        return g
+
     def setSolver(self, solver, solverOptions=[], objFunOptions=[], constraintFunOptions=[]):
         if hasattr(self, '_solver'):
             raise ValueError("You've already set a solver and you can't change it")
@@ -136,39 +179,9 @@ class MultipleShootingStage():
         f.init()
 
         # make constraint function
-        g = C.MXFunction([self.getDesignVars()], [self._constraints.getG()])
-        setFXOptions(g, constraintFunOptions)
-        g.init()
-
-        def mkParallelG():
-            gs = [C.MXFunction([self.getDesignVars()],[gg]) for gg in self._constraints._g]
-            for gg in gs:
-                gg.init()
-            
-            pg = C.Parallelizer(gs)
-#            pg.setOption("parallelization","openmp")
-            pg.setOption("parallelization","serial")
-#            pg.setOption("parallelization","expand")
-            pg.init()
-    
-            dvsDummy = C.msym('dvs',(self.nStates()+self.nActions())*self.nSteps+self.nParams())
-            g_ = C.MXFunction([dvsDummy],[C.veccat(pg.call([dvsDummy]*len(gs)))])
-            g_.init()
-            return g_
-
-#        parallelG = mkParallelG()
-#        guess = self._initialGuess.vectorize()
-#        parallelG.setInput([x*1.1 for x in guess])
-#        g.setInput([x*1.1 for x in guess])
-#    
-#        g.evaluate()
-#        parallelG.evaluate()
-    
-#        print parallelG.output()-g.output()
-#        exit(0)
+        g = self.constraintFun(constraintFunOptions)
 
         # make solver function
-        # self._solver = solver(f, mkParallelG())
         self._solver = solver(f, g)
         setFXOptions(self._solver, solverOptions)
         self._solver.init()
@@ -0,0 +1,222 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Closed loop MHE + MPC + plant benchmark.
+
+Every cycle runs MHE preparation/feedback, MPC preparation/feedback, one plant step,
+log() and shift(), and times each of them. Reports p50/p95/p99/max per phase.
+
+usage: python -m rawe.ocp.benchmark --cycles 1000 --plant rtintegrator --json bench.json
+'''
+
+import sys
+import time
+import json
+import platform
+import numpy
+
+import casadi as C
+
+import rawe
+from Ocp import OcpExportOptions,Mhe,Mpc
+from ocprt import MheRT,MpcRT
+from ..rtIntegrator import RtIntegratorOptions
+from ..utils.instrumentation import monotonic
+
+def doubleIntegrator():
+    dae = rawe.dae.Dae()
+    [x,v] = dae.addX(['x','v'])
+    [u] = dae.addU(['u'])
+    dae.setResidual([dae.ddt('x') - v,
+                     dae.ddt('v') - u])
+    x0 = numpy.array([1.0, 0.0])
+    return (dae, x0)
+
+# dae factories with no free parameters, returning (dae, initial state)
+models = {'double_integrator':doubleIntegrator}
+
+def defaultIntegratorOptions():
+    intOpts = RtIntegratorOptions()
+    intOpts['INTEGRATOR_TYPE'] = 'INT_IRK_GL2'
+    intOpts['NUM_INTEGRATOR_STEPS'] = 40
+    intOpts['IMPLICIT_INTEGRATOR_NUM_ITS'] = 3
+    intOpts['IMPLICIT_INTEGRATOR_NUM_ITS_INIT'] = 0
+    intOpts['LINEAR_ALGEBRA_SOLVER'] = 'HOUSEHOLDER_QR'
+    intOpts['UNROLL_LINEAR_SOLVER'] = False
+    intOpts['IMPLICIT_INTEGRATOR_MODE'] = 'IFTR'
+    return intOpts
+
+def defaultOcpOptions(fixInitialState):
+    ocpOpts = OcpExportOptions()
+    ocpOpts['HESSIAN_APPROXIMATION'] = 'GAUSS_NEWTON'
+    ocpOpts['DISCRETIZATION_TYPE'] = 'MULTIPLE_SHOOTING'
+    ocpOpts['QP_SOLVER'] = 'QP_QPOASES'
+    ocpOpts['HOTSTART_QP'] = False
+    ocpOpts['SPARSE_QP_SOLUTION'] = 'CONDENSING'
+    ocpOpts['FIX_INITIAL_STATE'] = fixInitialState
+    return ocpOpts
+
+def percentiles(samples):
+    '''
+    Summary of a list of durations in seconds, in microseconds.
+    '''
+    s = numpy.array(samples)*1e6
+    if s.size == 0:
+        return {'count':0}
+    return {'count':int(s.size),
+            'mean':float(numpy.mean(s)),
+            'p50':float(numpy.percentile(s, 50)),
+            'p95':float(numpy.percentile(s, 95)),
+            'p99':float(numpy.percentile(s, 99)),
+            'max':float(numpy.max(s))}
+
+class Timings(object):
+    def __init__(self):
+        self.samples = {}
+        self._order = []
+
+    def time(self, name, f, *args, **kwargs):
+        t0 = monotonic()
+        ret = f(*args, **kwargs)
+        t1 = monotonic()
+        if name not in self.samples:
+            self.samples[name] = []
+            self._order.append(name)
+        self.samples[name].append(t1 - t0)
+        return ret
+
+    def drop(self, n):
+        # throw away warmup cycles
+        for name in self.samples:
+            self.samples[name] = self.samples[name][n:]
+
+    def summary(self):
+        return [(name, percentiles(self.samples[name])) for name in self._order]
+
+def runBenchmark(dae, x0, N=10, ts=0.1, cycles=1000, warmup=10, plant='rtintegrator',
+                 noise=0.01, seed=0, integratorOptions=None):
+    '''
+    Run cycles closed loop iterations of MheRT + MpcRT on dae, simulating the plant with
+    RtIntegrator ('rtintegrator') or Sim ('sim'). Returns a json-able dict of results.
+    '''
+    if integratorOptions is None:
+        integratorOptions = defaultIntegratorOptions()
+    assert plant in ['rtintegrator','sim'], 'plant must be "rtintegrator" or "sim", got '+str(plant)
+    nx = len(dae.xNames())
+    nu = len(dae.uNames())
+
+    # build everything
+    t0 = monotonic()
+    mhe = MheRT(Mhe(dae, N=N, ts=ts), ocpOptions=defaultOcpOptions(False),
+                integratorOptions=integratorOptions)
+    mpc = MpcRT(Mpc(dae, N=N, ts=ts), dae, ocpOptions=defaultOcpOptions(True),
+                integratorOptions=integratorOptions)
+    if plant == 'rtintegrator':
+        integrator = rawe.RtIntegrator(dae, ts=ts, options=integratorOptions)
+        def plantStep(x, u):
+            integrator.x = x
+            integrator.u = u
+            integrator.step()
+            return numpy.array(integrator.x)
+    else:
+        sim = rawe.sim.Sim(dae, ts)
+        def plantStep(x, u):
+            return numpy.squeeze(numpy.array(sim.step(x, u, {})))
+    buildTime = monotonic() - t0
+
+    # regulate to zero, measure everything
+    mpc.S = numpy.eye(mpc.S.shape[0])
+    mpc.SN = numpy.eye(mpc.SN.shape[0])
+    mhe.S = numpy.eye(mhe.S.shape[0])
+    mhe.SN = numpy.eye(mhe.SN.shape[0])
+    mpc.x0 = x0
+    x = numpy.array(x0, dtype=numpy.double)
+    for k in range(N+1):
+        mhe.x[k,:] = x
+    mhe.y = numpy.zeros(mhe.y.shape)
+    mhe.y[:,:nx] = x
+    mhe.yN = mhe.computeYX(x)
+
+    random = numpy.random.RandomState(seed)
+    timings = Timings()
+    for k in range(warmup + cycles):
+        timings.time('mhe_preparation', mhe.preparationStep)
+        timings.time('mhe_feedback', mhe.feedbackStep)
+        mpc.x0 = mhe.x[-1,:]
+        timings.time('mpc_preparation', mpc.preparationStep)
+        timings.time('mpc_feedback', mpc.feedbackStep)
+
+        u = numpy.array(mpc.u[0,:])
+        xNext = timings.time('plant_step', plantStep, x, u)
+
+        timings.time('mhe_log', mhe.log)
+        timings.time('mpc_log', mpc.log)
+
+        newY = numpy.concatenate([mhe.computeYX(x), mhe.computeYU(u)]) + noise*random.randn(mhe.y.shape[1])
+        newYN = mhe.computeYX(xNext) + noise*random.randn(mhe.yN.size)
+        timings.time('mpc_shift', mpc.shift)
+        timings.time('mhe_shift', mhe.shift, new_y=newY, new_yN=newYN)
+        x = xNext
+    timings.drop(warmup)
+
+    return {'model':{'nx':nx, 'nu':nu, 'nz':len(dae.zNames()), 'N':N, 'ts':ts},
+            'plant':plant,
+            'cycles':cycles,
+            'warmup':warmup,
+            'build_seconds':buildTime,
+            'host':{'platform':platform.platform(), 'python':platform.python_version(),
+                    'casadi':getattr(C, '__version__', 'unknown')},
+            'timestamp':time.time(),
+            'units':'us',
+            'phases':timings.summary()}
+
+def printResults(results):
+    print '%d cycles, N = %d, plant = %s, built in %.2f s' % \
+        (results['cycles'], results['model']['N'], results['plant'], results['build_seconds'])
+    print '%-16s %10s %10s %10s %10s %10s' % ('phase [us]', 'mean', 'p50', 'p95', 'p99', 'max')
+    for (name, s) in results['phases']:
+        if s['count'] == 0:
+            continue
+        print '%-16s %10.1f %10.1f %10.1f %10.1f %10.1f' % \
+            (name, s['mean'], s['p50'], s['p95'], s['p99'], s['max'])
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description='closed loop MHE + MPC latency benchmark')
+    parser.add_argument('--model', default='double_integrator', choices=sorted(models.keys()))
+    parser.add_argument('--plant', default='rtintegrator', choices=['rtintegrator','sim'])
+    parser.add_argument('--cycles', type=int, default=1000)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('-N', type=int, default=10, help='horizon length')
+    parser.add_argument('--ts', type=float, default=0.1, help='sample time')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', default=None, help='write results to this file')
+    args = parser.parse_args(argv)
+
+    (dae, x0) = models[args.model]()
+    results = runBenchmark(dae, x0, N=args.N, ts=args.ts, cycles=args.cycles,
+                           warmup=args.warmup, plant=args.plant, seed=args.seed)
+    results['model']['name'] = args.model
+    printResults(results)
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print 'wrote '+args.json
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
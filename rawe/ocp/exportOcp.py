@@ -20,8 +20,9 @@ import casadi as C
 import phase1
 import qpoases
 import ocg_interface
+import writeAcadoOcpExport
 from ..rtIntegrator import rtModelExport
-from ..utils import codegen
+from ..utils import codegen, artifactcache
 
 def validateOptions(defaultOpts, userOpts, optName):
     '''
@@ -58,7 +59,7 @@ def testSeparation(dae,out,exportName):
               'of both x and u:\n'+'\n'.join(msgs)
         raise Exception(msg)
 
-def writeObjective(ocp, out0, exportName):
+def objectiveFun(ocp, out0, exportName):
     dae = ocp.dae
 
     # first make out not a function of xDot or z
@@ -94,14 +95,33 @@ def writeObjective(ocp, out0, exportName):
     else:
         raise Exception('unrecognized name "'+exportName+'"')
 
-    return codegen.writeCCode(outputFun,exportName)
+    return outputFun
+
+def writeObjective(ocp, out0, exportName):
+    return codegen.writeCCode(objectiveFun(ocp, out0, exportName), exportName)
 
 
+def ocpCacheKey(ocp, ocpOptions, integratorOptions, cgOptions, phase1Options):
+    dae = ocp.dae
+    inputs = [dae.xDotVec(), dae.xVec(), dae.zVec(), dae.uVec(), dae.pVec()]
+    # the phase 1 exporter source already has the constraints, bounds, horizon and options in it
+    pieces = [artifactcache.fingerprintDae(dae),
+              artifactcache.fingerprintSX(inputs, [ocp._minLsq]),
+              artifactcache.fingerprintSX(inputs, [ocp._minLsqEndTerm]),
+              repr(ocp.ts),
+              writeAcadoOcpExport.generateAcadoOcp(ocp, integratorOptions, ocpOptions),
+              ocg_interface.ocg_interface,
+              repr(sorted(cgOptions.items())),
+              repr(sorted(phase1Options.items())),
+              artifactcache.fingerprintToolchain([cgOptions['CC'], cgOptions['CXX'], phase1Options['CXX']])]
+    return artifactcache.makeKey(ocp.hashPrefix, pieces)
+
 def exportOcp(ocp, ocpOptions, integratorOptions, cgOptions, phase1Options):
     defaultCgOptions = {'CXX':'g++', 'CC':'gcc',
                         'CXXFLAGS':'-O3 -fPIC -finline-functions',
                         'CFLAGS':'-O3 -fPIC -finline-functions',
                         'hideSymbols':False,
+                        'sparseJacobians':False,
                         'export_without_build_path':None}
     defaultPhase1Options = {'CXX':'g++'}
     validateOptions(defaultCgOptions, cgOptions, "codegen")
@@ -109,6 +129,15 @@ def exportOcp(ocp, ocpOptions, integratorOptions, cgOptions, phase1Options):
     cgOptions['hashPrefix'] = ocp.hashPrefix
     phase1Options['hashPrefix'] = ocp.hashPrefix
 
+    # if this exact ocp has been built before, skip code generation entirely
+    cacheKey = None
+    if cgOptions['export_without_build_path'] is None:
+        cacheKey = ocpCacheKey(ocp, ocpOptions, integratorOptions, cgOptions, phase1Options)
+        cachedPath = artifactcache.lookup(cacheKey, ['ocp.so'])
+        if cachedPath is not None:
+            print 'using cached ocp '+cachedPath
+            return cachedPath
+
     # write the OCP exporter and run it, returning an exported OCP
     files = phase1.runPhase1(ocp, phase1Options, integratorOptions, ocpOptions)
 
@@ -118,15 +147,21 @@ def exportOcp(ocp, ocpOptions, integratorOptions, cgOptions, phase1Options):
 #include "rhs.h"
 #include "rhsJacob.h"
 '''
-    rtModelGen = rtModelExport.generateCModel(ocp.dae, ocp.ts, None)
-    files['rhs.cpp'] = '#include "rhs.h"\n'+rtModelGen['rhsFile'][0]
-    files['rhsJacob.cpp'] = '#include "rhsJacob.h"\n'+rtModelGen['rhsJacobFile'][0]
-    files['rhs.h'] = rtModelGen['rhsFile'][1]
-    files['rhsJacob.h'] = rtModelGen['rhsJacobFile'][1]
+    # generate the model and the objective/jacobian C code all at once
+    funs = rtModelExport.modelFuns(ocp.dae, ocp.ts, None, cgOptions['sparseJacobians'])
+    funs.append((objectiveFun(ocp, ocp._minLsq, 'lsqExtern'), 'lsqExtern'))
+    funs.append((objectiveFun(ocp, ocp._minLsqEndTerm, 'lsqEndTermExtern'), 'lsqEndTermExtern'))
+    (sources, _) = codegen.writeCCodeParallel(funs)
+    sources = rtModelExport.modelSources(funs, sources)
+
+    files['rhs.cpp'] = '#include "rhs.h"\n'+sources['rhs'][0]
+    files['rhsJacob.cpp'] = '#include "rhsJacob.h"\n'+sources['rhsJacob'][0]
+    files['rhs.h'] = sources['rhs'][1]
+    files['rhsJacob.h'] = sources['rhsJacob'][1]
 
     # add objective and jacobian
-    externObj    = writeObjective(ocp, ocp._minLsq, 'lsqExtern')
-    externObjEnd = writeObjective(ocp, ocp._minLsqEndTerm, 'lsqEndTermExtern')
+    externObj    = sources['lsqExtern']
+    externObjEnd = sources['lsqEndTermExtern']
     externFile  = '''\
 #include "acado_external_functions.h"
 #include <math.h>
@@ -151,4 +186,7 @@ def exportOcp(ocp, ocpOptions, integratorOptions, cgOptions, phase1Options):
     else:
         raise Exception('the impossible happened, unsupported qp solver: "'+str(ocpOptions['QP_SOLVER'])+'"')
 
+    if cacheKey is not None:
+        artifactcache.store(cacheKey, exportPath, ['ocp.so'])
+
     return exportPath
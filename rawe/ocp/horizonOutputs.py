@@ -0,0 +1,131 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+import ctypes
+import os
+import numpy
+
+import casadi as C
+
+from ..utils import codegen, subprocess_tee
+
+def makeMakefile():
+    return """\
+CXX      = g++
+CXXFLAGS = -O3 -fPIC -finline-functions -I.
+LDFLAGS  = -lm
+
+.PHONY: clean all
+all : horizonOutputs.so
+
+%.o : %.cpp horizonOutputs.h
+\t@echo CXX $@: $(CXX) $(CXXFLAGS) -c $< -o $@
+\t@$(CXX) $(CXXFLAGS) -c $< -o $@
+
+horizonOutputs.so : horizonOutputs.o
+\t@echo LD $@: $(CXX) -shared -o $@ $^ $(LDFLAGS)
+\t@$(CXX) -shared -o $@ $^ $(LDFLAGS)
+
+clean :
+\trm -f *.o *.so
+"""
+
+def horizonOutputsFun(dae, N):
+    '''
+    Map dae.outputsFunWithSolve() over N+1 nodes.
+    Inputs are [x_0..x_N, u_0..u_N, p], outputs are one vector per output name
+    holding that output at every node.
+    Returns (SXFunction, list of per-node output shapes).
+    '''
+    f = dae.outputsFunWithSolve()
+    nx = dae.xVec().size()
+    nu = dae.uVec().size()
+    xs = [C.ssym('x_'+str(k), nx) for k in range(N+1)]
+    us = [C.ssym('u_'+str(k), nu) for k in range(N+1)]
+    p = C.ssym('p', dae.pVec().size())
+
+    shapes = [(f.output(j).size1(), f.output(j).size2()) for j in range(f.getNumOutputs())]
+    outs = [[] for j in range(f.getNumOutputs())]
+    for k in range(N+1):
+        for j,o in enumerate(f.eval([xs[k], us[k], p])):
+            outs[j].append(C.densify(o))
+    hf = C.SXFunction([C.veccat(xs), C.veccat(us), p], [C.veccat(o) for o in outs])
+    hf.init()
+    return (hf, shapes)
+
+def exportHorizonOutputs(dae, N):
+    (hf, shapes) = horizonOutputsFun(dae, N)
+    (src, header) = codegen.writeCCode(hf, 'horizonOutputs')
+    genfiles = {'horizonOutputs.cpp': '#include "horizonOutputs.h"\n'+src,
+                'horizonOutputs.h': header,
+                'Makefile': makeMakefile()}
+    exportpath = codegen.memoizeFiles(genfiles, prefix='horizon_outputs__')
+
+    (ret, msgs) = subprocess_tee.call(['make',codegen.makeJobs()], cwd=exportpath)
+    if ret != 0:
+        raise Exception("horizon outputs compilation failed:\n"+msgs)
+
+    print 'loading '+exportpath+'/horizonOutputs.so'
+    lib = ctypes.cdll.LoadLibrary(os.path.join(exportpath, 'horizonOutputs.so'))
+    return (lib, shapes)
+
+class HorizonOutputs(object):
+    '''
+    Evaluates all of a dae's outputs at all N+1 nodes of a horizon with one call
+    into generated C code. Input and output buffers are allocated once.
+    At the last node u is nan, like OcpRT always did.
+    '''
+    def __init__(self, dae, N):
+        self.outputNames = dae.outputNames()
+        self._N = N
+        nx = dae.xVec().size()
+        nu = dae.uVec().size()
+        self._x = numpy.zeros((N+1, nx))
+        self._u = numpy.zeros((N+1, nu))
+        self._u[N,:] = numpy.nan
+        self._p = numpy.zeros(dae.pVec().size())
+
+        if len(self.outputNames) == 0:
+            self._lib = None
+            self._outputs = {}
+            return
+        (self._lib, shapes) = exportHorizonOutputs(dae, N)
+        assert len(shapes) == len(self.outputNames)
+
+        # generated code writes each node's output column major
+        self._buffers = []
+        self._outputs = {}
+        for name,(n1,n2) in zip(self.outputNames, shapes):
+            buf = numpy.zeros((N+1, n2, n1))
+            self._buffers.append(buf)
+            self._outputs[name] = numpy.squeeze(buf.transpose(0,2,1))
+
+        def ptr(a):
+            return a.ctypes.data_as(ctypes.POINTER(ctypes.c_double))
+        self._args = [ptr(self._x), ptr(self._u), ptr(self._p)] + [ptr(b) for b in self._buffers]
+
+    def evaluate(self, x, u):
+        '''
+        x is (N+1, nx) and u is (N, nu). Returns a dict of output name to array
+        with leading dimension N+1. The arrays are overwritten by the next call.
+        '''
+        if self._lib is None:
+            return self._outputs
+        self._x[:,:] = x
+        self._u[:self._N,:] = u
+        self._lib.horizonOutputs(*self._args)
+        return self._outputs
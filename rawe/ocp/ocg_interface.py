@@ -117,6 +117,24 @@ int py_get_SN(real_t * val, const int nr, const int nc){
   return memcpyMat(val, acadoVariables.SN, nr, nc, ACADO_NYN, ACADO_NYN); }
 #endif /* ACADO_WEIGHTING_MATRICES_TYPE */
 
+/* pointers into acadoVariables, so python can use the solver memory directly */
+real_t * py_ptr_x(void){ return acadoVariables.x; }
+real_t * py_ptr_u(void){ return acadoVariables.u; }
+real_t * py_ptr_y(void){ return acadoVariables.y; }
+real_t * py_ptr_S(void){ return acadoVariables.S; }
+real_t * py_ptr_SN(void){ return acadoVariables.SN; }
+#if ACADO_NXA
+real_t * py_ptr_z(void){ return acadoVariables.z; }
+#endif
+#if ACADO_NYN
+real_t * py_ptr_yN(void){ return acadoVariables.yN; }
+#endif /* ACADO_NYN */
+#if ACADO_INITIAL_STATE_FIXED
+real_t * py_ptr_x0(void){ return acadoVariables.x0; }
+#endif /* ACADO_INITIAL_STATE_FIXED */
+
+/** Size of real_t, python needs this to make views of acadoVariables. */
+int py_get_sizeof_real_t(void){ return sizeof(real_t); }
 
 /** Number of control/estimation intervals. */
 int py_get_ACADO_N(void){ return ACADO_N; }
@@ -17,7 +17,6 @@
 
 import ctypes
 import numpy
-import copy
 import matplotlib.pyplot as plt
 import casadi as C
 import scipy
@@ -26,6 +25,10 @@ import os
 import rawe
 from Ocp import OcpExportOptions,Ocp,Mhe,Mpc
 from ..rtIntegrator import RtIntegratorOptions
+from ..utils.ringlog import RingLog
+from ..utils.mmaplog import MmapLog
+from ..utils.instrumentation import Instrumentation, instrumented
+from horizonOutputs import HorizonOutputs
 
 def dlqr(A, B, Q, R, N=None):
 
@@ -53,6 +56,8 @@ def secretAccess(f):
 
 class OcpRT(object):
     _canonicalNames = ['x','u','z','y','yN','x0','S','SN']
+    # set by enableInstrumentation
+    _instrumentation = None
 
     @property
     def ocp(self):
@@ -64,7 +69,16 @@ class OcpRT(object):
                  integratorOptions=None,
                  codegenOptions=None,
                  phase1Options=None,
-                 integratorMeasurements=None):
+                 integratorMeasurements=None,
+                 sharedMemory=False,
+                 logCapacity=2000):
+        '''
+        If sharedMemory is True, x/u/z/y/yN/x0/S/SN are numpy views directly onto
+        the solver's acadoVariables, so nothing is copied in and out on every call.
+        Assigning to them copies into the solver memory in place.
+
+        log() keeps the last logCapacity steps, older ones are overwritten.
+        '''
         if ocpOptions is None:
             ocpOptions=OcpExportOptions(),
         if integratorOptions is None:
@@ -92,55 +106,56 @@ class OcpRT(object):
         self.preparationTime = 0.0
         self.feedbackTime = 0.0
 
-        self.x  = numpy.zeros((self._lib.py_get_ACADO_N()+1,
-                               self._lib.py_get_ACADO_NX()))
-        self.u  = numpy.zeros((self._lib.py_get_ACADO_N(),
-                               self._lib.py_get_ACADO_NU()))
-        self.y  = numpy.zeros((self._lib.py_get_ACADO_N(),
-                               self._lib.py_get_ACADO_NY()))
+        self._sharedMemory = sharedMemory
+        if self._sharedMemory:
+            assert self._lib.py_get_sizeof_real_t() == ctypes.sizeof(ctypes.c_double), \
+                "sharedMemory needs the solver to be exported with real_t == double"
+
+        self._newField('x', (self._lib.py_get_ACADO_N()+1,
+                             self._lib.py_get_ACADO_NX()))
+        self._newField('u', (self._lib.py_get_ACADO_N(),
+                             self._lib.py_get_ACADO_NU()))
+        self._newField('y', (self._lib.py_get_ACADO_N(),
+                             self._lib.py_get_ACADO_NY()))
         if self._lib.py_get_ACADO_NXA() > 0:
-            self.z  = numpy.zeros((self._lib.py_get_ACADO_N(),
-                                   self._lib.py_get_ACADO_NXA()))
+            self._newField('z', (self._lib.py_get_ACADO_N(),
+                                 self._lib.py_get_ACADO_NXA()))
 
-        self.yN = numpy.zeros(self._lib.py_get_ACADO_NYN())
+        self._newField('yN', (self._lib.py_get_ACADO_NYN(),))
         wmt = self._lib.py_get_ACADO_WEIGHTING_MATRICES_TYPE()
         if wmt == 1:
-            self.S  = numpy.zeros((self._lib.py_get_ACADO_NY(),
-                                   self._lib.py_get_ACADO_NY()))
-            self.SN = numpy.zeros((self._lib.py_get_ACADO_NYN(),
-                                   self._lib.py_get_ACADO_NYN()))
+            self._newField('S',  (self._lib.py_get_ACADO_NY(),
+                                  self._lib.py_get_ACADO_NY()))
+            self._newField('SN', (self._lib.py_get_ACADO_NYN(),
+                                  self._lib.py_get_ACADO_NYN()))
         elif wmt == 2:
-            self.S  = numpy.zeros((self._lib.py_get_ACADO_N()*self._lib.py_get_ACADO_NY(),
-                                   self._lib.py_get_ACADO_NY()))
-            self.SN = numpy.zeros((self._lib.py_get_ACADO_NYN(),
-                                   self._lib.py_get_ACADO_NYN()))
+            self._newField('S',  (self._lib.py_get_ACADO_N()*self._lib.py_get_ACADO_NY(),
+                                  self._lib.py_get_ACADO_NY()))
+            self._newField('SN', (self._lib.py_get_ACADO_NYN(),
+                                  self._lib.py_get_ACADO_NYN()))
         else:
             raise Exception('unrecognized ACADO_WEIGHING_MATRICES_TYPE '+str(wmt))
 
         if self._lib.py_get_ACADO_INITIAL_STATE_FIXED():
-            self.x0 = numpy.zeros(self._lib.py_get_ACADO_NX())
+            self._newField('x0', (self._lib.py_get_ACADO_NX(),))
 
         print 'initializing solver'
         self._lib.py_initialize()
         self._getAll()
 
-        self._log = {}
+        self._log = RingLog(logCapacity, groups=['outputs'])
+        self._fileLog = None
         self._autologNames = []
         for field in self._canonicalNames:
             if hasattr(self, field):
                 self._autologNames.append(field)
-                self._log[field] = []
-        self._log['_kkt'] = []
-        self._log['_objective'] = []
-        self._log['_prep_time'] = []
-        self._log['_fb_time'] = []
-
-        self._log['outputs'] = {}
-        for outName in self.outputNames():
-            self._log['outputs'][outName] = []
 
         # setup outputs function
         self._outputsFun = self.ocp.dae.outputsFunWithSolve()
+        # outputs over the whole horizon, compiled here so log() never has to
+        self._horizonOutputs = None
+        if len(self.outputNames()) > 0:
+            self._horizonOutputs = HorizonOutputs(self.ocp.dae, self.u.shape[0])
 
         # export integrator
         self._integrator = rawe.RtIntegrator(self.ocp.dae, ts=self.ocp.ts,
@@ -155,6 +170,7 @@ class OcpRT(object):
     def outputNames(self):
         return self.ocp.dae.outputNames()
 
+    @instrumented
     def computeOutputs(self, x, u):
         self._outputsFun.setInput(x,0)
         self._outputsFun.setInput(u,1)
@@ -163,6 +179,17 @@ class OcpRT(object):
                 for k in range(self._outputsFun.getNumOutputs())]
         return numpy.squeeze(numpy.array(C.veccat(outs)))
 
+    def _newField(self, name, shape):
+        if self._sharedMemory:
+            # view of the acadoVariables field, which has the same row-major layout
+            getPtr = getattr(self._lib, 'py_ptr_'+name)
+            getPtr.restype = ctypes.c_void_p
+            size = int(numpy.prod(shape))
+            buf = (ctypes.c_double*size).from_address(getPtr())
+            object.__setattr__(self, name, numpy.ctypeslib.as_array(buf).reshape(shape))
+        else:
+            object.__setattr__(self, name, numpy.zeros(shape))
+
     def __setattr__(self, name, value):
         if name in self._canonicalNames:
             if type(value)==C.DMatrix:
@@ -171,7 +198,11 @@ class OcpRT(object):
                 assert value.shape == getattr(self, name).shape, \
                     name+' has dimension '+str(getattr(self,name).shape)+' but you tried to '+\
                     'assign it something with dimension '+str(value.shape)
-            object.__setattr__(self, name, numpy.ascontiguousarray(value, dtype=numpy.double))
+            if self._sharedMemory:
+                # never rebind, write through to the solver memory
+                getattr(self, name)[...] = value
+            else:
+                object.__setattr__(self, name, numpy.ascontiguousarray(value, dtype=numpy.double))
         else:
             if self._locked == 0:
                 raise Exception('you cannot set field "'+name+'"')
@@ -188,7 +219,10 @@ class OcpRT(object):
         assert 0 == ret, "dimension mismatch in "+str(call)
         return call(ctypes.c_void_p(mat.ctypes.data), nr, nc)
 
+    @instrumented
     def _setAll(self):
+        if self._sharedMemory:
+            return
         self._callMat(self._lib.py_set_x,  self.x)
         self._callMat(self._lib.py_set_u,  self.u)
         self._callMat(self._lib.py_set_y,  self.y)
@@ -200,7 +234,10 @@ class OcpRT(object):
         if hasattr(self, 'z'):
             self._callMat(self._lib.py_set_z, self.z)
 
+    @instrumented
     def _getAll(self):
+        if self._sharedMemory:
+            return
         self._callMat(self._lib.py_get_x,  self.x)
         self._callMat(self._lib.py_get_u,  self.u)
         self._callMat(self._lib.py_get_y,  self.y)
@@ -229,18 +266,43 @@ class OcpRT(object):
                 numpy.savetxt(os.path.join(directory,prefix+name+'.txt'), getattr(self,name))
 
 
+    @secretAccess
+    def enableInstrumentation(self, enable=True):
+        '''
+        Start (or stop) timing the hot path methods of this instance, see getCounters.
+        '''
+        if enable:
+            if self._instrumentation is None:
+                self._instrumentation = Instrumentation()
+        else:
+            self._instrumentation = None
+
+    def getCounters(self):
+        '''
+        Per method call counts and timings, {} if instrumentation is disabled.
+        '''
+        if self._instrumentation is None:
+            return {}
+        return self._instrumentation.counters()
+
+    @instrumented
     @secretAccess
     def preparationStep(self):
         self._setAll()
         self.preparationTime = self._lib.preparationStepTimed()
         self._getAll()
+        if self._instrumentation is not None:
+            self._instrumentation.recordDuration('acado_preparationStep', self.preparationTime)
 
+    @instrumented
     @secretAccess
     def feedbackStep(self):
         self._setAll()
         ret = ctypes.c_int(0)
         self.feedbackTime = self._lib.feedbackStepTimed(ctypes.byref(ret))
         self._getAll()
+        if self._instrumentation is not None:
+            self._instrumentation.recordDuration('acado_feedbackStep', self.feedbackTime)
         if ret.value != 0:
             raise Exception("feedbackStep returned error code "+str(ret.value))
         nans = []
@@ -256,6 +318,7 @@ class OcpRT(object):
         self._lib.initializeNodesByForwardSimulation()
         self._getAll()
 
+    @instrumented
     def shiftXZU(self,strategy='simulate', xEnd=None, uEnd=None):
         null_ptr = ctypes.POINTER(ctypes.c_double)()
         if strategy == 'copy':
@@ -279,6 +342,7 @@ class OcpRT(object):
         self._lib.shiftControls(uptr)
         self._getAll()
 
+    @instrumented
     def pythonShiftXZU(self):
         '''
         There are N+1 states and N controls/alg vars in the trajectory.
@@ -309,6 +373,7 @@ class OcpRT(object):
         self.y[-1,:] = y_Nm1
         self.yN = yN
 
+    @instrumented
     @secretAccess
     def shift(self,new_x=None,new_u=None,sim=None,new_y=None,new_yN=None,new_S=None,new_SN=None):
         # Shift weighting matrices
@@ -371,33 +436,46 @@ class OcpRT(object):
         if new_yN != None:
             self.yN = new_yN
 
+    @instrumented
+    @secretAccess
     def log(self):
+        row = {}
         for field in self._autologNames:
             assert hasattr(self, field), \
                 "the \"impossible\" happend: ocprt doesn't have field \""+field+"\""
-            self._log[field].append(copy.deepcopy(getattr(self, field)))
-        self._log['_kkt'].append(self.getKKT())
-        self._log['_objective'].append(self.getObjective())
-        self._log['_prep_time'].append(self.preparationTime)
-        self._log['_fb_time'].append(self.feedbackTime)
-
-        ret = {}
-        for j,name in enumerate(self.outputNames()):
-            ret[name] = []
-        nu = self.u.shape[0]
-        for k in range(nu+1):
-            self._outputsFun.setInput(self.x[k,:],0)
-            if k < nu:
-                self._outputsFun.setInput(self.u[k,:],1)
-            else:
-                # at final state, set u=nan
-                self._outputsFun.setInput(numpy.nan*self.u[k-1,:],1)
-            self._outputsFun.evaluate()
-            for j,name in enumerate(self.outputNames()):
-                ret[name].append(numpy.array(self._outputsFun.output(j)))
+            row[field] = getattr(self, field)
+        row['_kkt'] = self.getKKT()
+        row['_objective'] = self.getObjective()
+        row['_prep_time'] = self.preparationTime
+        row['_fb_time'] = self.feedbackTime
+
+        # at final state u=nan
+        if self._horizonOutputs is not None:
+            outs = self._horizonOutputs.evaluate(self.x, self.u)
+            for outName in self.outputNames():
+                row['outputs/'+outName] = outs[outName]
+
+        # copied into preallocated columns
+        self._log.append(row)
+        if self._fileLog is not None:
+            self._fileLog.append(row)
+
+    @secretAccess
+    def logToFile(self, directory, chunkRows=10000):
+        '''
+        From now on log() also appends every step to a memory mapped log in directory,
+        which can be opened with rawe.utils.mmaplog.openLog (e.g. in load_and_plot).
+        '''
+        self.closeLogFile()
+        meta = {'xNames':self.xNames(), 'uNames':self.uNames(),
+                'outputNames':self.outputNames(), 'ts':float(self.ocp.ts)}
+        self._fileLog = MmapLog(directory, meta=meta, chunkRows=chunkRows)
 
-        for outName in self.outputNames():
-            self._log['outputs'][outName].append(numpy.squeeze(ret[outName]))
+    @secretAccess
+    def closeLogFile(self):
+        if self._fileLog is not None:
+            self._fileLog.close()
+            self._fileLog = None
 
 #     def shiftStates( int strategy, real_t* const xEnd, real_t* const uEnd ):
 #         void shiftStates( int strategy, real_t* const xEnd, real_t* const uEnd );
@@ -408,10 +486,12 @@ class OcpRT(object):
 #    def getTiming(self):
 #        blabla
 
+    @instrumented
     def getKKT(self):
         self._setAll()
         return self._lib.getKKT()
 
+    @instrumented
     def getObjective(self):
         self._setAll()
         return self._lib.getObjective()
@@ -554,7 +634,9 @@ class MpcRT(OcpRT):
                  ocpOptions=None,
                  integratorOptions=None,
                  codegenOptions=None,
-                 phase1Options=None):
+                 phase1Options=None,
+                 sharedMemory=False,
+                 logCapacity=2000):
         assert isinstance(ocp, Mpc), "MpcRT must be given an Mpc object, you gave: "+str(type(ocp))
 
         # call the parent init
@@ -562,7 +644,9 @@ class MpcRT(OcpRT):
                        ocpOptions=ocpOptions,
                        integratorOptions=integratorOptions,
                        codegenOptions=codegenOptions,
-                       phase1Options=phase1Options)
+                       phase1Options=phase1Options,
+                       sharedMemory=sharedMemory,
+                       logCapacity=logCapacity)
 
         # set up measurement functions
         self._yxFun = C.SXFunction([ocp.dae.xVec()], [C.densify(self.ocp.yx)])
@@ -573,6 +657,7 @@ class MpcRT(OcpRT):
         self._lqrDae = lqrDae
         self._integratorLQR  = rawe.RtIntegrator(self._lqrDae, ts=self.ocp.ts, options=integratorOptions)
 
+    @instrumented
     def computeLqr(self):
         nx = self.x.shape[1]
 
@@ -594,7 +679,9 @@ class MheRT(OcpRT):
                  ocpOptions=None,
                  integratorOptions=None,
                  codegenOptions=None,
-                 phase1Options=None):
+                 phase1Options=None,
+                 sharedMemory=False,
+                 logCapacity=2000):
         assert isinstance(ocp, Mhe), "MheRT must be given an Mhe object, you gave: "+str(type(ocp))
 
         # call the parent init
@@ -603,7 +690,9 @@ class MheRT(OcpRT):
                        integratorOptions=integratorOptions,
                        codegenOptions=codegenOptions,
                        phase1Options=phase1Options,
-                       integratorMeasurements=C.veccat([ocp.yx,ocp.yu]))
+                       integratorMeasurements=C.veccat([ocp.yx,ocp.yu]),
+                       sharedMemory=sharedMemory,
+                       logCapacity=logCapacity)
 
         # set up measurement functions
         self._yxFun = C.SXFunction([ocp.dae.xVec()], [C.densify(self.ocp.yx)])
@@ -611,16 +700,19 @@ class MheRT(OcpRT):
         self._yxFun.init()
         self._yuFun.init()
 
+    @instrumented
     def computeYX(self,x):
         self._yxFun.setInput(x,0)
         self._yxFun.evaluate()
         return numpy.squeeze(numpy.array(self._yxFun.output(0)))
 
+    @instrumented
     def computeYU(self,u):
         self._yuFun.setInput(u,0)
         self._yuFun.evaluate()
         return numpy.squeeze(numpy.array(self._yuFun.output(0)))
 
+    @instrumented
     def UpdateArrivalCost(self):
         ''' Arrival cost implementation.
             Approximate the solution of:
@@ -18,14 +18,70 @@
 import os
 from rawe.utils import pkgconfig, codegen, subprocess_tee
 
-def mkMakefile(cgOptions, qposrc):
-    qposrc = ' \\\n'.join(['\t'+os.path.join('qpoases', q.split('qpoases'+os.sep)[1]) for q in qposrc])
+# bump this to rebuild everyone's prebuilt qpOASES libraries
+qpoasesLibVersion = 1
+
+def _visibility(cgOptions):
     if cgOptions['hideSymbols']:
-        c_visibility = ' -fvisibility=hidden'
-        cxx_visibility = ' -fvisibility=hidden -fvisibility-inlines-hidden'
+        return (' -fvisibility=hidden', ' -fvisibility=hidden -fvisibility-inlines-hidden')
+    return ('', '')
+
+def _qpoSrcPaths(qposrc):
+    return [os.path.join('qpoases', q.split('qpoases'+os.sep)[1]) for q in qposrc]
+
+def mkLibMakefile(cgOptions, qposrc):
+    (_, cxx_visibility) = _visibility(cgOptions)
+    makefile = """\
+CXX      = %(CXX)s
+CXXFLAGS = %(CXXFLAGS)s%(cxx_visibility)s
+
+QPO_INC = \\
+\t-I. \\
+\t-Iqpoases \\
+\t-Iqpoases/INCLUDE \\
+\t-Iqpoases/SRC
+
+CXXFLAGS += $(QPO_INC)
+
+CXX_SRC = \\
+%(qpo_src)s
+
+CXX_OBJ = $(CXX_SRC:%%.cpp=%%.o)
+
+.PHONY: clean all
+all : libqpoases.a
+
+$(CXX_OBJ) : %%.o : %%.cpp
+\t@echo CXX $@: $(CXX) $(CXXFLAGS) -c $< -o $@
+\t@$(CXX) $(CXXFLAGS) -c $< -o $@
+
+libqpoases.a : $(CXX_OBJ)
+\t@echo AR $@ : ar rcs $@ $(CXX_OBJ)
+\t@ar rcs $@ $(CXX_OBJ)
+
+clean :
+\t@echo rm -f libqpoases.a $(CXX_OBJ)
+\t@rm -f libqpoases.a $(CXX_OBJ)
+""" % {'CXX':cgOptions['CXX'], 'CXXFLAGS':cgOptions['CXXFLAGS'],
+       'cxx_visibility':cxx_visibility,
+       'qpo_src':' \\\n'.join(['\t'+q for q in _qpoSrcPaths(qposrc)])}
+    return makefile
+
+def mkMakefile(cgOptions, qposrc, qpoLib=None):
+    '''
+    If qpoLib is given, link against that prebuilt qpOASES library
+    instead of compiling the qpOASES sources.
+    '''
+    (c_visibility, cxx_visibility) = _visibility(cgOptions)
+    cxxsrc = ['rhs.cpp', 'rhsJacob.cpp', 'acado_external_functions.cpp']
+    if qpoLib is None:
+        cxxsrc += _qpoSrcPaths(qposrc)
+        qpoLib = ''
+        # nothing to unpack
+        qpoObj = ''
     else:
-        c_visibility = ''
-        cxx_visibility = ''
+        qpoObj = 'qpoases_lib/*.o'
+    cxxsrc.append('qpoases/solver.cpp')
 
     makefile = """\
 CXX      = %(CXX)s
@@ -48,13 +104,11 @@ else
 	LDFLAGS += -lrt
 endif
 
+# prebuilt qpOASES, if any
+QPO_LIB = %(qpo_lib)s
 
 CXX_SRC = \\
-\trhs.cpp \\
-\trhsJacob.cpp \\
-\tacado_external_functions.cpp \\
-%(qpo_src)s \\
-\tqpoases/solver.cpp
+%(cxx_src)s
 
 C_SRC = \\
 \tworkspace.c \\
@@ -94,28 +148,80 @@ $(C_OBJ) : %%.o : %%.c $(HEADERS)
 \t@echo CC $@: $(CC) $(CFLAGS) -c $< -o $@
 \t@$(CC) $(CFLAGS) -c $< -o $@
 
-ocp.so : $(CXX_OBJ) $(C_OBJ)
-\t@echo LD $@: $(CXX) -shared -o $@ $(CXX_OBJ) $(C_OBJ) $(LDFLAGS)
-\t@$(CXX) -shared -o $@ $(CXX_OBJ) $(C_OBJ) $(LDFLAGS)
+ocp.so : $(CXX_OBJ) $(C_OBJ) $(QPO_LIB)
+\t@echo LD $@: $(CXX) -shared -o $@ $(CXX_OBJ) $(C_OBJ) $(QPO_LIB) $(LDFLAGS)
+\t@$(CXX) -shared -o $@ $(CXX_OBJ) $(C_OBJ) $(QPO_LIB) $(LDFLAGS)
 
-ocp.a : $(CXX_OBJ) $(C_OBJ)
+ocp.a : $(CXX_OBJ) $(C_OBJ) $(QPO_LIB)
+ifeq ($(QPO_LIB),)
 \t@echo AR $@ : ar r $@ $?
 \t@ar r $@ $?
+else
+\t@echo AR $@ : cp $(QPO_LIB) $@, ar r $@ $(CXX_OBJ) $(C_OBJ)
+\t@cp $(QPO_LIB) $@
+\t@ar r $@ $(CXX_OBJ) $(C_OBJ)
+endif
 
-ocp.o : $(CXX_OBJ) $(C_OBJ)
-\t@echo ld $@ : ld -r $? -o $@
-\t@ld -r $? -o $@
+ocp.o : $(CXX_OBJ) $(C_OBJ) $(QPO_LIB)
+ifneq ($(QPO_LIB),)
+\t@rm -rf qpoases_lib && mkdir qpoases_lib && cd qpoases_lib && ar x $(QPO_LIB)
+endif
+\t@echo ld $@ : ld -r $(CXX_OBJ) $(C_OBJ) %(qpo_obj)s -o $@
+\t@ld -r $(CXX_OBJ) $(C_OBJ) %(qpo_obj)s -o $@
 
 clean :
 \t@echo rm -f ocp.a $(CXX_OBJ) $(C_OBJ) ocp.so
-\t@rm -f ocp.a ocp.so ocp.o $(CXX_OBJ) $(C_OBJ)
+\t@rm -rf ocp.a ocp.so ocp.o $(CXX_OBJ) $(C_OBJ) qpoases_lib
 """ % {'CXX':cgOptions['CXX'], 'CC':cgOptions['CC'],
        'CXXFLAGS':cgOptions['CXXFLAGS'], 'CFLAGS':cgOptions['CFLAGS'],
        'c_visibility':c_visibility,
        'cxx_visibility':cxx_visibility,
-       'qpo_src':qposrc}
+       'cxx_src':' \\\n'.join(['\t'+c for c in cxxsrc]),
+       'qpo_lib':qpoLib,
+       'qpo_obj':qpoObj}
     return makefile
 
+def mergeAll(srcdict,destdict):
+    for name,src in srcdict.items():
+        if isinstance(src,dict):
+            if name not in destdict:
+                destdict[name] = {}
+            assert isinstance(destdict[name], dict), "dictionary merge failed, source was directory but destination was a file"
+            destdict[name] = mergeAll(src,destdict[name])
+        else:
+            destdict[name] = src
+    return destdict
+
+def _headers(files):
+    return dict([(name,src) for name,src in files.items()
+                 if isinstance(src,str) and os.path.splitext(name)[1] in ['.h','.hpp']])
+
+def _withoutSources(files):
+    ret = {}
+    for name,src in files.items():
+        if isinstance(src,dict):
+            ret[name] = _withoutSources(src)
+        elif os.path.splitext(name)[1] != '.cpp':
+            ret[name] = src
+    return ret
+
+def buildQpoasesLib(cgOptions, qposrc, qpoSrcTree, phase1src):
+    '''
+    Compile the qpOASES sources into a static library in its own memoized directory.
+    qpOASES includes the generated headers (problem dimensions), so those go in the hash too
+    but nothing else from the OCP does. Changing weights, bounds or the objective reuses the
+    library, changing dimensions builds a new one. Returns the path to libqpoases.a.
+    '''
+    libfiles = _headers(phase1src)
+    libfiles['qpoases'] = mergeAll(_headers(phase1src.get('qpoases', {})), dict(qpoSrcTree))
+    libfiles['Makefile'] = mkLibMakefile(cgOptions, qposrc)
+    libpath = codegen.memoizeFiles(libfiles,
+                                   prefix='qpoases_lib_v'+str(qpoasesLibVersion)+'__')
+
+    (ret, msgs) = subprocess_tee.call(['make',codegen.makeJobs()], cwd=libpath)
+    if ret != 0:
+        raise Exception("qpOASES library compilation failed:\n\n"+msgs)
+    return os.path.join(libpath, 'libqpoases.a')
 
 def exportPhase2(cgOptions, phase1src):
     # call pkg-config to get qpoases source and includes
@@ -128,33 +234,26 @@ def exportPhase2(cgOptions, phase1src):
     qpoSrcPath = os.path.join(qpoStuff['qpOASESsrc'][0].split('qpoases')[0], 'qpoases')
     phase2src = codegen.directoryToDict(qpoSrcPath)
 
-    # merge qpoases source with phase 1 output
-    def mergeAll(srcdict,destdict):
-        for name,src in srcdict.items():
-            if isinstance(src,dict):
-                if name not in destdict:
-                    destdict[name] = {}
-                assert isinstance(destdict[name], dict), "dictionary merge failed, source was directory but destination was a file"
-                destdict[name] = mergeAll(src,destdict[name])
-            else:
-                destdict[name] = src
-        return destdict
-    genfiles = mergeAll(phase1src, {'qpoases':phase2src})
-
-    # add makefile
-    genfiles['Makefile'] = mkMakefile(cgOptions, qpoStuff['qpOASESsrc'])
-    genfiles['workspace.c'] ='''\
+    workspace = '''\
 #include "acado_common.h"
 ACADOworkspace acadoWorkspace;
 ACADOvariables acadoVariables;
 '''
 
-    # write things in user specified directory if 'export_without_build_path' is not None
+    # write things in user specified directory if 'export_without_build_path' is not None,
+    # self contained so the whole qpoases source goes along
     if cgOptions['export_without_build_path'] is not None:
+        genfiles = mergeAll(phase1src, {'qpoases':phase2src})
+        genfiles['Makefile'] = mkMakefile(cgOptions, qpoStuff['qpOASESsrc'])
+        genfiles['workspace.c'] = workspace
         codegen.writeDifferentFiles(cgOptions['export_without_build_path'], genfiles)
         return
 
-    # otherwise write things in memoized directory, then compile
+    # otherwise link against a prebuilt qpoases, so only the generated code is compiled
+    qpoLib = buildQpoasesLib(cgOptions, qpoStuff['qpOASESsrc'], phase2src, phase1src)
+    genfiles = mergeAll(phase1src, {'qpoases':_withoutSources(phase2src)})
+    genfiles['Makefile'] = mkMakefile(cgOptions, qpoStuff['qpOASESsrc'], qpoLib=qpoLib)
+    genfiles['workspace.c'] = workspace
     exportpath = codegen.memoizeFiles(genfiles,prefix=cgOptions['hashPrefix']+'__')
 
     # compile!
@@ -17,6 +17,7 @@
 
 import numpy as np
 import numbers
+import bisect
 
 #from models import Dae
 from dvmap import DesignVarMap
@@ -33,13 +34,37 @@ def setFXOptions(fun, options):
         fun.setOption(optName, optVal)
 
 
+class ConstraintBlock():
+    """
+    One addBnds/addBlock call: rows start:stop of g.
+    tagRows is {tagName: local row indices} so everything about a tag only touches its blocks.
+    """
+    def __init__(self,start,g,glb,gub,tags):
+        self.start = start
+        self.stop = start + g.size()
+        self.g = g
+        self.glb = glb
+        self.gub = gub
+        self.tags = tags
+        self.tagRows = {}
+        for k,(name,_,_) in enumerate(tags):
+            if name not in self.tagRows:
+                self.tagRows[name] = []
+            self.tagRows[name].append(k)
+        for name in self.tagRows:
+            self.tagRows[name] = np.array(self.tagRows[name],dtype=int)
+
 class Constraints():
     def __init__(self):
-        self._tags = []
         self._g = []
         self._glb = []
         self._gub = []
-        
+        self._blocks = []
+        self._starts = []
+        # tagName -> indices of the blocks which have it
+        self._tagBlocks = {}
+        self._size = 0
+
     def add(self,lhs,comparison,rhs,tag=('unnamed_constraint',None)):
         #print "\n\nadding constraint\nlhs: "+str(lhs)+"\ncomparison: "+comparison+"\nrhs: "+str(rhs)
         if comparison=="==":
@@ -61,6 +86,8 @@ class Constraints():
             raise ValueError('Did not recognize comparison \"'+str(comparison)+'\"')
 
     def addBnds(self,g,(glb,gub),tag=('unnamed_constraint',None)):
+        if isinstance(tag,str):
+            tag = (tag,None)
         (tagName, tagIdx) = tag
 
         if (isinstance(glb,numbers.Real) and isinstance(gub,numbers.Real)):
@@ -71,11 +98,32 @@ class Constraints():
         assert isinstance(gub,np.ndarray)
         assert isinstance(g,C.SXMatrix) or isinstance(g,C.MX)
         assert g.size()==glb.size and g.size()==gub.size
+        self._addBlock(g,glb,gub,[(tagName,tagIdx,k) for k in range(g.size())])
+
+    def addBlock(self,g,(glb,gub),tags):
+        """
+        Add many constraints at once, tags has one (tagName,tagIdx,k) for every element of g
+        """
+        assert isinstance(glb,np.ndarray)
+        assert isinstance(gub,np.ndarray)
+        assert isinstance(g,C.SXMatrix) or isinstance(g,C.MX)
+        assert g.size()==glb.size and g.size()==gub.size and g.size()==len(tags)
+        self._addBlock(g,glb,gub,list(tags))
+
+    def _addBlock(self,g,glb,gub,tags):
+        glb = np.array(glb,dtype=float).ravel()
+        gub = np.array(gub,dtype=float).ravel()
+        block = ConstraintBlock(self._size,g,glb,gub,tags)
+        for name in block.tagRows:
+            if name not in self._tagBlocks:
+                self._tagBlocks[name] = []
+            self._tagBlocks[name].append(len(self._blocks))
+        self._blocks.append(block)
+        self._starts.append(block.start)
+        self._size = block.stop
         self._g.append(g)
         self._glb.append(glb)
         self._gub.append(gub)
-        for k in range(g.size()):
-            self._tags.append( (tagName,tagIdx,k) )
 
     def getG(self):
         return C.veccat(self._g)
@@ -84,46 +132,112 @@ class Constraints():
     def getUb(self):
         return C.veccat(self._gub)
 
-    def getViolations(self,g,lbg,ubg,reportThreshold=0,reportEqViolations=False):
+    def size(self):
+        return self._size
+
+    def tagNames(self):
+        return self._tagBlocks.keys()
+
+    def getTag(self,k):
+        """
+        (tagName,tagIdx,k) of row k of g
+        """
+        if k < 0 or k >= self._size:
+            raise IndexError("constraint index "+str(k)+" out of range, there are "+str(self._size))
+        block = self._blocks[bisect.bisect_right(self._starts,k)-1]
+        return block.tags[k-block.start]
+
+    def _tagBlockRows(self,tagName):
+        # [(block, local rows)] of a tag
+        if tagName not in self._tagBlocks:
+            raise KeyError('no constraints are tagged "'+str(tagName)+'"')
+        return [(self._blocks[b], self._blocks[b].tagRows[tagName]) for b in self._tagBlocks[tagName]]
+
+    def getTagIndices(self,tagName):
+        """
+        rows of g tagged tagName
+        """
+        return np.concatenate([block.start + rows for (block,rows) in self._tagBlockRows(tagName)])
+
+    def setTagBounds(self,tagName,(lb,ub),tagIdx=None):
+        """
+        Change the bounds of every constraint tagged tagName (and tagIdx, if given).
+        lb/ub are scalars or one value per row. Returns the rows of g which changed,
+        so only those have to be sent to a solver which is already set up.
+        """
+        blockRows = self._tagBlockRows(tagName)
+        if tagIdx is not None:
+            blockRows = [(block,np.array([r for r in rows if block.tags[r][1] == tagIdx],dtype=int))
+                         for (block,rows) in blockRows]
+        n = sum([len(rows) for (_,rows) in blockRows])
+        if not np.isscalar(lb):
+            lb = np.asarray(lb,dtype=float).ravel()
+            assert lb.size == n, "got "+str(lb.size)+" lower bounds for "+str(n)+" constraints"
+        if not np.isscalar(ub):
+            ub = np.asarray(ub,dtype=float).ravel()
+            assert ub.size == n, "got "+str(ub.size)+" upper bounds for "+str(n)+" constraints"
+
+        offset = 0
+        for (block,rows) in blockRows:
+            m = len(rows)
+            block.glb[rows] = lb if np.isscalar(lb) else lb[offset:offset+m]
+            block.gub[rows] = ub if np.isscalar(ub) else ub[offset:offset+m]
+            offset += m
+        return np.concatenate([block.start + rows for (block,rows) in blockRows])
+
+    def getBounds(self,rows):
+        """
+        (lb,ub) of the given rows of g
+        """
+        lb = np.zeros(len(rows))
+        ub = np.zeros(len(rows))
+        for j,k in enumerate(rows):
+            block = self._blocks[bisect.bisect_right(self._starts,k)-1]
+            lb[j] = block.glb[k-block.start]
+            ub[j] = block.gub[k-block.start]
+        return (lb,ub)
+
+    def getViolations(self,g,lbg,ubg,reportThreshold=0,reportEqViolations=False,tags=None):
         """
         Tests if g >= ubg + reportThreshold
                  g <= lbg - reportThreshold
         Positive reportThreshold supresses barely active bounds
         Negative reportThreshold reports not-quite-active bounds
+        If tags (a list of tag names) is given, only those constraints are checked
         """
-        violations = {}
+        g = np.asarray(g,dtype=float).ravel()
+        lbg = np.asarray(lbg,dtype=float).ravel()
+        ubg = np.asarray(ubg,dtype=float).ravel()
+        if tags is None:
+            rows = None
+        else:
+            rows = np.concatenate([self.getTagIndices(name) for name in tags]+[np.zeros(0,dtype=int)])
+            rows.sort()
+            g = g[rows]
+            lbg = lbg[rows]
+            ubg = ubg[rows]
 
         ubviols = g - ubg
         lbviols = lbg - g
-        ubviolsIdx = np.where(C.logic_and(ubviols >= reportThreshold, ubg > lbg))[0]
-        lbviolsIdx = np.where(C.logic_and(lbviols >= reportThreshold, ubg > lbg))[0]
+        ineq = ubg > lbg
+        ubviolsIdx = np.where(np.logical_and(ubviols >= reportThreshold, ineq))[0]
+        lbviolsIdx = np.where(np.logical_and(lbviols >= reportThreshold, ineq))[0]
 
         eqviolsIdx = []
         if reportEqViolations:
-            eqviolsIdx = np.where(C.logic_and(C.fabs(ubviols) >= reportThreshold, ubg == lbg))[0]
+            eqviolsIdx = np.where(np.logical_and(np.abs(ubviols) >= reportThreshold, ubg == lbg))[0]
 
         violations = {}
-        for k in ubviolsIdx:
-            (name,time,idx) = self._tags[k]
-            viol = ('ub',(time,idx),float(ubviols[k]))#,g[k],ubg[k])
-            if name not in violations:
-                violations[name] = [viol]
-            else:
-                violations[name].append(viol)
-        for k in lbviolsIdx:
-            (name,time,idx) = self._tags[k]
-            viol = ('lb',(time,idx),float(lbviols[k]))#,g[k],lbg[k])
-            if name not in violations:
-                violations[name] = [viol]
-            else:
-                violations[name].append(viol)
-        for k in eqviolsIdx:
-            (name,time,idx) = self._tags[k]
-            viol = ('eq',(time,idx),float(ubviols[k]))#,g[k],lbg[k])
-            if name not in violations:
-                violations[name] = [viol]
-            else:
-                violations[name].append(viol)
+        for (kind,idxs,viols) in [('ub',ubviolsIdx,ubviols),
+                                  ('lb',lbviolsIdx,lbviols),
+                                  ('eq',eqviolsIdx,ubviols)]:
+            for k in idxs:
+                (name,time,idx) = self.getTag(k if rows is None else rows[k])
+                viol = (kind,(time,idx),float(viols[k]))
+                if name not in violations:
+                    violations[name] = [viol]
+                else:
+                    violations[name].append(viol)
         return violations
 
     def getViolationsStr(self,*args,**kwargs):
@@ -141,6 +255,42 @@ class Constraints():
         if viols != '':
             print viols
 
+    def jacobianSparsity(self,x):
+        """
+        Jacobian of g w.r.t. design variables x, per tag:
+        {tagName: {'rows', 'nnz', 'cols' (number of x it depends on)}}
+        """
+        ret = {}
+        for block in self._blocks:
+            if isinstance(block.g,C.MX):
+                f = C.MXFunction([x],[block.g])
+            else:
+                f = C.SXFunction([x],[block.g])
+            f.init()
+            sp = f.jacSparsity(0,0)
+            jrows = np.array(sp.getRow(),dtype=int)
+            jcols = np.array(sp.col(),dtype=int)
+            for name,rows in block.tagRows.items():
+                mask = np.zeros(block.stop-block.start,dtype=bool)
+                mask[rows] = True
+                nzmask = mask[jrows]
+                if name not in ret:
+                    ret[name] = {'rows':0, 'nnz':0, 'cols':set()}
+                ret[name]['rows'] += len(rows)
+                ret[name]['nnz'] += int(nzmask.sum())
+                ret[name]['cols'].update(jcols[nzmask].tolist())
+        for name in ret:
+            ret[name]['cols'] = len(ret[name]['cols'])
+        return ret
+
+    def printJacobianSparsity(self,x):
+        sps = self.jacobianSparsity(x)
+        total = max(1,sum([sp['nnz'] for sp in sps.values()]))
+        print '%-40s %8s %8s %8s %8s' % ('constraint', 'rows', 'cols', 'nnz', '% nnz')
+        for name,sp in sorted(sps.items(), key=lambda (n,sp): -sp['nnz']):
+            print '%-40s %8d %8d %8d %8.1f' % (str(name)[:40], sp['rows'], sp['cols'], sp['nnz'],
+                                               100.0*sp['nnz']/total)
+
 class Bounds(DesignVarMap):
     descriptor = "bound"
         
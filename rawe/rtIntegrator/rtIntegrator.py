@@ -21,9 +21,11 @@ import numpy
 import casadi as C
 
 from rtIntegratorExport import exportIntegrator
+import rtModelExport
 
 from ..utils import codegen, subprocess_tee
 from ..utils.options import Options, OptStr, OptInt, OptBool
+from ..utils.instrumentation import Instrumentation, instrumented
 
 class RtIntegratorOptions(Options):
     def __init__(self):
@@ -51,6 +53,9 @@ class RtIntegrator(object):
                        '_dx1z0_dx0','_dx1z0_dup',
                        'h','dh_dx0','dh_du','dh_dp','_dh_dup', '_measData',# measurements
                        '_data']
+    # set by enableInstrumentation
+    _instrumentation = None
+
     def __setattr__(self, name, value):
         if name in self._canonicalNames:
             if type(value)==C.DMatrix:
@@ -124,9 +129,14 @@ class RtIntegrator(object):
             self.dh_du = self._dh_dup[:,:nu]
             self.dh_dp = self._dh_dup[:,nu:]
 
-    def __init__(self, dae, ts, measurements=None, options=RtIntegratorOptions()):
+    def __init__(self, dae, ts, measurements=None, options=RtIntegratorOptions(), sparseJacobians=False):
+        '''
+        If sparseJacobians is True the generated model jacobians only compute their
+        structural nonzeros and scatter them into the dense layout the integrator uses.
+        '''
         self._dae = dae
         self._ts = ts
+        self._sparseJacobians = sparseJacobians
         if measurements is None:
             self._measurements = measurements
         else:
@@ -134,14 +144,13 @@ class RtIntegrator(object):
                 measurements = C.veccat(measurements)
             self._measurements = measurements
 
-        # setup outputs function
-        self._outputsFun = self._dae.outputsFunWithSolve()
-
-        (integratorLib, modelLib, rtModelGen) = exportIntegrator(self._dae, ts, options, self._measurements)
+        (integratorLib, modelLib, rtModelGen) = exportIntegrator(self._dae, ts, options, self._measurements,
+                                                                   sparseJacobians=sparseJacobians)
         self._integratorLib = integratorLib
         self._modelLib = modelLib
+        # rtModelGen is None if the integrator came out of the artifact cache
         self._rtModelGen = rtModelGen
-        
+
         self._initIntegrator = 1
 
         nx = len( self._dae.xNames() )
@@ -171,6 +180,36 @@ class RtIntegrator(object):
             self.dh_du = numpy.zeros( (nh, nu) )
             self.dh_dp = numpy.zeros( (nh, np) )
 
+    def enableInstrumentation(self, enable=True):
+        '''
+        Start (or stop) timing step/stepBatch/getOutputs of this instance, see getCounters.
+        '''
+        if enable:
+            if self._instrumentation is None:
+                self._instrumentation = Instrumentation()
+        else:
+            self._instrumentation = None
+
+    def getCounters(self):
+        '''
+        Per method call counts and timings, {} if instrumentation is disabled.
+        '''
+        if self._instrumentation is None:
+            return {}
+        return self._instrumentation.counters()
+
+    def _getRtModelGen(self):
+        if self._rtModelGen is None:
+            self._rtModelGen = rtModelExport.generateCModel(self._dae, self._ts, self._measurements,
+                                                            self._sparseJacobians)
+        return self._rtModelGen
+
+    def _getOutputsFun(self):
+        # only solve for the outputs symbolically when someone asks for them
+        if not hasattr(self, '_outputsFun'):
+            self._outputsFun = self._dae.outputsFunWithSolve()
+        return self._outputsFun
+
     def rhs(self,xdot,x,z,u,p, compareWithSX=False):
         xdot = numpy.array([xdot[n] for n in self._dae.xNames()],dtype=numpy.double)
         x    = numpy.array([x[n]    for n in self._dae.xNames()],dtype=numpy.double)
@@ -185,7 +224,7 @@ class RtIntegrator(object):
                            )
 
         if compareWithSX:
-            f = self._rtModelGen['rhs']
+            f = self._getRtModelGen()['rhs']
             f.setInput(dataIn)
             f.evaluate()
             print f.output() - dataOut
@@ -205,7 +244,7 @@ class RtIntegrator(object):
                                ctypes.c_void_p(dataOut.ctypes.data),
                                )
         if compareWithSX:
-            f = self._rtModelGen['rhsJacob']
+            f = self._getRtModelGen()['rhsJacob']
             f.setInput(dataIn)
             f.evaluate()
             print (f.output() - dataOut)
@@ -214,6 +253,7 @@ class RtIntegrator(object):
     def run(self,*args,**kwargs):
         raise Exception("to step an rt integrator, you now have to call .step(x,u,p) instead of .run(x,u,p)")
 
+    @instrumented
     def step(self,x=None,u=None,p=None):
         # x,u,p can be dicts or array-like
         # if x is a dict, the return value is a dict, otherwise it's a numpy array
@@ -255,6 +295,84 @@ class RtIntegrator(object):
             xret = numpy.copy(self.x)
         return xret
 
+    def _getBatchBuffer(self, name, nbatch, rowSize):
+        # reuse the same buffer as long as the batch size doesn't change
+        if not hasattr(self, name) or getattr(self, name).shape != (nbatch, rowSize):
+            setattr(self, name, numpy.zeros((nbatch, rowSize), dtype=numpy.double))
+        return getattr(self, name)
+
+    @instrumented
+    def stepBatch(self, X, U=None, P=None, resetIntegrator=True):
+        '''
+        Integrate every row of X in one call to the exported integrator.
+        X has shape (nbatch, nx). U and P can be (nbatch, nu)/(nbatch, np) arrays,
+        or single (nu,)/(np,) vectors which are used for every row.
+        If U or P are not given, the current self.u/self.p are used.
+        The current self.z is the algebraic state guess for every row.
+
+        Returns (X1, dx1_dx0, dx1_du) with shapes (nbatch, nx), (nbatch, nx, nx), (nbatch, nx, nu).
+        This does not change self.x/self.u/self.p or the single step sensitivities.
+        '''
+        nx = self.x.size
+        nz = self.z.size
+        nu = self.u.size
+        np = self.p.size
+
+        X = numpy.asarray(X, dtype=numpy.double)
+        if X.ndim == 1:
+            X = X.reshape((1, X.size))
+        nbatch = X.shape[0]
+        assert X.shape == (nbatch, nx), \
+            'X must have shape (nbatch, '+str(nx)+'), you gave '+str(X.shape)
+        if U is None:
+            U = self.u
+        if P is None:
+            P = self.p
+        U = numpy.asarray(U, dtype=numpy.double)
+        P = numpy.asarray(P, dtype=numpy.double)
+        assert U.shape in [(nu,), (nbatch, nu)], \
+            'U must have shape ('+str(nu)+',) or ('+str(nbatch)+', '+str(nu)+'), you gave '+str(U.shape)
+        assert P.shape in [(np,), (nbatch, np)], \
+            'P must have shape ('+str(np)+',) or ('+str(nbatch)+', '+str(np)+'), you gave '+str(P.shape)
+
+        # same row layout as _data: [ x z d(x,z)/dx d(x,z)/d(u,p) u p]
+        i0 = nx + nz
+        i1 = i0 + (nx + nz)*nx
+        i2 = i1 + (nx + nz)*(nu + np)
+        i3 = i2 + nu
+        rowSize = i3 + np
+
+        data = self._getBatchBuffer('_batchData', nbatch, rowSize)
+        data[:, :nx] = X
+        data[:, nx:i0] = self.z
+        data[:, i2:i3] = U
+        data[:, i3:] = P
+
+        nullPtr = ctypes.POINTER(ctypes.c_double)()
+        if self._measurements is None:
+            measPtr = nullPtr
+            measRowSize = 0
+        else:
+            nh = self.h.size
+            measRowSize = nh + nh*nx + nh*(nu + np)
+            measData = self._getBatchBuffer('_batchMeasData', nbatch, measRowSize)
+            measPtr = ctypes.c_void_p(measData.ctypes.data)
+
+        failedRow = ctypes.c_int(0)
+        ret = self._integratorLib.integrate_batch(ctypes.c_void_p(data.ctypes.data), rowSize,
+                                                  measPtr, measRowSize,
+                                                  nbatch, int(resetIntegrator),
+                                                  ctypes.byref(failedRow))
+        assert ret==0, "integrator returned error "+str(ret)+" on batch row "+str(failedRow.value)
+        # the integrator state now belongs to the last batch row, make the next step start over
+        self._initIntegrator = 1
+
+        X1 = numpy.array(data[:, :nx])
+        dx1_dx0 = numpy.array(data[:, i0:i1].reshape((nbatch, nx + nz, nx))[:, :nx, :])
+        dx1_du = numpy.array(data[:, i1:i2].reshape((nbatch, nx + nz, nu + np))[:, :nx, :nu])
+        return (X1, dx1_dx0, dx1_du)
+
+    @instrumented
     def getOutputs(self, x=None, u=None, p=None):
         # vectorize inputs
         if x != None:
@@ -263,11 +381,12 @@ class RtIntegrator(object):
             self.u = u
         if p != None:
             self.p = p
-        self._outputsFun.setInput(self.x, 0)
-        self._outputsFun.setInput(self.u, 1)
-        self._outputsFun.setInput(self.p, 2)
-        self._outputsFun.evaluate()
+        outputsFun = self._getOutputsFun()
+        outputsFun.setInput(self.x, 0)
+        outputsFun.setInput(self.u, 1)
+        outputsFun.setInput(self.p, 2)
+        outputsFun.evaluate()
         ret = {}
         for k,name in enumerate(self._dae.outputNames()):
-            ret[name] = numpy.array(self._outputsFun.output(k))
+            ret[name] = numpy.array(outputsFun.output(k))
         return ret
@@ -19,7 +19,9 @@ import ctypes
 import os
 from multiprocessing import Process, Queue
 
-from ..utils import codegen, subprocess_tee
+import casadi as C
+
+from ..utils import codegen, subprocess_tee, artifactcache
 import rtModelExport
 import rtIntegratorInterface
 
@@ -56,6 +58,31 @@ clean :
 """ % {'cfiles':' '.join(cfiles), 'cxxfiles':' '.join(cxxfiles)}
 
 
+def batchSource(measurements):
+    # loop over many (x,z,sensitivities,u,p) rows in one native call
+    if measurements is None:
+        call = 'integrate(data + k*rowSize, resetIntegrator)'
+    else:
+        call = 'integrate(data + k*rowSize, measData + k*measRowSize, resetIntegrator)'
+    return """\
+#include "acado.h"
+
+int integrate_batch(real_t * const data, const int rowSize,
+                    real_t * const measData, const int measRowSize,
+                    const int nbatch, const int resetIntegrator, int * const failedRow){
+  int k;
+  int ret;
+  for (k = 0; k < nbatch; k++){
+    ret = %(call)s;
+    if (ret != 0){
+      *failedRow = k;
+      return ret;
+    }
+  }
+  return 0;
+}
+""" % {'call':call}
+
 def writeRtIntegrator(dae, options, measurements):
     # write the exporter file
     files = {'export_integrator.cpp':rtIntegratorInterface.phase1src(dae, options, measurements),
@@ -89,12 +116,35 @@ def writeRtIntegrator(dae, options, measurements):
         "error exporting integrator, see stdout/stderr above"
     return ret
 
-def exportIntegrator(dae, timestep, options, measurements):
+def integratorCacheKey(dae, timestep, options, measurements, sparseJacobians):
+    pieces = [artifactcache.fingerprintDae(dae),
+              repr(float(timestep)),
+              'sparseJacobians '+repr(bool(sparseJacobians)),
+              rtIntegratorInterface.phase1src(dae, options, measurements),
+              makeMakefile([], []),
+              batchSource(measurements),
+              artifactcache.fingerprintToolchain(['gcc','g++'])]
+    if measurements is not None:
+        xdot = C.veccat([dae.ddt(name) for name in dae.xNames()])
+        pieces.append(artifactcache.fingerprintSX([dae.xVec(), dae.zVec(), dae.uVec(), dae.pVec(), xdot],
+                                                  [measurements]))
+    return artifactcache.makeKey('rt_integrator', pieces)
+
+def exportIntegrator(dae, timestep, options, measurements, sparseJacobians=False):
+    # if this exact integrator has been built before, load it without generating anything
+    cacheKey = integratorCacheKey(dae, timestep, options, measurements, sparseJacobians)
+    cachedPath = artifactcache.lookup(cacheKey, ['integrator.so','model.so'])
+    if cachedPath is not None:
+        print 'loading cached '+cachedPath+'/integrator.so'
+        integratorLib = ctypes.cdll.LoadLibrary(cachedPath+'/integrator.so')
+        modelLib = ctypes.cdll.LoadLibrary(cachedPath+'/model.so')
+        return (integratorLib, modelLib, None)
+
     # get the exported integrator files
     exportedFiles = writeRtIntegrator(dae, options, measurements)
 
     # model file
-    rtModelGen = rtModelExport.generateCModel(dae,timestep, measurements)
+    rtModelGen = rtModelExport.generateCModel(dae,timestep, measurements, sparseJacobians)
     modelFile = '''\
 #include "acado.h"
 #include "rhs.h"
@@ -110,7 +160,7 @@ def exportIntegrator(dae, timestep, options, measurements):
     symbolicsFiles = ['rhs.cpp','rhsJacob.cpp']
     if measurements is not None:
         symbolicsFiles += ['measurements.cpp', 'measurementsJacob.cpp']
-    makefile = makeMakefile(['workspace.c', 'model.c', 'integrator.c'],
+    makefile = makeMakefile(['workspace.c', 'model.c', 'integrator.c', 'batch.c'],
                             symbolicsFiles)
 
     # write the static workspace file (temporary)
@@ -127,6 +177,7 @@ ACADOvariables acadoVariables;
                 'rhsJacob.cpp': '#include "rhsJacob.h"\n'+rtModelGen['rhsJacobFile'][0],
                 'rhsJacob.h': rtModelGen['rhsJacobFile'][1],
                 'workspace.c': workspace,
+                'batch.c': batchSource(measurements),
                 'Makefile': makefile}
     if measurements is not None:
         genfiles['measurements.cpp'] = '#include "measurements.h"\n'+rtModelGen['measurementsFile'][0]
@@ -139,6 +190,7 @@ ACADOvariables acadoVariables;
     (ret, msgs) = subprocess_tee.call(['make',codegen.makeJobs()], cwd=exportpath)
     if ret != 0:
         raise Exception("integrator compilation failed:\n"+msgs)
+    artifactcache.store(cacheKey, exportpath, ['integrator.so','model.so'])
 
     print 'loading '+exportpath+'/integrator.so'
     integratorLib = ctypes.cdll.LoadLibrary(exportpath+'/integrator.so')
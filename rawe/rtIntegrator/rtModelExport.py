@@ -15,11 +15,26 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
 
+import numpy
 import casadi as C
 
 from ..utils import codegen
 
-def generateCModel(dae,timeScaling,measurements):
+def modelFuns(dae,timeScaling,measurements,sparseJacobians=False):
+    '''
+    The SXFunctions which generateCModel writes to C, as a list of (function, name).
+    With sparseJacobians, the jacobians are named rhsJacobSparse/measurementsJacobSparse
+    and only output their structural nonzeros, see modelSources.
+    '''
+    def jacobFun(jac, name):
+        if sparseJacobians:
+            fun = C.SXFunction( [inputs], [jac] )
+            fun.init()
+            return (fun, name+'Sparse')
+        fun = C.SXFunction( [inputs], [C.densify(jac)] )
+        fun.init()
+        return (fun, name)
+
     xdot = C.veccat([dae.ddt(name) for name in dae.xNames()])
     inputs = C.veccat([dae.xVec(), dae.zVec(), dae.uVec(), dae.pVec(), xdot])
     f = dae.getResidual()
@@ -31,18 +46,11 @@ def generateCModel(dae,timeScaling,measurements):
     [f] = rhs.eval([C.veccat([dae.xVec(), dae.zVec(), dae.uVec(), dae.pVec(), xdot/timeScaling])])
     rhs = C.SXFunction( [inputs], [C.densify(f)] )
     rhs.init()
-    rhsString = codegen.writeCCode(rhs, 'rhs')
 
     # dae residual jacobian
     jf = C.veccat( [ C.jacobian(f,inputs).T ] )
-    rhsJacob = C.SXFunction( [inputs], [C.densify(jf)] )
-    rhsJacob.init()
-    rhsJacobString = codegen.writeCCode(rhsJacob, 'rhsJacob')
 
-    ret = {'rhs':rhs,
-           'rhsJacob':rhsJacob,
-           'rhsFile':rhsString,
-           'rhsJacobFile':rhsJacobString}
+    ret = [(rhs, 'rhs'), jacobFun(jf, 'rhsJacob')]
 
     if measurements is not None:
         # measurements
@@ -51,16 +59,73 @@ def generateCModel(dae,timeScaling,measurements):
         [measurements] = measurementsFun.eval([C.veccat([dae.xVec(), dae.zVec(), dae.uVec(), dae.pVec(), xdot/timeScaling])])
         measurementsFun = C.SXFunction( [inputs], [C.densify(measurements)] )
         measurementsFun.init()
-        measurementsString = codegen.writeCCode(measurementsFun, 'measurements')
-        ret['measurements'] = measurementsFun
-        ret['measurementsFile'] = measurementsString
 
         # measurements jacobian
         jo = C.veccat( [ C.jacobian(measurements,inputs).T ] )
-        measurementsJacobFun = C.SXFunction( [inputs], [C.densify(jo)] )
-        measurementsJacobFun.init()
-        measurementsJacobString = codegen.writeCCode(measurementsJacobFun, 'measurementsJacob')
-        ret['measurementsJacob'] = measurementsJacobFun
-        ret['measurementsJacobFile'] = measurementsJacobString
+        ret += [(measurementsFun, 'measurements'), jacobFun(jo, 'measurementsJacob')]
+
+    return ret
+
+def writeScatter(name, sparseFun, sparseSource):
+    '''
+    Given the C code for a function with a sparse vector output, write
+    "name" with the usual dense output, which zeros it and scatters the nonzeros into it.
+    '''
+    out = sparseFun.output(0)
+    nnz = out.size()
+    # label every nonzero with its index+1 and see where it lands in the dense vector
+    marker = numpy.array(C.densify(C.DMatrix(out.sparsity(), [float(k+1) for k in range(nnz)]))).flatten()
+    index = [0]*nnz
+    for i,v in enumerate(marker):
+        if v != 0:
+            index[int(v)-1] = i
+
+    src = sparseSource[0] + '''
+static const int %(name)s_index[%(nnzArray)d] = {%(index)s};
+
+void %(name)s(const double* x0, double* r0){
+  double nz[%(nnzArray)d];
+  int k;
+  %(name)sSparse(x0, nz);
+  for (k = 0; k < %(ndense)d; k++) r0[k] = 0;
+  for (k = 0; k < %(nnz)d; k++) r0[%(name)s_index[k]] = nz[k];
+}
+
+int %(name)sWrap(const double** x, double** r){
+  %(name)s(x[0], r[0]);
+  return 0;
+}
+''' % {'name':name, 'nnz':nnz, 'nnzArray':max(nnz,1), 'ndense':marker.size,
+       'index':', '.join([str(i) for i in index]) if nnz > 0 else '0'}
+    header = sparseSource[1] + codegen.writeCHeader(name,
+        ['void '+name+'(const double* x0, double* r0)',
+         'int '+name+'Wrap(const double** x, double** r)'])
+    print '%s: %d of %d jacobian entries are structurally nonzero' % (name, nnz, marker.size)
+    return (src, header)
+
+def modelSources(funs, sources):
+    '''
+    Turn the output of writeCCodeParallel(modelFuns(...)) into {name:(src,header)}
+    with the dense names (rhs, rhsJacob, ...) ACADO expects.
+    '''
+    ret = {}
+    for (f,name) in funs:
+        if name.endswith('Sparse'):
+            denseName = name[:-len('Sparse')]
+            ret[denseName] = writeScatter(denseName, f, sources[name])
+        else:
+            ret[name] = sources[name]
+    return ret
+
+def generateCModel(dae,timeScaling,measurements,sparseJacobians=False):
+    funs = modelFuns(dae,timeScaling,measurements,sparseJacobians)
+    # the C code for each function is written in parallel
+    (sources, timings) = codegen.writeCCodeParallel(funs)
+    files = modelSources(funs, sources)
 
+    ret = {'timings':timings}
+    for (f,name) in funs:
+        ret[name] = f
+    for name,src in files.items():
+        ret[name+'File'] = src
     return ret
@@ -20,6 +20,8 @@ import casadi as C
 import numpy
 import matplotlib.pyplot as plt
 
+from utils.mmaplog import MmapLog, MmapLogReader
+
 def getitemMsg(d,name,msg):
     try:
         return d[name]
@@ -94,7 +96,10 @@ class Sim(object):
         listOut=[]
         for n in self.outputNames: listOut.append([])
         self._log = {'x':[],'u':[],'y':[],'yN':[],'outputs':dict(zip(self.outputNames,listOut))}
-        
+        self._fileLog = None
+        # simulate() functions by (number of steps, with outputs)
+        self._rolloutFuns = {}
+
     def step(self, x, u, p):
         (xVec,uVec,pVec) = vectorizeXUP(x,u,p,self.dae)
         self.integrator.setInput(xVec,C.INTEGRATOR_X0)
@@ -109,6 +114,70 @@ class Sim(object):
             ret = xNext
         return ret
 
+    def _rolloutFun(self, N, withOutputs):
+        key = (N, withOutputs)
+        if key not in self._rolloutFuns:
+            nx = len(self.xNames)
+            nu = len(self.uNames)
+            npar = len(self.dae.pNames())
+            x0 = C.msym('x0',nx)
+            U = C.msym('U',nu,N)
+            p = C.msym('p',npar)
+            # chain the integrator over the control sequence, one evaluate() does the whole rollout
+            xs = [x0]
+            for k in range(N):
+                xs.append(self.integrator.call([xs[-1],C.veccat([U[:,k],p])])[C.INTEGRATOR_XF])
+            outs = [C.horzcat(xs)]
+            if withOutputs and self.outputsFun0 is not None:
+                # controls are held at the last grid point
+                allOuts = [self.outputsFun0.call([xs[k],U[:,min(k,N-1)],p]) for k in range(N+1)]
+                for j in range(len(self.outputs0names)):
+                    (r,c) = (allOuts[0][j].size1(), allOuts[0][j].size2())
+                    # one row major column per grid point
+                    outs.append(C.horzcat([C.veccat([o[j][i0,i1] for i0 in range(r) for i1 in range(c)])
+                                           for o in allOuts]))
+            f = C.MXFunction([x0,U,p],outs)
+            f.init()
+            self._rolloutFuns[key] = f
+        return self._rolloutFuns[key]
+
+    def simulate(self, x0, U, p, outputs=False):
+        '''
+        Integrate from x0 over the N steps of the control sequence U (N by nu, one row per step).
+        x0 and p are dicts or vectors like in step(). Returns the (N+1, nx) states at the grid
+        points, and with outputs=True also a dict of the outputs at every grid point
+        ((N+1,) for scalars, (N+1, rows, cols) otherwise), the last one with the last control.
+        '''
+        U = numpy.array(U,dtype=numpy.double)
+        if U.ndim == 1 and len(self.uNames) == 1:
+            # a sequence of the only control
+            U = U.reshape(-1,1)
+        U = numpy.atleast_2d(U)
+        N = U.shape[0]
+        assert N > 0, "need at least one control"
+        assert U.shape[1] == len(self.uNames), \
+            "U has "+str(U.shape[1])+" columns, there are "+str(len(self.uNames))+" controls"
+        (xVec,_,pVec) = vectorizeXUP(x0,[],p,self.dae)
+
+        f = self._rolloutFun(N, outputs)
+        f.setInput(xVec,0)
+        f.setInput(numpy.ascontiguousarray(U.T),1)
+        f.setInput(pVec,2)
+        f.evaluate()
+        X = numpy.array(f.output(0)).reshape(len(self.xNames),N+1).T
+        if not outputs:
+            return X
+        outs = {}
+        if self.outputsFun0 is not None:
+            for j,name in enumerate(self.outputs0names):
+                (r,c) = (self.outputsFun0.output(j).size1(), self.outputsFun0.output(j).size2())
+                vals = numpy.array(f.output(j+1)).reshape(r*c,N+1).T
+                if (r,c) == (1,1):
+                    outs[name] = vals[:,0]
+                else:
+                    outs[name] = vals.reshape(N+1,r,c)
+        return (X,outs)
+
     def getOutputs(self, x, u, p):
         if self.outputsFun0 == None:
             return {}
@@ -122,7 +191,38 @@ class Sim(object):
             ret[name] = maybeToScalar(C.DMatrix(self.outputsFun0.output(k)))
         return ret
     
+    def logToFile(self, directory, chunkRows=10000):
+        '''
+        Send log() to a memory mapped log in directory instead of the in-memory lists,
+        open it again with rawe.utils.mmaplog.openLog.
+        '''
+        self.closeLogFile()
+        fields = [('x', (len(self.xNames),)), ('u', (len(self.uNames),))]
+        if self.outputsFun0 != None:
+            for k,name in enumerate(self.outputs0names):
+                sh = (self.outputsFun0.output(k).size1(), self.outputsFun0.output(k).size2())
+                # log() squeezes the values, so the fields have to be squeezed too
+                fields.append(('outputs/'+name, numpy.squeeze(numpy.zeros(sh)).shape))
+        meta = {'xNames':self.xNames, 'uNames':self.uNames,
+                'outputNames':self.outputs0names, 'ts':float(self._ts)}
+        self._fileLog = MmapLog(directory, fields=fields, meta=meta, chunkRows=chunkRows)
+
+    def closeLogFile(self):
+        if self._fileLog is not None:
+            self._fileLog.close()
+            self._fileLog = None
+
     def log(self,new_x=None,new_u=None,new_y=None,new_yN=None,new_out=None):
+        if self._fileLog is not None:
+            row = {}
+            for (name,val) in [('x',new_x),('u',new_u),('y',new_y),('yN',new_yN)]:
+                if val != None:
+                    row[name] = numpy.squeeze(numpy.array(val))
+            if new_out != None:
+                for name in new_out.keys():
+                    row['outputs/'+name] = numpy.squeeze(numpy.array(new_out[name]))
+            self._fileLog.append(row)
+            return
         if new_x != None:
             self._log['x'].append(numpy.array(new_x))
         if new_u != None:
@@ -140,6 +240,11 @@ class Sim(object):
             names = [names]
         assert isinstance(names,list)
 
+        logData = self._log
+        if self._fileLog is not None:
+            self._fileLog.flush()
+            logData = MmapLogReader(self._fileLog.directory)
+
         legend = []
         for name in names:
             assert isinstance(name,str)
@@ -148,20 +253,20 @@ class Sim(object):
             # if it's a differential state
             if name in self.xNames:
                 index = self.xNames.index(name)
-                ys = numpy.squeeze(self._log['x'])[:,index]
+                ys = numpy.squeeze(logData['x'])[:,index]
                 ts = numpy.arange(len(ys))*self._ts
                 plt.plot(ts,ys,style)
                 
             # if it's a control
             if name in self.uNames:
                 index = self.uNames.index(name)
-                ys = numpy.squeeze(self._log['u'])[:,index]
+                ys = numpy.squeeze(logData['u'])[:,index]
                 ts = numpy.arange(len(ys))*self._ts
                 plt.step(ts,ys,style)
                 
             if name in self.outputNames:
                 index = self.outputNames.index(name)
-                ys = numpy.squeeze(self._log['outputs'][name])
+                ys = numpy.squeeze(logData['outputs'][name])
                 ts = numpy.arange(len(ys))*self._ts
                 plt.plot(ts,ys,style)
 
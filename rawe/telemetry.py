@@ -15,17 +15,24 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import time
 import zmq
-from multiprocessing import Manager, Process
+from multiprocessing import Process
 import numpy
 
 from rawe.collocation import trajectory
+from rawe.utils.shmbuffer import LatestValueBuffer
 
 def startTelemetry(ocp, callbacks=[],
                    printBoundViolation=False,printConstraintViolation=False,
-                   url="tcp://*:5563"):
-    xOptQueue = Manager().Queue()
-    Sender(ocp, xOptQueue, callbacks, url).start()
+                   url="tcp://*:5563", maxRate=20.0):
+    """
+    maxRate is the most frames per second the sender publishes, None for as fast as it can.
+    """
+    # the sender only ever wants the newest iterate
+    xOptBuffer = LatestValueBuffer(ocp.getNV())
+    Sender(ocp, xOptBuffer, callbacks, url, maxRate=maxRate).start()
 
     class MyCallback:
         def __call__(self,f,*args):
@@ -44,18 +51,27 @@ def startTelemetry(ocp, callbacks=[],
                 g = ocp._gfcn.output()
                 ocp._constraints.printViolations(g,lbg,ubg,reportThreshold=0)
 
-            xOptQueue.put(xOpt)
+            xOptBuffer.write(xOpt)
 
     return MyCallback()
 
 
 class Sender(Process):
-    def __init__(self, ocp, xOptQueue, callbackFunsWithChannels, url):
+    """
+    Publishes the newest iterate at most maxRate times per second. One Trajectory is
+    built for the first frame and updated in place after that. Callbacks may have a
+    "fields" attribute listing the names they use (see trajectoryCallback); if none of
+    them needs outputs or quadrature states, those aren't evaluated.
+    """
+    def __init__(self, ocp, xOptBuffer, callbackFunsWithChannels, url, pollInterval=0.005, maxRate=None):
         Process.__init__(self)
         self.daemon = True
 
         self.ocp = ocp
-        self.xOptQueue = xOptQueue
+        self.xOptBuffer = xOptBuffer
+        self.pollInterval = pollInterval
+        self.maxRate = maxRate
+        self.parentPid = os.getpid()
         self.url = url
         msg = "callbacks must be a list of (callback (function), channel (string)) tuples"
         if not isinstance(callbackFunsWithChannels, list):
@@ -66,39 +82,127 @@ class Sender(Process):
         self.callbackFunsWithChannels = callbackFunsWithChannels
 
     def run(self):
-        myiter = 0
         context   = zmq.Context(1)
         publisher = context.socket(zmq.PUB)
         publisher.bind(self.url)
 
-        try:
-            while True:
-                xOpt = self.xOptQueue.get()
-                # empty the queue
-                while not self.xOptQueue.empty():
-                    xOpt = self.xOptQueue.get()
-                    myiter += 1
+        # names any callback needs, None for everything
+        names = set()
+        for callbackFun, _ in self.callbackFunsWithChannels:
+            fields = getattr(callbackFun, 'fields', None)
+            if fields is None:
+                names = None
+                break
+            names.update(fields)
+
+        traj = None
+        lastFrame = None
+        myiter = 0
+        while True:
+            if self.maxRate is not None and lastFrame is not None:
+                wait = lastFrame + 1.0/self.maxRate - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+            (myiter, xOpt) = self.xOptBuffer.read(myiter)
+            if xOpt is None:
+                # parent died
+                if os.getppid() != self.parentPid:
+                    return
+                time.sleep(self.pollInterval)
+                continue
+            lastFrame = time.time()
+            if traj is None:
                 traj = trajectory.Trajectory(self.ocp, xOpt)
-                for callbackFun, zeromqChannel in self.callbackFunsWithChannels:
-                    mcStr = callbackFun(traj,myiter,self.ocp)
-                    publisher.send_multipart([zeromqChannel, mcStr])
-        except EOFError:
-            pass
+            else:
+                traj.update(self.ocp, xOpt, names)
+            for callbackFun, zeromqChannel in self.callbackFunsWithChannels:
+                mcStr = callbackFun(traj,myiter,self.ocp)
+                publisher.send_multipart([zeromqChannel, mcStr])
 
-def trajectoryCallback(toProto,protoTraj,showAllPoints=False):
+def _nodes(ocp,showAllPoints):
+    # (timesteps, nicpIdxs, degIdxs) index arrays of the published points
+    if showAllPoints:
+        degIdxRange = range(ocp.deg+1)
+    else:
+        degIdxRange = [0]
+    nodes = [(k,nicpIdx,degIdx) for k in range(0,ocp.nk)
+             for nicpIdx in range(0,ocp.nicp) for degIdx in degIdxRange]
+    return tuple(numpy.array(nodes,dtype=int).T)
+
+def trajectoryCallback(toProto,protoTraj,showAllPoints=False,fields=None):
+    """
+    With fields (a list of names) only those are looked up and serialized,
+    toProto must then take (lookup, fields) as mkprotobufs generates it.
+    """
+    if fields is not None:
+        fields = set(fields)
     def callback(traj,myiter,ocp):
-        protos = []
-        for k in range(0,ocp.nk):
-            for nicpIdx in range(0,ocp.nicp):
-                if showAllPoints:
-                    degIdxRange = range(ocp.deg+1)
-                else:
-                    degIdxRange = [0]
-                for degIdx in degIdxRange:
-                    lookup = lambda name: traj.lookup(name,timestep=k,nicpIdx=nicpIdx,degIdx=degIdx)
-                    protos.append( toProto(lookup) )
+        if callback.nodes is None:
+            callback.nodes = _nodes(ocp,showAllPoints)
+        nodes = callback.nodes
+
+        # every name at every node in one lookup, when toProto first asks for it
+        values = {}
+        def nodeValues(name):
+            if name not in values:
+                if fields is not None and name not in fields:
+                    raise KeyError('"'+name+'" is not in the fields of this callback')
+                values[name] = traj.nodeValues(name,*nodes)
+            return values[name]
+
         mc = protoTraj()
-        mc.traj.extend(list(protos))
+        for j in range(len(nodes[0])):
+            def lookup(name):
+                (vals,defined) = nodeValues(name)
+                if not defined[j]:
+                    raise ValueError('"'+name+'" is not defined at node '+str(j))
+                return vals[j]
+            if fields is None:
+                mc.traj.add().CopyFrom(toProto(lookup))
+            else:
+                mc.traj.add().CopyFrom(toProto(lookup,fields))
+
+        if fields is None:
+            return mc.SerializeToString()
+        # unsubscribed required fields are left out
+        return mc.SerializePartialToString()
+    callback.nodes = None
+    callback.fields = fields
+    return callback
+
+def columnsTrajectoryCallback(toColumnsProto,showAllPoints=False,fields=None):
+    """
+    Publish a TrajectoryColumns (one packed array per variable) with the toColumnsProto
+    mkprotobufs generates, much smaller and faster to fill than a Trajectory.
+    """
+    if fields is not None:
+        fields = set(fields)
+    def callback(traj,myiter,ocp):
+        if callback.nodes is None:
+            callback.nodes = _nodes(ocp,showAllPoints)
+        nodes = callback.nodes
+
+        def columns(name):
+            (vals,defined) = traj.nodeValues(name,*nodes)
+            if vals.dtype != object:
+                ret = numpy.array(vals,dtype=float)
+                ret[~defined] = numpy.nan
+                return ret
+            # outputs, None where undefined
+            shape = None
+            for v in vals[defined]:
+                shape = numpy.shape(v)
+                break
+            if shape is None:
+                raise ValueError('"'+name+'" is not defined at any node')
+            ret = numpy.nan*numpy.ones((len(vals),)+shape)
+            for j in numpy.where(defined)[0]:
+                ret[j] = vals[j]
+            return ret
 
-        return mc.SerializeToString()
+        msg = toColumnsProto(columns,time=traj.tgrid[nodes],fields=fields)
+        msg.iteration = myiter
+        return msg.SerializeToString()
+    callback.nodes = None
+    callback.fields = fields
     return callback
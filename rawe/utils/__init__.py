@@ -20,3 +20,8 @@ import pkgconfig
 import subprocess_tee
 import mkprotobufs
 import options
+import artifactcache
+import ringlog
+import mmaplog
+import instrumentation
+import shmbuffer
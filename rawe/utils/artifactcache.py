@@ -0,0 +1,243 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Content-addressed cache of compiled shared objects (integrator.so, ocp.so, ...).
+
+codegen.memoizeFiles only notices that nothing changed *after* all the C code has been
+generated, so a warm start still pays for symbolic differentiation, code emission and
+the phase 1 exporter. Here the key is computed from the symbolic model itself
+(the SX algorithm of the residual/objectives/measurements), the options and the toolchain,
+so on a hit the shared objects can be loaded right away.
+
+Entries live in ~/.rawesome/artifact_cache/<prefix>__<key>/ and are evicted least recently
+used first once the cache is bigger than RAWESOME_ARTIFACT_CACHE_MB megabytes.
+Set RAWESOME_ARTIFACT_CACHE=0 to disable the cache.
+
+usage: python -m rawe.utils.artifactcache {list,prune,clear}
+'''
+
+import os
+import sys
+import time
+import json
+import shutil
+import hashlib
+import tempfile
+
+import casadi as C
+
+from codegen import rawesomeDataPath
+
+# bump this whenever the generated code changes in a way the key can't see
+cacheVersion = 1
+
+cachePath = os.path.join(rawesomeDataPath, 'artifact_cache')
+
+defaultMaxMegabytes = 1024
+
+def isEnabled():
+    return os.environ.get('RAWESOME_ARTIFACT_CACHE', '1') not in ['0', '', 'no', 'false']
+
+def maxBytes():
+    return int(float(os.environ.get('RAWESOME_ARTIFACT_CACHE_MB', defaultMaxMegabytes))*1024*1024)
+
+def fingerprintSX(inputs, outputs):
+    '''
+    Return a string which uniquely describes the algorithm of SXFunction(inputs, outputs).
+    This walks the algorithm once, so unlike printing the expressions
+    it is linear in the size of the graph and does no differentiation.
+    '''
+    f = C.SXFunction(inputs, [C.densify(o) for o in outputs])
+    f.init()
+    assert len(f.getFree()) == 0, "can't fingerprint function with free variables: "+str(f.getFree())
+
+    ret = ['in'+str([f.input(k).size() for k in range(f.getNumInputs())]),
+           'out'+str([f.output(k).size() for k in range(f.getNumOutputs())])]
+    for i in range(f.getAlgorithmSize()):
+        op = f.getAtomicOperation(i)
+        if op == C.OP_CONST:
+            ret.append('%d %d %r' % (op, f.getAtomicOutput(i), f.getAtomicInputReal(i)))
+        else:
+            (i2, i3) = f.getAtomicInput(i)
+            ret.append('%d %d %d %d' % (op, f.getAtomicOutput(i), i2, i3))
+    return '\n'.join(ret)
+
+def fingerprintDae(dae):
+    '''
+    Fingerprint of the dae residual as a function of x/z/u/p/xdot, including the variable names.
+    '''
+    names = [dae.xNames(), dae.zNames(), dae.uNames(), dae.pNames()]
+    inputs = [dae.xVec(), dae.zVec(), dae.uVec(), dae.pVec(), dae.xDotVec()]
+    return str(names) + '\n' + fingerprintSX(inputs, [dae.getResidual()])
+
+def _which(program):
+    if os.path.isabs(program):
+        return program
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        candidate = os.path.join(path, program)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return os.path.realpath(candidate)
+    return program
+
+def fingerprintToolchain(programs):
+    '''
+    Identify the compilers by their resolved location, size and modification time.
+    This doesn't spawn any processes, so it's cheap enough to do on every lookup.
+    '''
+    ret = [sys.platform, os.environ.get('PKG_CONFIG_PATH', '')]
+    for program in programs:
+        path = _which(program)
+        try:
+            st = os.stat(path)
+            ret.append('%s %d %d' % (path, st.st_size, int(st.st_mtime)))
+        except OSError:
+            ret.append(path)
+    return '\n'.join(ret)
+
+def makeKey(prefix, pieces):
+    '''
+    Hash a list of strings into a cache key.
+    '''
+    m = hashlib.md5()
+    m.update('rawesome artifact cache version '+str(cacheVersion)+'\n')
+    for piece in pieces:
+        assert isinstance(piece, str), "cache key pieces must be strings, got: "+str(type(piece))
+        m.update(str(len(piece))+':')
+        m.update(piece)
+    return prefix+'__'+m.hexdigest()
+
+def _entryPath(key):
+    return os.path.join(cachePath, key)
+
+def lookup(key, filenames):
+    '''
+    If all of filenames are cached under key, mark the entry as recently used
+    and return its directory. Otherwise return None.
+    '''
+    if not isEnabled():
+        return None
+    path = _entryPath(key)
+    for name in filenames:
+        if not os.path.isfile(os.path.join(path, name)):
+            return None
+    os.utime(path, None)
+    return path
+
+def store(key, srcdir, filenames):
+    '''
+    Copy filenames from srcdir (usually a memoized build directory) into the cache under key,
+    then evict old entries if the cache is too big. Returns the entry directory.
+    '''
+    if not isEnabled():
+        return None
+    if not os.path.exists(cachePath):
+        os.makedirs(cachePath)
+
+    # copy into a temporary directory first and move it into place,
+    # so a half written entry is never found by lookup
+    tmppath = tempfile.mkdtemp(dir=cachePath, prefix='.tmp_')
+    try:
+        size = 0
+        for name in filenames:
+            shutil.copy2(os.path.join(srcdir, name), os.path.join(tmppath, name))
+            size += os.path.getsize(os.path.join(tmppath, name))
+        with open(os.path.join(tmppath, 'manifest.json'), 'w') as f:
+            json.dump({'key':key, 'files':filenames, 'bytes':size,
+                       'source':srcdir, 'created':time.time()}, f)
+        path = _entryPath(key)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmppath, path)
+    finally:
+        if os.path.exists(tmppath):
+            shutil.rmtree(tmppath)
+
+    prune()
+    return path
+
+def _dirSize(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            size += os.path.getsize(os.path.join(root, name))
+    return size
+
+def entries():
+    '''
+    Return a list of (key, bytes, last used time), most recently used first.
+    '''
+    if not os.path.exists(cachePath):
+        return []
+    ret = []
+    for key in os.listdir(cachePath):
+        path = _entryPath(key)
+        if key.startswith('.') or not os.path.isdir(path):
+            continue
+        ret.append((key, _dirSize(path), os.path.getmtime(path)))
+    ret.sort(key=lambda e: -e[2])
+    return ret
+
+def prune(maxSize=None):
+    '''
+    Delete least recently used entries until the cache is at most maxSize bytes.
+    Returns the list of removed keys.
+    '''
+    if maxSize is None:
+        maxSize = maxBytes()
+    removed = []
+    total = 0
+    for (key, size, _) in entries():
+        total += size
+        if total > maxSize:
+            shutil.rmtree(_entryPath(key), ignore_errors=True)
+            removed.append(key)
+    return removed
+
+def clear():
+    return prune(maxSize=0)
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description='inspect or prune the rawesome artifact cache ('+cachePath+')')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('list', help='list cache entries, most recently used first')
+    pruneParser = subparsers.add_parser('prune', help='evict least recently used entries')
+    pruneParser.add_argument('--max-mb', type=float, default=None,
+                             help='size cap in megabytes (default: $RAWESOME_ARTIFACT_CACHE_MB or '+
+                             str(defaultMaxMegabytes)+')')
+    subparsers.add_parser('clear', help='remove every entry')
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        es = entries()
+        for (key, size, used) in es:
+            print '%-60s %8.2f MB  last used %s' % (key, size/1048576.0, time.ctime(used))
+        print '%d entries, %.2f MB total, cap %.2f MB' % \
+            (len(es), sum([e[1] for e in es])/1048576.0, maxBytes()/1048576.0)
+    elif args.command == 'prune':
+        maxSize = None
+        if args.max_mb is not None:
+            maxSize = int(args.max_mb*1024*1024)
+        for key in prune(maxSize):
+            print 'removed '+key
+    elif args.command == 'clear':
+        for key in clear():
+            print 'removed '+key
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -16,10 +16,13 @@
 # along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import time
 import hashlib
 import shutil
 import tempfile
+import traceback
 import multiprocessing
+from Queue import Empty
 
 rawesomeDataPath = os.path.expanduser("~/.rawesome")
 
@@ -158,7 +161,10 @@ def writeCCode(f, name):
     fun1 = proto1+'{\n' + \
            '  return '+namespace+'::evaluateWrap(x, r);\n}\n'
     codestring += fun0 + fun1
-    header = '''\
+    return (codestring, writeCHeader(name, [proto0, proto1]))
+
+def writeCHeader(name, protos):
+    return '''\
 #ifndef __%(name)s_H__
 #define __%(name)s_H__
 
@@ -173,5 +179,59 @@ extern "C" {
 #endif
 
 #endif // __%(name)s_H__
-''' % {'name':name, 'protos':proto0 + ';\n' + proto1 + ';'}
-    return (codestring, header)
+''' % {'name':name, 'protos':'\n'.join([p+';' for p in protos])}
+
+# Like writeCCode, but for a list of (SXFunction, name). Each function is written in its own
+# forked process, at most "processes" at once (default $RAWESOME_CODEGEN_PROCESSES or the number of cpus).
+# Returns ({name:(src,header)}, {name:seconds}).
+def writeCCodeParallel(funs, processes=None):
+    if processes is None:
+        processes = int(os.environ.get('RAWESOME_CODEGEN_PROCESSES', multiprocessing.cpu_count()))
+    names = [name for (_,name) in funs]
+    assert len(set(names)) == len(names), "duplicate names in "+str(names)
+
+    sources = {}
+    timings = {}
+    if processes <= 1 or len(funs) <= 1:
+        for (f,name) in funs:
+            t0 = time.time()
+            sources[name] = writeCCode(f, name)
+            timings[name] = time.time() - t0
+    else:
+        q = multiprocessing.Queue()
+        def work(k):
+            (f,name) = funs[k]
+            try:
+                t0 = time.time()
+                ret = writeCCode(f, name)
+                q.put((k, ret, time.time() - t0, None))
+            except:
+                q.put((k, None, 0.0, traceback.format_exc()))
+
+        pending = range(len(funs))
+        running = {}
+        try:
+            while len(pending) > 0 or len(running) > 0:
+                while len(pending) > 0 and len(running) < processes:
+                    k = pending.pop(0)
+                    running[k] = multiprocessing.Process(target=work, args=(k,))
+                    running[k].start()
+                try:
+                    (k, ret, dt, err) = q.get(timeout=1.0)
+                except Empty:
+                    for k,p in running.items():
+                        if not p.is_alive() and p.exitcode != 0:
+                            raise Exception('code generation for "'+names[k]+'" died with exit code '+str(p.exitcode))
+                    continue
+                running.pop(k).join()
+                if err is not None:
+                    raise Exception('code generation for "'+names[k]+'" failed:\n'+err)
+                sources[names[k]] = ret
+                timings[names[k]] = dt
+        finally:
+            for p in running.values():
+                p.terminate()
+
+    for name in names:
+        print 'generated %s: %.3f s, %d bytes' % (name, timings[name], len(sources[name][0]))
+    return (sources, timings)
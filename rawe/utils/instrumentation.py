@@ -0,0 +1,124 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Per instance timing counters for the real time classes (OcpRT, RtIntegrator, ...).
+
+Methods are wrapped with @instrumented. If the instance's _instrumentation is None
+(the default) the wrapper just calls through, otherwise it records a monotonic start/end
+timestamp, the duration and the change in the gc generation 0 count
+(a rough count of container objects allocated, which hints at hidden copies).
+'''
+
+import gc
+import sys
+import time
+import ctypes
+import ctypes.util
+
+def _makeClock():
+    # python 2 has no time.monotonic
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+    clockId = 6 if sys.platform == 'darwin' else 1 # CLOCK_MONOTONIC
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'))
+        clock_gettime = libc.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        ts = timespec()
+        tsref = ctypes.byref(ts)
+        if clock_gettime(clockId, tsref) != 0:
+            raise OSError('clock_gettime failed')
+    except (OSError, AttributeError, TypeError):
+        return time.time
+    def monotonic():
+        clock_gettime(clockId, tsref)
+        return ts.tv_sec + ts.tv_nsec*1e-9
+    return monotonic
+
+monotonic = _makeClock()
+
+class Counter(object):
+    __slots__ = ['count', 'total', 'min', 'max', 'lastStart', 'lastEnd', 'allocs']
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+        self.lastStart = 0.0
+        self.lastEnd = 0.0
+        self.allocs = 0
+
+    def toDict(self):
+        ret = {'count':self.count, 'total':self.total, 'max':self.max,
+               'lastStart':self.lastStart, 'lastEnd':self.lastEnd, 'allocs':self.allocs}
+        if self.count > 0:
+            ret['min'] = self.min
+            ret['mean'] = self.total/self.count
+        return ret
+
+class Instrumentation(object):
+    def __init__(self):
+        self._counters = {}
+
+    def record(self, name, t0, t1, allocs=0):
+        try:
+            c = self._counters[name]
+        except KeyError:
+            c = self._counters[name] = Counter()
+        dt = t1 - t0
+        c.count += 1
+        c.total += dt
+        if dt < c.min:
+            c.min = dt
+        if dt > c.max:
+            c.max = dt
+        c.lastStart = t0
+        c.lastEnd = t1
+        if allocs > 0:
+            c.allocs += allocs
+
+    def recordDuration(self, name, dt):
+        # for durations measured somewhere else (e.g. by ACADO)
+        t1 = monotonic()
+        self.record(name, t1 - dt, t1)
+
+    def counters(self):
+        '''
+        dict of name: {count, total, min, max, mean, lastStart, lastEnd, allocs}, times in seconds
+        '''
+        return dict([(name, c.toDict()) for name,c in self._counters.items()])
+
+    def reset(self):
+        self._counters = {}
+
+def instrumented(f):
+    name = f.__name__
+    def wrapper(self, *args, **kwargs):
+        ins = self._instrumentation
+        if ins is None:
+            return f(self, *args, **kwargs)
+        a0 = gc.get_count()[0]
+        t0 = monotonic()
+        try:
+            return f(self, *args, **kwargs)
+        finally:
+            t1 = monotonic()
+            ins.record(name, t0, t1, gc.get_count()[0] - a0)
+    wrapper.__name__ = f.__name__
+    wrapper.__doc__ = f.__doc__
+    return wrapper
@@ -52,6 +52,26 @@ def simpleMessage(dae, messagename, fieldnames, qualifier='required'):
     ret.append('}\n\n')
     return '\n'.join(ret)
 
+def packedMessage(dae, messagename, fieldnames):
+    # one packed column per element, the values at every node of a horizon
+    ret = []
+    ret.append('message '+messagename+' {')
+    k = 1
+    for name in fieldnames:
+        for idx in getIndices(dae[name]):
+            ret.append('  repeated double '+name+idx+' = '+str(k)+' [packed=true];')
+            k += 1
+    ret.append('}\n\n')
+    return '\n'.join(ret)
+
+# (proto field, Columns message, dae names) of TrajectoryColumns
+def columnFields(dae):
+    return [('differentialStates','DifferentialStatesColumns',dae.xNames()),
+            ('algebraicVars','AlgebraicVarsColumns',dae.zNames()),
+            ('controls','ControlsColumns',dae.uNames()),
+            ('parameters','ParametersColumns',dae.pNames()),
+            ('outputs','OutputsColumns',dae.outputNames())]
+
 def writeProtoSpec(topname, dae, measurementsX, measurementsU):
     protobufs = 'package '+topname+';\n\n'
     for (msgname,fieldnames) in daeNames(dae, measurementsX, measurementsU):
@@ -74,32 +94,109 @@ message Trajectory {
   optional int32 iteration = 2;
   repeated string messages = 3;
 }
+
+'''
+    # the same as Trajectory but one packed array per variable instead of one message per node,
+    # nan where a variable isn't defined, parameters only once
+    for (_,msgname,fieldnames) in columnFields(dae):
+        protobufs += packedMessage(dae, msgname, fieldnames)
+    protobufs += '''\
+message TrajectoryColumns {
+  repeated double time = 1 [packed=true];
+  optional DifferentialStatesColumns differentialStates = 2;
+  optional AlgebraicVarsColumns algebraicVars = 3;
+  optional ControlsColumns controls = 4;
+  optional ParametersColumns parameters = 5;
+  optional OutputsColumns outputs = 6;
+  optional int32 iteration = 7;
+  repeated string messages = 8;
+}
 '''
     return protobufs
 
 def writePythonGenerator(topname,dae):
-    lines = ['import '+topname+'_pb2']
+    lines = ['import numpy']
+    lines.append('import '+topname+'_pb2')
     lines.append('')
-    lines.append('def toProto(lookup):')
+    # (proto field, names), optional ones may fail to look up (z at degIdx 0, ...)
+    for (tableName,fieldsAndNames) in [('requiredFields',[('differentialStates',dae.xNames()),
+                                                           ('controls',dae.uNames()),
+                                                           ('parameters',dae.pNames())]),
+                                        ('optionalFields',[('algebraicVars',dae.zNames()),
+                                                           ('outputs',dae.outputNames())])]:
+        lines.append(tableName+' = [')
+        for (field,names) in fieldsAndNames:
+            lines.append('    (\''+field+'\', '+repr([str(name) for name in names])+'),')
+        lines.append('    ]')
+        lines.append('')
+    lines.append('def toProto(lookup, fields=None):')
+    lines.append('    """')
+    lines.append('    fields is the set of names to fill in, None for all of them')
+    lines.append('    """')
     lines.append('    dkp = '+topname+'_pb2.Dae()')
+    lines.append('    for (field,names) in requiredFields:')
+    lines.append('        msg = getattr(dkp,field)')
+    lines.append('        for name in names:')
+    lines.append('            if fields is None or name in fields:')
+    lines.append('                setattr(msg,name,lookup(name))')
+    lines.append('    for (field,names) in optionalFields:')
+    lines.append('        msg = getattr(dkp,field)')
+    lines.append('        for name in names:')
+    lines.append('            if fields is None or name in fields:')
+    lines.append('                try:')
+    lines.append('                    setattr(msg,name,lookup(name))')
+    lines.append('                except Exception:')
+    lines.append('                    pass')
+    lines.append('    return dkp')
     lines.append('')
-    for (field,names) in [('differentialStates',dae.xNames()),
-                          ('controls',dae.uNames()),
-                          ('parameters',dae.pNames())]:
-        lines.append('    # '+field)
-        for name in names:
-            lines.append('    dkp.'+field+'.'+name+' = lookup(\''+name+'\')')
-        lines.append('')
-    for (field,names) in [('algebraicVars',dae.zNames()),
-                          ('outputs',dae.outputNames())]:
-        lines.append('    # '+field)
+
+    # (proto field, [(column name, dae name, element)]) for the packer
+    lines.append('columnFields = [')
+    for (field,_,names) in columnFields(dae):
+        cols = []
         for name in names:
-            lines.append('    try:')
-            lines.append('        dkp.'+field+'.'+name+' = lookup(\''+name+'\')')
-            lines.append('    except Exception:')
-            lines.append('        pass')
-        lines.append('')
-    lines.append('    return dkp')
+            (nr,nc) = dae[name].shape
+            idxs = getIndices(dae[name])
+            if idxs == ['']:
+                cols.append((str(name), str(name), None))
+            elif 1 in [nr,nc]:
+                cols += [(str(name)+idx, str(name), k) for k,idx in enumerate(idxs)]
+            else:
+                # getIndices goes down the columns, the values are row major
+                cols += [(str(name)+'__'+str(jr)+'_'+str(jc), str(name), jr*nc+jc)
+                         for jc in range(nc) for jr in range(nr)]
+        lines.append('    (\''+field+'\', '+repr(cols)+'),')
+    lines.append('    ]')
+    lines.append('')
+    lines.append('def toColumnsProto(columns, time=None, fields=None):')
+    lines.append('    """')
+    lines.append('    Fill a TrajectoryColumns. columns(name) returns the values of name at every node,')
+    lines.append('    (nNodes,) or (nNodes,rows,cols) for matrices, nan where undefined.')
+    lines.append('    It may raise for names it doesn\'t have. fields is the set of names to fill in, None for all.')
+    lines.append('    """')
+    lines.append('    msg = '+topname+'_pb2.TrajectoryColumns()')
+    lines.append('    if time is not None:')
+    lines.append('        msg.time.extend(numpy.asarray(time,dtype=float).ravel().tolist())')
+    lines.append('    for (field,cols) in columnFields:')
+    lines.append('        sub = getattr(msg,field)')
+    lines.append('        values = {}')
+    lines.append('        for (colName,name,k) in cols:')
+    lines.append('            if fields is not None and name not in fields:')
+    lines.append('                continue')
+    lines.append('            if name not in values:')
+    lines.append('                try:')
+    lines.append('                    values[name] = numpy.asarray(columns(name),dtype=float)')
+    lines.append('                except Exception:')
+    lines.append('                    values[name] = None')
+    lines.append('            vals = values[name]')
+    lines.append('            if vals is None:')
+    lines.append('                continue')
+    lines.append('            if k is not None:')
+    lines.append('                vals = vals.reshape(vals.shape[0],-1)[:,k]')
+    lines.append('            if field == \'parameters\':')
+    lines.append('                vals = vals[:1]')
+    lines.append('            getattr(sub,colName).extend(vals.tolist())')
+    lines.append('    return msg')
     return ('\n'.join(lines)).strip()+'\n'
 
 def writeStruct(vecname,fieldnames,dae,realType='double'):
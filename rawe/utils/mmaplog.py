@@ -0,0 +1,212 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Append-only log of fixed width records in memory mapped binary files.
+
+A log is a directory with a schema.json and chunk_00000.bin, chunk_00001.bin, ...
+Every chunk holds chunkRows records of one numpy structured dtype,
+when a chunk is full the next one is created. Only the chunk being written is mapped,
+so the memory used doesn't grow with the length of the run.
+
+Open it again with MmapLogReader (or openLog) to get read-only memmap views of the columns.
+'''
+
+import os
+import glob
+import json
+import numpy
+
+schemaVersion = 1
+
+def _chunkName(k):
+    return 'chunk_%05d.bin' % k
+
+def _makeDtype(fields):
+    # _valid is set last, so a crashed writer leaves at most one unmarked row
+    return numpy.dtype([(str(name), numpy.double, tuple(shape)) for (name,shape) in fields] + \
+                       [('_valid', numpy.uint8)])
+
+class MmapLog(object):
+    '''
+    Writer. fields is a list of (name, shape) that are always in the schema,
+    names first seen in the first append are added to it.
+    Names missing from an append are logged as nan.
+    meta is any json-able dict stored alongside (xNames, uNames, outputNames, ts, ...).
+    '''
+    def __init__(self, directory, fields=None, meta=None, chunkRows=10000):
+        assert chunkRows > 0, "chunkRows must be positive"
+        if fields is None:
+            fields = []
+        if meta is None:
+            meta = {}
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        assert len(glob.glob(os.path.join(directory, 'chunk_*.bin'))) == 0, \
+            "there's already a log in "+directory
+        self.directory = directory
+        self.chunkRows = chunkRows
+        self._fields = [(name, tuple(shape)) for (name,shape) in fields]
+        self._meta = meta
+        self._dtype = None
+        self._chunk = None
+        self._chunkIndex = -1
+        self._row = chunkRows
+        self.rows = 0
+
+    def _writeSchema(self):
+        schema = {'version':schemaVersion,
+                  'fields':[[name, list(shape)] for (name,shape) in self._fields],
+                  'chunkRows':self.chunkRows,
+                  'meta':self._meta}
+        with open(os.path.join(self.directory, 'schema.json'), 'w') as f:
+            json.dump(schema, f, indent=2)
+
+    def _nextChunk(self):
+        if self._chunk is not None:
+            self._chunk.flush()
+        self._chunkIndex += 1
+        self._chunk = numpy.memmap(os.path.join(self.directory, _chunkName(self._chunkIndex)),
+                                   dtype=self._dtype, mode='w+', shape=(self.chunkRows,))
+        self._row = 0
+
+    def append(self, values):
+        if self._dtype is None:
+            known = set([name for (name,_) in self._fields])
+            for name in sorted(values.keys()):
+                if name not in known:
+                    self._fields.append((name, numpy.shape(values[name])))
+            self._dtype = _makeDtype(self._fields)
+            self._names = set([name for (name,_) in self._fields])
+            self._writeSchema()
+        for name in values:
+            if name not in self._names:
+                raise Exception('"'+name+'" is not in the log schema: '+str(sorted(self._names)))
+        if self._row == self.chunkRows:
+            self._nextChunk()
+
+        # structured scalars are views, so this writes straight into the map
+        record = self._chunk[self._row]
+        for name,_ in self._fields:
+            if name in values:
+                record[name] = values[name]
+            else:
+                record[name] = numpy.nan
+        record['_valid'] = 1
+        self._row += 1
+        self.rows += 1
+
+    def flush(self):
+        if self._chunk is not None:
+            self._chunk.flush()
+
+    def close(self):
+        if self._chunk is None:
+            return
+        self._chunk.flush()
+        del self._chunk
+        self._chunk = None
+        # drop the unused part of the last chunk
+        with open(os.path.join(self.directory, _chunkName(self._chunkIndex)), 'r+b') as f:
+            f.truncate(self._row*self._dtype.itemsize)
+
+class MmapLogReader(object):
+    '''
+    Read-only view of a log written by MmapLog (possibly still being written).
+    log['x'] is a memmap view when the log is a single chunk, otherwise the chunks are concatenated.
+    log['outputs'] returns a dict of the 'outputs/...' columns.
+    '''
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'schema.json'), 'r') as f:
+            schema = json.load(f)
+        assert schema['version'] == schemaVersion, \
+            "log schema version "+str(schema['version'])+", expected "+str(schemaVersion)
+        self.directory = directory
+        self.fields = [(str(name), tuple(shape)) for (name,shape) in schema['fields']]
+        self.meta = schema['meta']
+        self._dtype = _makeDtype(self.fields)
+
+        self._chunks = []
+        k = 0
+        while os.path.exists(os.path.join(directory, _chunkName(k))):
+            filename = os.path.join(directory, _chunkName(k))
+            n = os.path.getsize(filename) / self._dtype.itemsize
+            if n > 0:
+                chunk = numpy.memmap(filename, dtype=self._dtype, mode='r', shape=(n,))
+                valid = chunk['_valid']
+                if not valid[-1]:
+                    # unfinished chunk, count the rows which were written
+                    n = int(numpy.argmin(valid))
+                self._chunks.append(chunk[:n])
+            k += 1
+
+    def __len__(self):
+        return sum([len(c) for c in self._chunks])
+
+    def names(self):
+        return [name for (name,_) in self.fields]
+
+    def _column(self, name):
+        if len(self._chunks) == 1:
+            return self._chunks[0][name]
+        if len(self._chunks) == 0:
+            return numpy.zeros((0,)+dict(self.fields)[name])
+        return numpy.concatenate([c[name] for c in self._chunks])
+
+    def chunks(self, name):
+        '''
+        List of zero-copy views of a column, one per chunk.
+        '''
+        return [c[name] for c in self._chunks]
+
+    def __getitem__(self, name):
+        if name in self.names():
+            return self._column(name)
+        prefix = name+'/'
+        group = dict([(key[len(prefix):], self._column(key))
+                      for key in self.names() if key.startswith(prefix)])
+        if len(group) == 0:
+            raise KeyError(name)
+        return group
+
+    def __contains__(self, name):
+        try:
+            self[name]
+            return True
+        except KeyError:
+            return False
+
+    def timeSeries(self, name, when=0):
+        '''
+        Look name up in the xNames/uNames/outputNames stored in meta
+        and return (time, values). For horizon logs (OcpRT) take node "when".
+        '''
+        ts = self.meta.get('ts', 1.0)
+        if name in self.meta.get('xNames', []):
+            ys = self['x'][..., self.meta['xNames'].index(name)]
+        elif name in self.meta.get('uNames', []):
+            ys = self['u'][..., self.meta['uNames'].index(name)]
+        elif name in self.meta.get('outputNames', []):
+            ys = self['outputs/'+name]
+        else:
+            raise KeyError('"'+name+'" is not a state, control or output in '+self.directory)
+        if ys.ndim > 1:
+            ys = ys[:,when]
+        return (numpy.arange(len(ys))*ts, ys)
+
+def openLog(directory):
+    return MmapLogReader(directory)
@@ -0,0 +1,95 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy
+
+class RingLog(object):
+    '''
+    Fixed capacity log with one preallocated numpy column per name.
+    Once full, the oldest rows are overwritten.
+
+    Names may contain a '/', log['outputs'] then returns a dict of
+    all the 'outputs/...' columns keyed by the rest of the name.
+    groups are the prefixes which give an empty dict when there are no such columns
+    (yet) rather than a KeyError.
+    Columns are allocated on the first append, with the shape of the value appended.
+    '''
+    def __init__(self, capacity, groups=[]):
+        assert capacity > 0, "RingLog capacity must be positive"
+        self.capacity = capacity
+        self.groups = list(groups)
+        self._columns = {}
+        self._head = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def names(self):
+        return sorted(self._columns.keys())
+
+    def clear(self):
+        self._head = 0
+        self._count = 0
+
+    def append(self, values):
+        '''
+        Copy a dict of name:value into the next row.
+        Every append must have the same names and shapes.
+        '''
+        if len(self._columns) == 0:
+            for name,value in values.items():
+                value = numpy.asarray(value, dtype=numpy.double)
+                self._columns[name] = numpy.zeros((self.capacity,)+value.shape)
+        assert len(values) == len(self._columns), \
+            "RingLog.append got names "+str(sorted(values.keys()))+", expected "+str(self.names())
+        for name,value in values.items():
+            self._columns[name][self._head] = value
+        self._head = (self._head + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def _ordered(self, column):
+        if self._count < self.capacity:
+            return column[:self._count]
+        return numpy.concatenate([column[self._head:], column[:self._head]])
+
+    def __getitem__(self, name):
+        '''
+        Return the rows of a column, oldest first.
+        '''
+        if name in self._columns:
+            return self._ordered(self._columns[name])
+        prefix = name+'/'
+        group = dict([(key[len(prefix):], self._ordered(col))
+                      for key,col in self._columns.items() if key.startswith(prefix)])
+        if len(group) == 0 and name not in self.groups:
+            raise KeyError(name)
+        return group
+
+    def __contains__(self, name):
+        try:
+            self[name]
+            return True
+        except KeyError:
+            return False
+
+    def last(self, name):
+        '''
+        Return the most recent row of a column.
+        '''
+        assert self._count > 0, "RingLog is empty"
+        return self._columns[name][(self._head - 1) % self.capacity]
@@ -0,0 +1,90 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Latest-value-wins buffer of one fixed size double vector in shared memory,
+for handing data from a hot loop (e.g. an IPOPT callback) to another process.
+
+The writer never waits: write() copies the vector into the next of a few slots,
+each guarded by a sequence number (a seqlock, odd while the slot is being written),
+then publishes the slot. A reader copies out the latest published slot and retries
+if the writer got to it in the meantime. Values written faster than they are read
+are simply overwritten, only the newest one matters.
+
+Create it before forking (multiprocessing.Process), both sides share the same memory.
+'''
+
+import multiprocessing
+import numpy
+
+class LatestValueBuffer(object):
+    def __init__(self, size, slots=3):
+        assert slots >= 2, "need at least 2 slots so the writer doesn't clobber the latest value"
+        self.size = size
+        self.slots = slots
+        self._data = multiprocessing.RawArray('d', size*slots)
+        self._seqs = multiprocessing.RawArray('L', slots)
+        # latest published slot, then the number of writes so far.
+        # writes publish the slot before bumping the count, so a count always has its slot
+        self._latest = multiprocessing.RawValue('l', -1)
+        self._count = multiprocessing.RawValue('L', 0)
+        self._views = None
+
+    def _slotViews(self):
+        # numpy views made lazily, after a fork each process makes its own
+        if self._views is None:
+            data = numpy.frombuffer(self._data, dtype=numpy.double)
+            self._views = [data[k*self.size:(k+1)*self.size] for k in range(self.slots)]
+        return self._views
+
+    def count(self):
+        return self._count.value
+
+    def write(self, x):
+        '''
+        Copy x (anything numpy can turn into a vector of size doubles) in, never blocks.
+        '''
+        count = self._count.value
+        # never the latest slot, nobody new starts reading this one until it's published
+        slot = count % self.slots
+        self._seqs[slot] += 1
+        self._slotViews()[slot][:] = numpy.ravel(x)
+        self._seqs[slot] += 1
+        self._latest.value = slot
+        self._count.value = count + 1
+
+    def read(self, lastCount=0, out=None):
+        '''
+        Returns (count, copy of the latest vector) if anything was written since lastCount,
+        otherwise (lastCount, None). The copy goes in out if given.
+        '''
+        views = self._slotViews()
+        while True:
+            count = self._count.value
+            if count == lastCount:
+                return (lastCount, None)
+            slot = self._latest.value
+            seq = self._seqs[slot]
+            if seq % 2 == 1:
+                continue
+            if out is None:
+                ret = views[slot].copy()
+            else:
+                out[:] = views[slot]
+                ret = out
+            if self._seqs[slot] == seq:
+                return (count, ret)
@@ -15,6 +15,9 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
 
+import threading
+import traceback
+import numpy
 import zmq
 
 class Communicator(object):
@@ -42,3 +45,114 @@ class Communicator(object):
     def close(self):
         self.publisher.close()
         self.context.term()
+
+class AsyncKitePublisher(object):
+    """
+    Publishes kite states from a background thread so the simulation loop never waits on zeromq.
+
+    names is the order of the values in every frame. Fill publisher.frame (or pass an array
+    to publish) and call publish(), which only copies the frame. If frames come faster than
+    they're sent, the newest one wins. serialize(lookup, messages) makes the zeromq message,
+    lookup(name) gives that name's value in the frame being sent, e.g.
+
+        def serialize(lookup, messages):
+            return autogen.tocarouselProto.toProto(lookup).SerializeToString()
+
+    hwm is the zeromq send high water mark. A PUB socket silently drops what doesn't fit,
+    so those drops can't be seen here: sent counts frames handed to zeromq, dropped only
+    counts frames replaced before they were sent and frames serialize failed on.
+    """
+    def __init__(self, names, serialize, channel='carousel', url="tcp://*:5563", hwm=1):
+        self.names = list(names)
+        self.serialize = serialize
+        self.channel = channel
+        self.url = url
+        self.hwm = hwm
+
+        self._index = dict([(name,k) for k,name in enumerate(self.names)])
+        # the stepping thread writes frame, publish copies it to _pending,
+        # the sender thread swaps _pending with _sending so it never holds the lock while sending
+        self.frame = numpy.zeros(len(self.names))
+        self._pending = numpy.zeros(len(self.names))
+        self._sending = numpy.zeros(len(self.names))
+        self._pendingMessages = []
+        self._fresh = False
+        self._stop = False
+        self._cond = threading.Condition()
+
+        self.published = 0
+        self.sent = 0
+        self.dropped = 0
+
+        self.context = zmq.Context(1)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def publish(self, values=None, messages=[]):
+        """
+        Queue values (default: self.frame) to be sent, replacing anything not sent yet
+        """
+        if values is None:
+            values = self.frame
+        with self._cond:
+            if self._fresh:
+                # the last frame never got out
+                self.dropped += 1
+            self._pending[:] = values
+            self._pendingMessages = messages
+            self._fresh = True
+            self.published += 1
+            self._cond.notify()
+
+    def publishDicts(self, dicts, messages=[]):
+        """
+        Fill the frame from a list of dicts (x, u, p, outputs, ...), names missing from all of them are nan
+        """
+        self.frame[:] = numpy.nan
+        for d in dicts:
+            for name,val in d.items():
+                k = self._index.get(name)
+                if k is not None:
+                    self.frame[k] = val
+        self.publish(messages=messages)
+
+    def _run(self):
+        # zeromq sockets aren't thread safe, this one only lives in this thread
+        publisher = self.context.socket(zmq.PUB)
+        publisher.setsockopt(getattr(zmq, 'SNDHWM', getattr(zmq, 'HWM', None)), self.hwm)
+        publisher.setsockopt(zmq.LINGER, 0)
+        publisher.bind(self.url)
+        index = self._index
+        try:
+            while True:
+                with self._cond:
+                    while not self._fresh and not self._stop:
+                        self._cond.wait()
+                    if self._stop:
+                        return
+                    (self._pending, self._sending) = (self._sending, self._pending)
+                    messages = self._pendingMessages
+                    self._fresh = False
+                values = self._sending
+                try:
+                    msg = self.serialize(lambda name: values[index[name]], messages)
+                except Exception:
+                    # don't let one bad frame kill the publisher
+                    traceback.print_exc()
+                    with self._cond:
+                        self.dropped += 1
+                    continue
+                # PUB never blocks or fails at the high water mark, it drops the message
+                publisher.send_multipart([self.channel, msg], zmq.NOBLOCK)
+                with self._cond:
+                    self.sent += 1
+        finally:
+            publisher.close()
+
+    def close(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        self._thread.join()
+        self.context.term()
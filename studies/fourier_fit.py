@@ -206,9 +206,7 @@ if __name__=='__main__':
     # load saved trajectory
     loadfile = filename+".dat"
     print "loading saved trajectory: "+loadfile
-    f=open(loadfile,'r')
-    traj = pickle.load(f)
-    f.close()
+    traj = rawe.collocation.trajectory.loadTrajectory(loadfile)
     
     # fit everything
     xyzOrders = {'poly':[0],
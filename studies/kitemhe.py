@@ -16,7 +16,7 @@
 # along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
 
 import zmq
-import pickle
+import rawe
 
 import casadi as C
 from casadi import pi
@@ -86,9 +86,7 @@ if __name__=='__main__':
 
     # initial guess
     print "loading trajectory..."
-    f=open('data/crosswind_opt.dat','r')
-    traj = pickle.load(f)
-    f.close()
+    traj = rawe.collocation.trajectory.loadTrajectory('data/crosswind_opt.dat')
     
     for name in dae.xNames():
         for k in range(nk+1):
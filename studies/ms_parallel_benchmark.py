@@ -0,0 +1,86 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Time the multiple shooting constraint function and its jacobian
+for every parallelization mode over a range of nSteps.
+
+usage: OMP_NUM_THREADS=4 python ms_parallel_benchmark.py --nSteps 5 10 20 40 --evals 20
+'''
+
+import sys
+import time
+import numpy
+
+import casadi as C
+
+import rawe
+from rawe.multipleShooting import MultipleShootingStage
+
+integratorOptions = [ ("reltol",1e-7)
+                    , ("abstol",1e-9)
+                    , ("t0",0)
+                    , ("tf",1)
+                    , ("linear_solver_creator",C.CSparse)
+                    , ("linear_solver","user_defined")
+                    ]
+
+def timeEvals(f, x, evals):
+    f.setInput(x)
+    f.evaluate() # warm up
+    t0 = time.time()
+    for k in range(evals):
+        f.setInput(x)
+        f.evaluate()
+    return (time.time() - t0)/evals
+
+def benchmarkStage(nSteps, parallelization, evals):
+    dae = rawe.models.pendulum(nSteps=nSteps)
+    ocp = MultipleShootingStage(dae, nSteps)
+    ocp.setIdasIntegrator(integratorOptions, parallelization=parallelization)
+
+    g = ocp.constraintFun()
+    jac = g.jacobian(0,0)
+    jac.init()
+
+    # somewhere near the pendulum's circle
+    random = numpy.random.RandomState(0)
+    x = 0.1 + 0.01*random.randn(ocp.getDesignVars().size())
+
+    return {'g':timeEvals(g, x, evals), 'jacobian':timeEvals(jac, x, evals)}
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description='multiple shooting parallelization benchmark')
+    parser.add_argument('--nSteps', type=int, nargs='+', default=[5,10,20,40])
+    parser.add_argument('--modes', nargs='+', default=['none','serial','openmp'],
+                        choices=['none','serial','openmp'])
+    parser.add_argument('--evals', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    print '%8s %8s %12s %12s %10s' % ('nSteps', 'mode', 'g [ms]', 'jac [ms]', 'jac speedup')
+    for nSteps in args.nSteps:
+        base = None
+        for mode in args.modes:
+            t = benchmarkStage(nSteps, None if mode == 'none' else mode, args.evals)
+            if base is None:
+                base = t['jacobian']
+            print '%8d %8s %12.2f %12.2f %10.2f' % \
+                (nSteps, mode, 1e3*t['g'], 1e3*t['jacobian'], base/t['jacobian'])
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
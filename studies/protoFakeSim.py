@@ -23,11 +23,7 @@ import rawe
 
 def loadPps(filename):
     print "loading ",filename
-    f=open(filename,'r')
-    traj = pickle.load(f)
-    f.close()
-
-    assert isinstance(traj,rawe.collocation.trajectory.Trajectory), "the file \""+filename+"\" doean't have a pickled Trajectory"
+    traj = rawe.collocation.trajectory.loadTrajectory(filename)
 
 #    h = (traj.tgrid[-1,0,0] - traj.tgrid[0,0,0])/float(traj.dvMap._nk*traj.dvMap._nicp)
 #    h *= traj.dvMap._nk*traj.dvMap._nicp/float(self.nk*self.nicp)